@@ -2,7 +2,16 @@ import tensorflow as tf
 import numpy as np
 import gym
 
-MAX_PIXEL_VALUE = 255.0
+from networks import CNN_SPEC, MLP_SPEC, build_lstm, build_trunks, validate_spec
+
+COMPUTE_DTYPES = {
+    'float32': tf.float32,
+    'float16': tf.float16,
+    'bfloat16': tf.bfloat16,
+}
+# Static loss scale applied when the conv trunk runs in reduced precision, so
+# small gradients of the half precision activations do not flush to zero.
+REDUCED_PRECISION_LOSS_SCALE = 128.0
 
 
 class ActorCritic(object):
@@ -16,11 +25,31 @@ class ActorCritic(object):
       val - values
       lrt - learning rate
       ret - returns
+
+     The hidden layers are described by network_spec (see networks.py),
+     defaulting to the A3C CNN or a 2x64 MLP depending on cnn. The CNN takes
+     uint8 observations and scales them inside the graph. The trunk can run in
+     float16 or bfloat16 (compute_dtype) with float32 master weights; the
+     actor and critic heads always run in float32.
+
+     With an LSTM in the spec, step and train also take the recurrent states
+     and the episode start masks of each environment, and step returns the
+     next states. initial_state is the state of a new episode (None for a feed
+     forward network).
+
+     Histogram summaries are only built when histograms is set, and
+     legacy_graph rebuilds the original graph with L2 regularisers and
+     histograms on every layer.
+
+     hyperparameter_scales multiplies the scheduled learning rate and entropy
+     coefficient, so population based training can perturb them while the
+     schedules keep decaying.
   '''
 
   def __init__(self, sess, obs_space, act_space, cnn, num_policy_updates,
                initial_ent_coeff=0.01, initial_learning_rate=7e-4,
-               decay_ent=True):
+               decay_ent=True, compute_dtype='float32', network_spec=None,
+               histograms=False, legacy_graph=False, max_grad_norm=1.0):
     lrt_scheduler = Scheduler(initial_learning_rate, 0, num_policy_updates)
     if decay_ent:
       ent_scheduler = Scheduler(
@@ -32,66 +61,101 @@ class ActorCritic(object):
 
     act_dim = act_space.n if discrete else act_space.shape[0]
 
+    if network_spec is None:
+      network_spec = CNN_SPEC if cnn else MLP_SPEC
+    network_spec = validate_spec(network_spec)
+    lstm_units = network_spec['lstm']
+
     with tf.name_scope('inputs'):
       adv, obs, act, ret, lrt, ent_coeff = _create_input_placeholders(
-          act_dim, obs_space, discrete, cnn)
+          act_dim, obs_space, discrete, cnn, histograms or legacy_graph)
+      if lstm_units:
+        states = tf.placeholder(
+            dtype=tf.float32, shape=[None, 2 * lstm_units], name='states')
+        masks = tf.placeholder(dtype=tf.float32, shape=[None], name='masks')
+
+    compute_dtype = COMPUTE_DTYPES[compute_dtype]
+    loss_scale = 1.0 if compute_dtype == tf.float32 \
+        else REDUCED_PRECISION_LOSS_SCALE
+
+    histograms = histograms or legacy_graph
+    regularizer = tf.nn.l2_loss if legacy_graph else None
 
     with tf.name_scope('hidden'):
-      if cnn:
-        hidden = _build_cnn(obs)
-      else:
-        hidden = _build_mlp(obs)
-      tf.summary.histogram('hidden_output', hidden)
+      actor_hidden, critic_hidden = build_trunks(
+          obs, network_spec, compute_dtype, histograms, legacy_graph)
+      if lstm_units:
+        actor_hidden, final_states = build_lstm(
+            actor_hidden, states, masks, lstm_units)
+        critic_hidden = actor_hidden
+      if histograms:
+        tf.summary.histogram('hidden_output', actor_hidden)
 
     with tf.name_scope('actor'):
       if discrete:
         act_logits = tf.layers.dense(
-            inputs=hidden, units=act_dim, activation=tf.nn.relu,
+            inputs=actor_hidden, units=act_dim, activation=tf.nn.relu,
             use_bias=True, bias_initializer=tf.zeros_initializer(),
             kernel_initializer=tf.glorot_normal_initializer(),
-            kernel_regularizer=tf.nn.l2_loss)
-        tf.summary.histogram('act_logits', act_logits)
+            kernel_regularizer=regularizer)
+        if histograms:
+          tf.summary.histogram('act_logits', act_logits)
       else:
         act_mean = tf.layers.dense(
-            inputs=hidden, units=act_dim, activation=None,
+            inputs=actor_hidden, units=act_dim, activation=None,
             kernel_initializer=tf.glorot_normal_initializer(),
             bias_initializer=tf.zeros_initializer(), name='mean')
-        tf.summary.histogram('mean', act_mean)
+        if histograms:
+          tf.summary.histogram('mean', act_mean)
 
         # Standard deviation of the normal distribution over actions
         act_std_dev = tf.get_variable(
             name="act_std_dev", shape=[act_dim],
             dtype=tf.float32, initializer=tf.ones_initializer())
         act_std_dev = tf.nn.softplus(act_std_dev) + 1e-4
-        tf.summary.scalar('act_std_dev', tf.squeeze(act_std_dev))
+        tf.summary.scalar('act_std_dev', tf.reduce_mean(act_std_dev))
 
       with tf.name_scope('sample_action'):
         if discrete:
           dist = tf.distributions.Categorical(
               logits=act_logits, name='categorical_dist')
           sample_act = dist.sample()
+          greedy_act = tf.argmax(act_logits, axis=1, output_type=tf.int32)
         else:
           dist = tf.contrib.distributions.MultivariateNormalDiag(
               loc=act_mean, scale_diag=act_std_dev,
               name='multivariate_gaussian_dist')
           sample_act = _generate_bounded_continuous_sample_action(
               dist, act_space)
+          greedy_act = _squash_action(act_mean, act_space)
 
-        tf.summary.histogram('sample_action', sample_act)
+        if histograms:
+          tf.summary.histogram('sample_action', sample_act)
 
       with tf.name_scope('log_prob'):
-        log_prob = dist.log_prob(act, name='log_prob')
-        tf.summary.histogram('log_prob', log_prob)
+        if discrete:
+          # One log probability per sample; the [None, 1] placeholder would
+          # broadcast against the batch of distributions
+          log_prob = dist.log_prob(act[:, 0], name='log_prob')
+          sample_log_prob = dist.log_prob(sample_act)
+        else:
+          log_prob = _squashed_log_prob(dist, act, act_space)
+          sample_log_prob = _squashed_log_prob(dist, sample_act, act_space)
+        if histograms:
+          tf.summary.histogram('log_prob', log_prob)
 
       with tf.name_scope('entropy'):
+        # For continuous actions this is the entropy of the Gaussian before
+        # squashing, as the squashed distribution has no closed form
         ent = tf.reduce_mean(dist.entropy())
         tf.summary.scalar('actor_entropy', ent)
 
     with tf.name_scope('critic'):
       critic_prediction = tf.squeeze(tf.layers.dense(
-          inputs=hidden, units=1, kernel_regularizer=tf.nn.l2_loss,
+          inputs=critic_hidden, units=1, kernel_regularizer=regularizer,
           kernel_initializer=tf.glorot_normal_initializer()))
-      tf.summary.histogram('critic_prediction', critic_prediction)
+      if histograms:
+        tf.summary.histogram('critic_prediction', critic_prediction)
 
     with tf.name_scope('loss'):
       # Minimising negative equivalent to maximising
@@ -113,48 +177,128 @@ class ActorCritic(object):
 
     with tf.name_scope('train'):
       optimizer = tf.train.AdamOptimizer(learning_rate=lrt, epsilon=1e-5)
-      grads_and_vars = optimizer.compute_gradients(total_loss)
-      grads_and_vars = _clip_by_global_norm(grads_and_vars)
+      grads_and_vars = optimizer.compute_gradients(total_loss * loss_scale)
+      if loss_scale != 1.0:
+        grads_and_vars = [(grad / loss_scale, var)
+                          for grad, var in grads_and_vars if grad is not None]
+      grads_and_vars = _clip_by_global_norm(grads_and_vars, max_grad_norm)
+      global_step = tf.train.get_or_create_global_step()
       train_op = optimizer.apply_gradients(
-          grads_and_vars, global_step=tf.train.get_or_create_global_step())
+          grads_and_vars, global_step=global_step)
+      # The step after this update, read in the same run as the update so the
+      # schedules need no extra session call
+      with tf.control_dependencies([train_op]):
+        next_global_step = tf.identity(global_step)
+
+    with tf.name_scope('params'):
+      params = tf.trainable_variables()
+      param_names = [param.name for param in params]
+      param_placeholders = [
+          tf.placeholder(dtype=param.dtype.base_dtype, shape=param.shape)
+          for param in params]
+      assign_params = tf.group(*[
+          tf.assign(param, placeholder)
+          for param, placeholder in zip(params, param_placeholders)])
 
     summaries = tf.summary.merge_all()
+    # The global step for the next update, None until it is read from the
+    # session (after initialisation or restoring a checkpoint)
+    cached_global_step = [None]
+    hyperparameter_scales = {'learning_rate': 1.0, 'ent_coeff': 1.0}
 
-    def step(observations):
+    def step(observations, recurrent_states=None, episode_starts=None,
+             with_log_probs=False):
       ''' Output actions and values for observations.
 
       # Params
         observations: List of observed states
+        recurrent_states: LSTM states for each environment
+        episode_starts: Flags for the environments starting a new episode
+        with_log_probs: Also return the log probabilities of the actions
 
       # Returns
+        actions: The sampled actions
         values: The predicted values of the states
+        recurrent_states: The LSTM states after the observations, None for a
+            feed forward network
+        log_probs: The log probabilities of the actions, only if
+            with_log_probs
       '''
       feed_dict = {obs: observations}
-      actions, values = sess.run(
-          [sample_act, critic_prediction], feed_dict=feed_dict)
-      return actions, values
+      fetches = [sample_act, critic_prediction]
+      if lstm_units:
+        feed_dict[states] = recurrent_states
+        feed_dict[masks] = episode_starts
+        fetches.append(final_states)
+      if with_log_probs:
+        fetches.append(sample_log_prob)
+
+      results = sess.run(fetches, feed_dict=feed_dict)
+      if not lstm_units:
+        results.insert(2, None)
+      return tuple(results)
+
+    def value(observations):
+      ''' Predict the values of observations. '''
+      return sess.run(critic_prediction, feed_dict={obs: observations})
+
+    def embed(observations, recurrent_states=None, episode_starts=None):
+      ''' The actor's last hidden layer activations for observations, e.g.
+          for embedding analysis (see embedding_analysis.py).
 
-    def train(observations, returns, actions, values):
+      # Returns
+        embeddings: The activations, dimension (batch, hidden_dim)
+        values: The predicted values of the observations
+      '''
+      feed_dict = {obs: observations}
+      if lstm_units:
+        feed_dict[states] = recurrent_states
+        feed_dict[masks] = episode_starts
+      return sess.run([actor_hidden, critic_prediction], feed_dict=feed_dict)
+
+    def evaluate_actions(observations, actions):
+      ''' The current policy's log probabilities of actions taken in
+          observations, and the values of the observations.
+      '''
+      return sess.run([log_prob, critic_prediction],
+                      feed_dict={obs: observations, act: actions})
+
+    def train(observations, returns, actions, values, summarise=False,
+              recurrent_states=None, episode_starts=None, run_metadata=None,
+              advantages=None):
       ''' Train the value function and policy.
 
       # Params
-        observations:   List of observed states
-        returns:        List of observed returns
-        actions:        List of actions taken
-        values:         List of values
+        observations:     List of observed states
+        returns:          List of observed returns
+        actions:          List of actions taken
+        values:           List of values
+        summarise:        Also evaluate the merged summaries
+        recurrent_states: LSTM states of each environment at the start of the
+                          rollout
+        episode_starts:   Flags for the steps starting a new episode
+        run_metadata:     A tf.RunMetadata to record a full trace of the
+                          update into
+        advantages:       Advantages to use instead of returns - values, for
+                          off-policy corrected updates
 
       # Returns
         pg_loss:              The policy gradient loss
         val_loss:             The critic loss
         explore_loss:         The actor exploration loss
-        regularization_loss:  The regularization loss
         ent:                  The policy entropy
+        summary:              The serialised summaries, None unless summarise
       '''
-      advantages = returns - values
+      if advantages is None:
+        advantages = returns - values
 
-      global_step = tf.train.get_or_create_global_step().eval(session=sess)
-      current_lrt = lrt_scheduler.current_value(global_step)
-      current_ent_coeff = ent_scheduler.current_value(global_step)
+      if cached_global_step[0] is None:
+        cached_global_step[0] = sess.run(global_step)
+      current_step = cached_global_step[0]
+      current_lrt = lrt_scheduler.current_value(current_step) \
+          * hyperparameter_scales['learning_rate']
+      current_ent_coeff = ent_scheduler.current_value(current_step) \
+          * hyperparameter_scales['ent_coeff']
 
       feed_dict = {
           obs: observations,
@@ -164,95 +308,137 @@ class ActorCritic(object):
           lrt: current_lrt,
           ent_coeff: current_ent_coeff
       }
+      if lstm_units:
+        feed_dict[states] = recurrent_states
+        feed_dict[masks] = episode_starts
 
-      _, pg_loss, val_loss, expl_loss, entropy, summary = \
-          sess.run([train_op, actor_pg_loss, critic_loss,
-                    actor_explore_loss, ent, summaries],
-                   feed_dict=feed_dict)
+      fetches = [next_global_step, actor_pg_loss, critic_loss,
+                 actor_explore_loss, ent]
+      if summarise and summaries is not None:
+        fetches.append(summaries)
+
+      if run_metadata is None:
+        results = sess.run(fetches, feed_dict=feed_dict)
+      else:
+        results = sess.run(
+            fetches, feed_dict=feed_dict,
+            options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            run_metadata=run_metadata)
+      cached_global_step[0] = results[0]
+      pg_loss, val_loss, expl_loss, entropy = results[1:5]
+      summary = results[5] if len(results) > 5 else None
 
       return pg_loss, val_loss, expl_loss, entropy, summary
 
     def reset():
       ''' Reset the policy. '''
       sess.run(tf.global_variables_initializer())
+      cached_global_step[0] = None
 
+    def get_params():
+      ''' Snapshot the trainable variables.
+
+      # Returns
+        params (dict): Variable values keyed by variable name
+      '''
+      return dict(zip(param_names, sess.run(params)))
+
+    def set_params(values):
+      ''' Load a snapshot from get_params, possibly taken from another
+          ActorCritic with the same network.
+      '''
+      feed_dict = {placeholder: values[name] for name, placeholder
+                   in zip(param_names, param_placeholders)}
+      sess.run(assign_params, feed_dict=feed_dict)
+
+    def sync_global_step():
+      ''' Re-read the global step, after variables are restored outside the
+          model.
+      '''
+      cached_global_step[0] = None
+
+    # The observation to action and value path, for exporting the policy
+    # without the training graph (see export_policy.py)
+    self.inference_tensors = {
+        'observations': obs,
+        'actions': sample_act,
+        'greedy_actions': greedy_act,
+        'values': critic_prediction,
+    }
+    if lstm_units:
+      self.inference_tensors.update(
+          {'states': states, 'masks': masks, 'next_states': final_states})
+
+    self.initial_state = np.zeros(2 * lstm_units, dtype=np.float32) \
+        if lstm_units else None
+    self.hyperparameter_scales = hyperparameter_scales
     self.reset = reset
+    self.sync_global_step = sync_global_step
+    self.get_params = get_params
+    self.set_params = set_params
     self.train = train
     self.step = step
+    self.value = value
+    self.embed = embed
+    self.evaluate_actions = evaluate_actions
 
     self.reset()
 
 
 def _generate_bounded_continuous_sample_action(dist, ac_space):
-  # TODO: This currently is only suitable for scalar actions. Generalise for
-  #      arbitrary dimensions.
-  bounded_sample = tf.nn.tanh(dist.sample(), name='sample_action')
-  scaled_shifted_sample = bounded_sample \
-      * (ac_space.high[0]-ac_space.low[0]) * 0.5 \
-      + (ac_space.high[0]+ac_space.low[0]) * 0.5
-  tf.summary.histogram('sample_action', scaled_shifted_sample)
-  return scaled_shifted_sample
-
-
-def _build_mlp(input_placeholder, n_layers=2,
-               size=64, activation=tf.nn.relu):
-  hidden = input_placeholder
-  for i in range(n_layers):
-    hidden = tf.layers.dense(
-        inputs=hidden, units=size, activation=activation,
-        name="dense_{}".format(i), use_bias=True,
-        bias_initializer=tf.zeros_initializer(),
-        kernel_initializer=tf.glorot_normal_initializer(),
-        kernel_regularizer=tf.nn.l2_loss)
-
-    tf.summary.histogram('dense{0}_activation'.format(i), hidden)
-
-  return hidden
-
-
-def _build_cnn(input_placeholder):
-  # The CNN architecture as described in the A3C Paper
-  scaled_obs = tf.cast(input_placeholder, tf.float32) / MAX_PIXEL_VALUE
-
-  conv1 = tf.layers.conv2d(
-      inputs=scaled_obs,
-      filters=16,
-      kernel_size=[8, 8],
-      strides=[4, 4],
-      padding="same",
-      activation=tf.nn.relu,
-      kernel_initializer=tf.glorot_normal_initializer(),
-      use_bias=True,
-      bias_initializer=tf.zeros_initializer(),
-      data_format='channels_last',
-      name='conv_1',
-      kernel_regularizer=tf.nn.l2_loss)
-  tf.summary.histogram('conv_1', conv1)
-
-  conv2 = tf.layers.conv2d(
-      inputs=conv1,
-      filters=32,
-      kernel_size=[4, 4],
-      strides=[2, 2],
-      padding="same",
-      activation=tf.nn.relu,
-      kernel_initializer=tf.glorot_normal_initializer(),
-      use_bias=True,
-      bias_initializer=tf.zeros_initializer(),
-      data_format='channels_last',
-      name='conv_2',
-      kernel_regularizer=tf.nn.l2_loss)
-  tf.summary.histogram('conv_2', conv2)
-
-  flattened = tf.layers.flatten(conv2)
-
-  dense = tf.layers.dense(
-      inputs=flattened, units=256, activation=tf.nn.relu, name="conv_fc",
-      kernel_initializer=tf.glorot_normal_initializer(), use_bias=True,
-      bias_initializer=tf.zeros_initializer(),
-      kernel_regularizer=tf.nn.l2_loss)
-
-  return dense
+  return _squash_action(dist.sample(), ac_space)
+
+
+def _squash_action(raw_action, ac_space):
+  # Squash each bounded dimension of a Gaussian action into [low, high]
+  # with tanh. Dimensions without finite bounds are left as they are.
+  bounded, scale, shift = _squash_bounds(ac_space)
+  squashed_action = tf.nn.tanh(raw_action) * scale + shift
+
+  if np.all(bounded):
+    return squashed_action
+  if not np.any(bounded):
+    return raw_action
+  mask = bounded.astype(np.float32)
+  return mask * squashed_action + (1.0 - mask) * raw_action
+
+
+def _squashed_log_prob(dist, actions, ac_space, epsilon=1e-6):
+  # Log probability of actions sampled by
+  # _generate_bounded_continuous_sample_action. The bounded dimensions are
+  # mapped back through atanh and corrected by the log determinant of the
+  # squashing Jacobian, log(scale) + log(1 - tanh(x)^2).
+  bounded, scale, shift = _squash_bounds(ac_space)
+  if not np.any(bounded):
+    return dist.log_prob(actions, name='log_prob')
+
+  mask = bounded.astype(np.float32)
+  # Keep away from +-1, where atanh is infinite
+  unit_actions = tf.clip_by_value(
+      (actions - shift) / scale, -1.0 + epsilon, 1.0 - epsilon)
+  raw_actions = 0.5 * (tf.log1p(unit_actions) - tf.log1p(-unit_actions))
+  raw_actions = mask * raw_actions + (1.0 - mask) * actions
+
+  # log(1 - tanh(x)^2) = 2 (log(2) - x - softplus(-2x)), which does not
+  # underflow for large |x|
+  log_det_jacobian = mask * (
+      np.log(scale) + 2.0 * (np.log(2.0) - raw_actions
+                             - tf.nn.softplus(-2.0 * raw_actions)))
+
+  return tf.subtract(dist.log_prob(raw_actions),
+                     tf.reduce_sum(log_det_jacobian, axis=1), name='log_prob')
+
+
+def _squash_bounds(ac_space):
+  # Per dimension bounds of a Box action space as a tanh scale and shift,
+  # with scale 1 and shift 0 for dimensions without finite bounds
+  low = np.asarray(ac_space.low, dtype=np.float64)
+  high = np.asarray(ac_space.high, dtype=np.float64)
+  bounded = np.isfinite(low) & np.isfinite(high)
+  with np.errstate(invalid='ignore'):
+    scale = np.where(bounded, (high - low) * 0.5, 1.0).astype(np.float32)
+    shift = np.where(bounded, (high + low) * 0.5, 0.0).astype(np.float32)
+  return bounded, scale, shift
 
 
 def _clip_by_global_norm(grads_and_vars, norm=1.0):
@@ -261,7 +447,7 @@ def _clip_by_global_norm(grads_and_vars, norm=1.0):
   return zip(clipped_grads, variables)
 
 
-def _create_input_placeholders(act_dim, obs_space, discrete, cnn):
+def _create_input_placeholders(act_dim, obs_space, discrete, cnn, histograms):
   if discrete:
     act = tf.placeholder(dtype=tf.int32, shape=[None, 1], name='act')
   else:
@@ -282,14 +468,15 @@ def _create_input_placeholders(act_dim, obs_space, discrete, cnn):
   tf.summary.scalar('lrt', lrt)
   tf.summary.scalar('ent_coeff', ent_coeff)
 
-  tf.summary.histogram('adv', adv)
-  tf.summary.histogram('ret', ret)
-  tf.summary.histogram('act', act)
+  if histograms:
+    tf.summary.histogram('adv', adv)
+    tf.summary.histogram('ret', ret)
+    tf.summary.histogram('act', act)
 
-  if cnn:
-    tf.summary.image('obs', obs)
-  else:
-    tf.summary.histogram('obs', obs)
+    if cnn:
+      tf.summary.image('obs', obs)
+    else:
+      tf.summary.histogram('obs', obs)
 
   return adv, obs, act, ret, lrt, ent_coeff
 
@@ -5,36 +5,82 @@ import multiprocessing
 
 import numpy as np
 import tensorflow as tf
-from tensorflow.python import debug as tf_debug
 from baselines import logger
 from baselines.common import set_global_seeds
 
 from a2c import ActorCritic
+from a2c_evaluator import AsyncEvaluator
 from a2c_runner import A2CRunner
+from checkpoint_manager import CHECKPOINT_SUFFIX, CheckpointManager
+from metrics_log import MetricsLogWriter
+from profiling import PhaseTimer, stats_summary, write_timeline
+from replay import RolloutBuffer, vtrace
+from weight_history import DEFAULT_PATTERNS, WeightHistoryWriter, select_names
 
 INFO_ALE_LIVES_KEY = 'ale.lives'
 
 
 class A2CAgent(object):
+  ''' Trains an ActorCritic on vectorised environments.
+
+      If eval_env_fn is given, the policy is evaluated every save_every
+      updates on num_eval_episodes episodes in a separate process (see
+      AsyncEvaluator) instead of synchronously on eval_env.
+
+      The time spent in each phase of an update, steps per second and frames
+      per second (steps times frames_per_step) are logged with every summary.
+      Every trace_every updates (if set) the training run is traced and a
+      Chrome timeline is written to the model directory.
+
+      The losses of every update, every finished training episode and every
+      evaluation are streamed into metrics logs (see metrics_log.py) under
+      <model_dir>/metrics/train, episodes and eval, indexed by the total
+      number of environment steps.
+
+      With replay_rollouts set, the last replay_rollouts rollouts are kept
+      with the log probabilities of the policy that collected them, and after
+      each collection the learner makes replay_epochs passes over all of them
+      using V-trace corrected returns (see replay.vtrace), so it performs
+      several updates per batch of environment steps.
+
+      inter_op_threads and intra_op_threads size the session's thread pools,
+      all cores if 0 (see resource_planner for splitting the cores with the
+      env workers). The evaluation process and its envs run on eval_cpus if
+      given, by default on the cores of the thread creating the agent.
+
+      Selected weight tensors are recorded in a weight history (see
+      weight_history.py) under <model_dir>/weights by snapshot_weights, and
+      every weight_history_every updates if set.
+  '''
   def __init__(self, train_envs, eval_env, model_dir, n_steps, debug, gamma, cnn,
                summary_every, num_learning_steps, seed, tensorboard_summaries,
-               save_every, load_checkpoint, checkpoint_prefix):
+               save_every, load_checkpoint, checkpoint_prefix,
+               compute_dtype='float32', network_spec=None, histograms=False,
+               eval_env_fn=None, num_eval_episodes=8, max_checkpoints=5,
+               frames_per_step=1, trace_every=0, replay_rollouts=0,
+               replay_epochs=1, vtrace_rho_max=1.0, vtrace_c_max=1.0,
+               inter_op_threads=0, intra_op_threads=0, weight_history_every=0,
+               weight_history_patterns=None, eval_cpus=None):
     discrete = isinstance(train_envs.action_space, gym.spaces.Discrete)
 
     num_cpu = multiprocessing.cpu_count()
     tf_config = tf.ConfigProto(
-        inter_op_parallelism_threads=num_cpu,
-        intra_op_parallelism_threads=num_cpu)
+        inter_op_parallelism_threads=inter_op_threads or num_cpu,
+        intra_op_parallelism_threads=intra_op_threads or num_cpu)
     self._sess = tf.Session(config=tf_config)
-    self._saver = None
 
     self._step = 0
     self._summary_every = summary_every
     self._save_every = save_every
     self._seed = seed
+    self._frames_per_step = frames_per_step
+    self._trace_every = trace_every
+    self._timer = PhaseTimer()
 
-    # Wrap the session in a CLI debugger
+    # Wrap the session in a CLI debugger, only imported when asked for as it
+    # pulls in the debugger's UI
     if debug:
+      from tensorflow.python import debug as tf_debug
       self._sess = tf_debug.LocalCLIDebugWrapperSession(self._sess)
 
     self._model_dir = model_dir+'/model'
@@ -45,13 +91,35 @@ class A2CAgent(object):
     batch_size = n_steps*train_envs.num_envs
     self._num_policy_updates = num_learning_steps//batch_size
 
+    self._gamma = gamma
+    self._n_envs = train_envs.num_envs
+    self._replay_epochs = replay_epochs
+    self._vtrace_rho_max = vtrace_rho_max
+    self._vtrace_c_max = vtrace_c_max
+    self._replay = None
+    updates_per_rollout = 1
+    if replay_rollouts:
+      if network_spec is not None and network_spec.get('lstm'):
+        raise ValueError('Experience replay is not supported for recurrent '
+                         'policies')
+      self._replay = RolloutBuffer(replay_rollouts)
+      updates_per_rollout = replay_rollouts * replay_epochs
+
+    model_kwargs = {
+        'obs_space': train_envs.observation_space,
+        'act_space': train_envs.action_space,
+        'cnn': cnn,
+        'compute_dtype': compute_dtype,
+        'network_spec': network_spec,
+    }
     self._actor_critic = ActorCritic(
-        sess=self._sess, obs_space=train_envs.observation_space, cnn=cnn,
-        act_space=train_envs.action_space,
-        num_policy_updates=self._num_policy_updates)
+        sess=self._sess,
+        num_policy_updates=self._num_policy_updates*updates_per_rollout,
+        histograms=histograms, **model_kwargs)
     self._runner = A2CRunner(
         actor_critic=self._actor_critic, env=train_envs, n_steps=n_steps,
-        gamma=gamma, discrete=discrete)
+        gamma=gamma, discrete=discrete, timer=self._timer,
+        record_log_probs=self._replay is not None)
 
     if self._tensorboard_summaries:
       self._summary_writer = tf.summary.FileWriter(model_dir)
@@ -61,31 +129,86 @@ class A2CAgent(object):
     if not self._graph_initialized():
       raise Exception('Graph not initialised!')
 
+    self._checkpoints = CheckpointManager(
+        self._sess, self._model_dir, max_to_keep=max_checkpoints)
+
+    metrics_dir = os.path.join(model_dir, 'metrics')
+    self._train_log = MetricsLogWriter(os.path.join(metrics_dir, 'train'))
+    self._episode_log = MetricsLogWriter(
+        os.path.join(metrics_dir, 'episodes'))
+    self._eval_log = MetricsLogWriter(os.path.join(metrics_dir, 'eval'))
+    self._total_timesteps = 0
+
+    self._weight_history_dir = os.path.join(model_dir, 'weights')
+    self._weight_history_every = weight_history_every
+    self._weight_history_patterns = weight_history_patterns or DEFAULT_PATTERNS
+    self._weight_history = None
+
     if load_checkpoint:
       self.load(checkpoint_prefix)
 
+    self._evaluator = None
+    if eval_env_fn is not None:
+      self._evaluator = AsyncEvaluator(
+          eval_env_fn, model_kwargs, num_eval_episodes, cpus=eval_cpus)
+
   def load(self, checkpoint_file_prefix):
     ''' Load a trained model from saved checkpoint files.
 
       # Params:
-        checkpoint_file_prefix (str): The prefix of all checkpoint files to
-            load. This is not an actual file. Example, if checkpoint files are
+        checkpoint_file_prefix (str): An .npz checkpoint written by save_model,
+            or the prefix of all files of a tf.train.Saver checkpoint. The
+            prefix is not an actual file. Example, if checkpoint files are
             stored in directory /tmp/checkpoint_files and all 3 files begin with
             'model' then provide '/tmp/checkpoint_files/model'.
 
     '''
-    saver = tf.train.Saver()
-    saver.restore(self._sess, checkpoint_file_prefix)
+    if checkpoint_file_prefix.endswith(CHECKPOINT_SUFFIX):
+      self._checkpoints.restore(checkpoint_file_prefix)
+    else:
+      saver = tf.train.Saver()
+      saver.restore(self._sess, checkpoint_file_prefix)
+    self._actor_critic.sync_global_step()
+
+  def snapshot_weights(self, patterns=None):
+    ''' Record the current values of the trainable variables whose names
+        match any of the regular expression patterns (the agent's
+        weight_history_patterns by default) in the weight history, at the
+        current update.
+
+      # Returns
+        names ([str]): The variables recorded.
+    '''
+    variables = {variable.name: variable
+                 for variable in tf.trainable_variables()}
+    names = select_names(sorted(variables),
+                         patterns or self._weight_history_patterns)
+    if not names:
+      return []
+    if self._weight_history is None:
+      self._weight_history = WeightHistoryWriter(self._weight_history_dir)
+    values = self._sess.run([variables[name] for name in names])
+    self._weight_history.append(self._step, dict(zip(names, values)))
+    return names
 
   def evaluate(self):
     ''' Evaluate a learned model by rolling out the policy. '''
     obs = self._eval_env.reset()
+    states = None
+    if self._actor_critic.initial_state is not None:
+      states = np.tile(self._actor_critic.initial_state,
+                       (self._eval_env.num_envs, 1))
+    episode_starts = np.ones(self._eval_env.num_envs, dtype=np.float32)
 
     while True:
-      actions, _ = self._actor_critic.step(obs)
-      obs, _, _, info = self._eval_env.step(actions)
-
-      if info[0][INFO_ALE_LIVES_KEY] < 1:
+      actions, _, states = self._actor_critic.step(
+          obs, states, episode_starts)
+      obs, _, dones, info = self._eval_env.step(actions)
+      episode_starts = dones.astype(np.float32)
+
+      # Atari games end when the last life is lost, other environments when
+      # they are done
+      if dones[0] and info[0].get(INFO_ALE_LIVES_KEY, 0) < 1:
         break
 
   def learn(self):
@@ -93,59 +216,195 @@ class A2CAgent(object):
         interacting with the environment.
     '''
     set_global_seeds(self._seed)
-    total_timesteps = 0
     start_time = time.time()
 
     try:
       for self._step in range(self._num_policy_updates):
         summarise = self._step % self._summary_every == 0
 
-        returns, actions, observations, values = \
-            self._runner.generate_rollouts()
+        rollout = self._runner.generate_rollouts()
 
-        total_timesteps += returns.shape[0]
+        self._total_timesteps += rollout.returns.shape[0]
         n_seconds = time.time()-start_time
 
-        pg_loss, val_loss, expl_loss, ent, summary = self._actor_critic.train(
-            observations, returns, actions, values)
+        if self._evaluator is not None:
+          with self._timer.phase('eval'):
+            for stats in self._evaluator.poll():
+              self._log_evaluation(stats)
+
+        run_metadata = None
+        if self._trace_every and self._step > 0 \
+            and self._step % self._trace_every == 0:
+          run_metadata = tf.RunMetadata()
+
+        if self._replay is None:
+          with self._timer.phase('train'):
+            pg_loss, val_loss, expl_loss, ent, summary = \
+                self._actor_critic.train(
+                    rollout.observations, rollout.returns, rollout.actions,
+                    rollout.values,
+                    summarise=summarise and self._tensorboard_summaries,
+                    recurrent_states=rollout.recurrent_states,
+                    episode_starts=rollout.episode_starts,
+                    run_metadata=run_metadata)
+        else:
+          pg_loss, val_loss, expl_loss, ent, summary = self._train_replay(
+              rollout, summarise and self._tensorboard_summaries,
+              run_metadata)
+
+        if run_metadata is not None:
+          self._write_trace(run_metadata)
+
+        if self._weight_history_every \
+            and self._step % self._weight_history_every == 0:
+          with self._timer.phase('checkpoint'):
+            self.snapshot_weights()
+
+        self._train_log.append(
+            self._total_timesteps, update=self._step, pg_loss=pg_loss,
+            val_loss=val_loss, expl_loss=expl_loss, entropy=ent)
+        for episode_return, episode_length in self._runner.pop_episodes():
+          self._episode_log.append(
+              self._total_timesteps, episode_return=episode_return,
+              episode_length=episode_length)
+
+        if self._step % self._save_every == 0 and self._step > 0:
+          with self._timer.phase('eval'):
+            if self._evaluator is not None:
+              self._evaluator.submit(
+                  self._actor_critic.get_params(), self._step)
+            else:
+              self.evaluate()
+          with self._timer.phase('checkpoint'):
+            self.save_model()
 
         if summarise:
-          logger.record_tabular('seconds', n_seconds)
-          logger.record_tabular('step', self._step)
-          logger.record_tabular('total_timesteps', total_timesteps)
-          logger.record_tabular('pg_loss', pg_loss)
-          logger.record_tabular('expl_loss', expl_loss)
-          logger.record_tabular('val_loss', val_loss)
-          logger.record_tabular('entropy', ent)
-          logger.dump_tabular()
-
-          if self._tensorboard_summaries:
-            self._summary_writer.add_summary(summary, self._step)
+          with self._timer.phase('summaries'):
+            if self._tensorboard_summaries:
+              self._summary_writer.add_summary(summary, self._step)
+            self._train_log.flush()
+            self._episode_log.flush()
+            if self._weight_history is not None:
+              self._weight_history.flush()
+
+        # Ended after everything done for the update, so each report's phase
+        # times describe the updates they are divided by
+        self._timer.end_update(rollout.returns.shape[0])
 
-        if self._step % self._save_every == 0 and self._step > 0:
-          self.evaluate()
-          self.save_model()
+        if summarise:
+          timings = self._timer.report(self._frames_per_step)
+          # Writing the report itself falls in the next interval
+          with self._timer.phase('summaries'):
+            for key in sorted(timings.keys()):
+              logger.record_tabular(key, timings[key])
+            logger.record_tabular('seconds', n_seconds)
+            logger.record_tabular('step', self._step)
+            logger.record_tabular('total_timesteps', self._total_timesteps)
+            logger.record_tabular('pg_loss', pg_loss)
+            logger.record_tabular('expl_loss', expl_loss)
+            logger.record_tabular('val_loss', val_loss)
+            logger.record_tabular('entropy', ent)
+            logger.dump_tabular()
+            if self._tensorboard_summaries:
+              self._summary_writer.add_summary(
+                  stats_summary(timings, 'profile'), self._step)
     finally:
       # Save out necessary checkpoints & diagnostics
       self._close()
 
+  def _train_replay(self, rollout, summarise, run_metadata):
+    ''' Add rollout to the replay buffer and make replay_epochs passes over
+        the buffer, one V-trace corrected update per stored rollout. Only the
+        first update is summarised and traced.
+    '''
+    self._replay.add(rollout)
+    rhos = []
+    first_result = None
+
+    for _ in range(self._replay_epochs):
+      for stored in self._replay.rollouts():
+        with self._timer.phase('replay'):
+          target_log_probs, values = self._actor_critic.evaluate_actions(
+              stored.observations, stored.actions)
+          bootstrap_values = self._actor_critic.value(
+              stored.bootstrap_observations)
+          vs, advantages, stored_rhos = vtrace(
+              stored.log_probs.reshape(self._n_envs, -1),
+              target_log_probs.reshape(self._n_envs, -1),
+              stored.rewards, stored.dones,
+              values.reshape(self._n_envs, -1), bootstrap_values,
+              self._gamma, self._vtrace_rho_max, self._vtrace_c_max)
+          rhos.append(stored_rhos)
+
+        with self._timer.phase('train'):
+          result = self._actor_critic.train(
+              stored.observations, vs.flatten(), stored.actions,
+              values, summarise=summarise and first_result is None,
+              run_metadata=run_metadata if first_result is None else None,
+              advantages=advantages.flatten())
+        if first_result is None:
+          first_result = result
+
+    logger.record_tabular('replay_rho_mean', np.mean(rhos))
+    return first_result
+
   def reset_actor_critic(self):
     self._actor_critic.reset()
 
+  def _write_trace(self, run_metadata):
+    write_timeline(run_metadata, os.path.join(
+        self._model_dir, 'timeline_{}.json'.format(self._step)))
+    if self._tensorboard_summaries:
+      self._summary_writer.add_run_metadata(
+          run_metadata, 'step_{}'.format(self._step), self._step)
+
+  def _log_evaluation(self, stats):
+    self._checkpoints.report_metric(stats['step'], stats['return_mean'])
+
+    for key in sorted(stats.keys()):
+      logger.record_tabular('eval_' + key, stats[key])
+    logger.dump_tabular()
+
+    self._eval_log.append(
+        self._total_timesteps,
+        update=stats['step'],
+        **{key: value for key, value in stats.items() if key != 'step'})
+    self._eval_log.flush()
+
+    if self._tensorboard_summaries:
+      summary = tf.Summary(value=[
+          tf.Summary.Value(tag='eval/' + key, simple_value=stats[key])
+          for key in sorted(stats.keys()) if key != 'step'])
+      self._summary_writer.add_summary(summary, stats['step'])
+
   def _close(self):
+    if self._evaluator is not None:
+      for stats in self._evaluator.close():
+        self._log_evaluation(stats)
+
     self._eval_env.close()
     self._train_envs.close()
 
     if self._tensorboard_summaries:
       self._summary_writer.close()
 
-  def save_model(self):
-    if self._saver is None:
-      self._saver = tf.train.Saver()
-    save_model_path = os.path.join(self._model_dir, 'model.ckpt')
+    self._checkpoints.close()
 
-    self._saver.save(
-        self._sess, save_path=save_model_path, global_step=self._step)
+    self._train_log.close()
+    self._episode_log.close()
+    self._eval_log.close()
+    if self._weight_history is not None:
+      self._weight_history.close()
+
+  def save_model(self):
+    ''' Snapshot the model and write it to disk in the background. The time
+        training was blocked for is logged with the next summary.
+    '''
+    stall_seconds = self._checkpoints.save(self._step)
+    logger.record_tabular('checkpoint_stall_seconds', stall_seconds)
+    if self._checkpoints.last_write_seconds is not None:
+      logger.record_tabular(
+          'checkpoint_write_seconds', self._checkpoints.last_write_seconds)
 
   def _graph_initialized(self):
     uninitialized_vars = self._sess.run(tf.report_uninitialized_variables())
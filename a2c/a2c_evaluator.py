@@ -0,0 +1,244 @@
+import math
+import multiprocessing
+import queue
+import time
+import traceback
+
+import numpy as np
+import tensorflow as tf
+
+from a2c import ActorCritic
+from resource_planner import pin_thread
+
+INFO_ALE_LIVES_KEY = 'ale.lives'
+INFO_EPISODE_KEY = 'episode'
+RETURN_PERCENTILES = [10, 50, 90]
+
+
+class AsyncEvaluator(object):
+  ''' Evaluates snapshots of the policy in a separate process, so the learner
+      is not blocked while evaluation episodes are played.
+
+      The worker process builds its own copy of the ActorCritic graph and a
+      vectorised environment of several evaluation envs, which are stepped
+      together with one batched policy call per step.
+
+      # Params
+        env_fn: Picklable callable returning a baselines VecEnv of evaluation
+            environments.
+        model_kwargs (dict): Keyword arguments for the worker's ActorCritic
+            (obs_space, act_space, cnn, network_spec, compute_dtype). They
+            must describe the same network as the learner's.
+        num_episodes (int): The number of episodes per evaluation, spread
+            evenly over the evaluation environments.
+        num_threads (int): Tensorflow thread pool sizes in the worker.
+        cpus ([int]): The cores the worker and its environments run on. By
+            default they inherit the affinity of the calling thread.
+  '''
+  def __init__(self, env_fn, model_kwargs, num_episodes, num_threads=1,
+               cpus=None):
+    # Tensorflow is not fork safe, so the worker starts a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    self._requests = context.Queue()
+    self._results = context.Queue()
+    self._pending = 0
+    self._num_episodes = num_episodes
+
+    self._process = context.Process(
+        target=_evaluation_worker,
+        args=(env_fn, model_kwargs, num_threads, cpus, self._requests,
+              self._results))
+    self._process.start()
+
+  @property
+  def busy(self):
+    return self._pending > 0
+
+  def submit(self, params, step):
+    ''' Start evaluating a snapshot of the policy unless an evaluation is
+        already running.
+
+      # Params
+        params (dict): Variable values from ActorCritic.get_params.
+        step (int): The learner step the snapshot was taken at.
+
+      # Returns
+        submitted (bool): False if the evaluation was skipped because the
+            worker is busy.
+    '''
+    self._check_worker()
+    if self.busy:
+      return False
+    self._requests.put((step, params, self._num_episodes))
+    self._pending += 1
+    return True
+
+  def poll(self):
+    ''' Collect any finished evaluations without blocking. Raises
+        RuntimeError if the worker died with an evaluation pending.
+
+      # Returns
+        results ([dict]): Statistics of each finished evaluation, see
+            episode_statistics.
+    '''
+    # Checked before draining, so results sent just before the worker
+    # exited are still collected
+    alive = self._process.is_alive()
+    results = []
+    while self._pending > 0:
+      try:
+        result = self._results.get_nowait()
+      except queue.Empty:
+        break
+      self._pending -= 1
+      if isinstance(result, Exception):
+        raise result
+      results.append(result)
+    if self._pending > 0 and not alive:
+      self._check_worker()
+    return results
+
+  def close(self, timeout=None):
+    ''' Wait for a running evaluation and stop the worker.
+
+      # Returns
+        results ([dict]): Evaluations finished since the last poll.
+    '''
+    results = []
+    while self._pending > 0 and self._process.is_alive():
+      try:
+        result = self._results.get(timeout=timeout)
+      except queue.Empty:
+        break
+      self._pending -= 1
+      if not isinstance(result, Exception):
+        results.append(result)
+
+    self._requests.put(None)
+    self._process.join(timeout)
+    if self._process.is_alive():
+      self._process.terminate()
+    return results
+
+  def _check_worker(self):
+    # A dead worker would otherwise leave its evaluation pending forever,
+    # with every later submit skipped
+    if not self._process.is_alive():
+      raise RuntimeError('The evaluation worker exited with code {}'.format(
+          self._process.exitcode))
+
+
+def run_episodes(actor_critic, env, num_episodes):
+  ''' Play episodes in every environment of env with batched policy calls.
+      Each environment plays the same number of episodes, so short episodes
+      are not over represented. An Atari episode only ends when the last life
+      is lost.
+
+    # Params
+      actor_critic: The policy to evaluate.
+      env: A baselines VecEnv.
+      num_episodes (int): The minimum number of episodes to play.
+
+    # Returns
+      returns ([float]): The undiscounted return of each episode.
+      lengths ([int]): The length of each episode.
+  '''
+  num_envs = env.num_envs
+  episodes_per_env = int(math.ceil(num_episodes / float(num_envs)))
+
+  obs = env.reset()
+  states = None
+  if actor_critic.initial_state is not None:
+    states = np.tile(actor_critic.initial_state, (num_envs, 1))
+  episode_starts = np.ones(num_envs, dtype=np.float32)
+
+  running_returns = np.zeros(num_envs)
+  running_lengths = np.zeros(num_envs, dtype=np.int64)
+  finished = np.zeros(num_envs, dtype=np.int64)
+  returns, lengths = [], []
+
+  while np.any(finished < episodes_per_env):
+    actions, _, states = actor_critic.step(obs, states, episode_starts)
+    obs, rewards, dones, infos = env.step(actions)
+    episode_starts = dones.astype(np.float32)
+    running_returns += rewards
+    running_lengths += 1
+
+    for i in np.nonzero(dones)[0]:
+      episode = infos[i].get(INFO_EPISODE_KEY)
+      if episode is None and infos[i].get(INFO_ALE_LIVES_KEY, 0) >= 1:
+        # Only a life was lost
+        continue
+
+      if finished[i] < episodes_per_env:
+        if episode is not None:
+          returns.append(float(episode['r']))
+          lengths.append(int(episode['l']))
+        else:
+          returns.append(float(running_returns[i]))
+          lengths.append(int(running_lengths[i]))
+      finished[i] += 1
+      running_returns[i] = 0
+      running_lengths[i] = 0
+
+  return returns, lengths
+
+
+def episode_statistics(returns, lengths):
+  stats = {
+      'num_episodes': len(returns),
+      'return_mean': float(np.mean(returns)),
+      'return_std': float(np.std(returns)),
+      'return_min': float(np.min(returns)),
+      'return_max': float(np.max(returns)),
+      'length_mean': float(np.mean(lengths)),
+  }
+  for percentile, value in zip(
+      RETURN_PERCENTILES, np.percentile(returns, RETURN_PERCENTILES)):
+    stats['return_p{}'.format(percentile)] = float(value)
+  return stats
+
+
+def _evaluation_worker(env_fn, model_kwargs, num_threads, cpus, requests,
+                       results):
+  try:
+    # Pinned before the envs are made, so their worker processes and the
+    # session's thread pools inherit the cores
+    if cpus:
+      pin_thread(cpus)
+    env = env_fn()
+    graph = tf.Graph()
+    with graph.as_default():
+      tf_config = tf.ConfigProto(
+          inter_op_parallelism_threads=num_threads,
+          intra_op_parallelism_threads=num_threads)
+      sess = tf.Session(config=tf_config, graph=graph)
+      actor_critic = ActorCritic(
+          sess=sess, num_policy_updates=1, **model_kwargs)
+  except Exception:
+    # Sent in place of the first evaluation's result, the worker then exits
+    # with an error
+    results.put(RuntimeError(traceback.format_exc()))
+    raise
+
+  try:
+    while True:
+      request = requests.get()
+      if request is None:
+        break
+      step, params, num_episodes = request
+
+      try:
+        start_time = time.time()
+        actor_critic.set_params(params)
+        returns, lengths = run_episodes(actor_critic, env, num_episodes)
+        stats = episode_statistics(returns, lengths)
+        stats['step'] = step
+        stats['seconds'] = time.time() - start_time
+        results.put(stats)
+      except Exception:  # pylint: disable=broad-except
+        # Tensorflow errors do not always pickle, so send the traceback
+        results.put(RuntimeError(traceback.format_exc()))
+  finally:
+    env.close()
+    sess.close()
@@ -1,8 +1,29 @@
+import collections
+
 import numpy as np
 
+from profiling import NullTimer
+
+INFO_EPISODE_KEY = 'episode'
+
+# A batch of experience laid out environment major, [n_envs * n_steps, ...].
+# recurrent_states are the LSTM states of each environment at the start of the
+# rollout and episode_starts flag the steps at which a new episode began; both
+# are None for feed forward policies. rewards and dones are [n_envs, n_steps].
+# bootstrap_observations (the observations after the last step) and the
+# behaviour policy's log_probs are only recorded for experience reuse and are
+# None otherwise.
+Rollout = collections.namedtuple('Rollout', [
+    'returns', 'actions', 'observations', 'values', 'recurrent_states',
+    'episode_starts', 'rewards', 'dones', 'bootstrap_observations',
+    'log_probs'])
+
+
 class A2CRunner(object):
   ''' Handles executing the policy and returning trajectories of states,
-      returns, and actions for the a2c algorithm.
+      returns, and actions for the a2c algorithm. For recurrent policies the
+      per environment LSTM states are carried across calls to
+      generate_rollouts and reset in the graph at episode boundaries.
 
       # Params
         actor_critic: A parameterised actor_critic which given an observation
@@ -12,13 +33,21 @@ class A2CRunner(object):
         n_steps (int): The number of steps to rollout at each interval
         gamma (float): The discounting factor.
         discrete (bool): Flag set for discrete action spaces.
+        timer (PhaseTimer): Optional timer for the env_step, inference and
+            returns phases.
+        record_log_probs (bool): Record the log probabilities of the sampled
+            actions and the bootstrap observations, so rollouts can be
+            replayed with off-policy corrections.
   '''
-  def __init__(self, actor_critic, env, n_steps, gamma, discrete):
+  def __init__(self, actor_critic, env, n_steps, gamma, discrete, timer=None,
+               record_log_probs=False):
+    self._timer = timer if timer is not None else NullTimer()
     self._actor_critic = actor_critic
     self._env = env
     self._n_steps = n_steps
     self._gamma = gamma
     self._discrete = discrete
+    self._record_log_probs = record_log_probs
     self._obs_dtype = self._env.observation_space.dtype
     self._act_dtype = self._env.action_space.dtype
 
@@ -26,8 +55,25 @@ class A2CRunner(object):
     self._batch_obs_shape = (-1,) \
         + self._env.observation_space.shape
 
-    # We must store the observations between calls to generate_rollouts
+    # Observations are written straight into a preallocated buffer in the
+    # environment's own dtype (uint8 frames for Atari), laid out
+    # [n_envs, n_steps, ...] so the batch needs no swap or copy before it is
+    # fed to the graph.
+    self._obs_buffer = np.empty(
+        (env.num_envs, n_steps) + self._env.observation_space.shape,
+        dtype=self._obs_dtype)
+
+    # We must store the observations, recurrent states and done flags between
+    # calls to generate_rollouts
     self._obs = self._env.reset()
+    self._recurrent = actor_critic.initial_state is not None
+    self._states = np.tile(actor_critic.initial_state, (env.num_envs, 1)) \
+        if self._recurrent else None
+    self._episode_starts = np.ones(env.num_envs, dtype=np.float32)
+    self._episode_starts_buffer = np.empty(
+        (env.num_envs, n_steps), dtype=np.float32)
+    # (return, length) of the episodes finished since pop_episodes
+    self._episodes = []
 
   def generate_rollouts(self):
     '''Generate rollouts for learning.
@@ -37,46 +83,99 @@ class A2CRunner(object):
       are bootstrapped using the critic value predictions.
 
     # Returns:
-      rollout_returns (np.array([np.float32])): List of returns for the
-          rollouts: dimension (-1,)
-      rollout_actions (np.array([env.action_space.dtype]): List of actions for
-          the rollouts: dimension (-1, act_dim)
-      rollout_observations ([env.observation_space.dtype]): List of observations
-          for the rollouts: dimension (-1, obs_dim)
-      rollout_values ([np.float32]): List of observations for the rollouts:
-          dimension (-1,)
+      rollout (Rollout):
+        returns (np.array([np.float32])): List of returns for the rollouts:
+            dimension (-1,)
+        actions (np.array([env.action_space.dtype]): List of actions for the
+            rollouts: dimension (-1, act_dim)
+        observations ([env.observation_space.dtype]): List of observations
+            for the rollouts: dimension (-1, obs_dim). This is a view of the
+            runner's observation buffer and is overwritten by the next call,
+            so copy it if it must be kept.
+        values ([np.float32]): List of observations for the rollouts:
+            dimension (-1,)
+        recurrent_states ([np.float32]): LSTM states at the start of the
+            rollout: dimension (n_envs, state_dim), None if not recurrent
+        episode_starts ([np.float32]): 1.0 at the steps starting an episode:
+            dimension (-1,), None if not recurrent
+        rewards ([np.float32]): dimension (n_envs, n_steps)
+        dones ([bool]): dimension (n_envs, n_steps)
+        bootstrap_observations: The observations following the rollout:
+            dimension (n_envs, obs_dim), None unless recording log probs
+        log_probs ([np.float32]): Log probabilities of the actions under the
+            policy which sampled them: dimension (-1,), None unless recording
+            log probs
     '''
-    rewards, actions, observations, dones, values = [], [], [], [], []
+    rewards, actions, dones, values, log_probs = [], [], [], [], []
+    initial_states = self._states
 
-    for _ in range(self._n_steps):
+    for t in range(self._n_steps):
       # NOTE: In each iteration we are saving:
       # $x_t, v(x_t), a_t, r_{t+1}, done(x_{t+1})$
-      observations.append(np.copy(self._obs))
-      act, val = self._actor_critic.step(self._obs)
+      self._obs_buffer[:, t] = self._obs
+      self._episode_starts_buffer[:, t] = self._episode_starts
+      with self._timer.phase('inference'):
+        if self._record_log_probs:
+          act, val, self._states, log_prob = self._actor_critic.step(
+              self._obs, self._states, self._episode_starts,
+              with_log_probs=True)
+          log_probs.append(log_prob)
+        else:
+          act, val, self._states = self._actor_critic.step(
+              self._obs, self._states, self._episode_starts)
       values.append(val)
       actions.append(act)
-      self._obs, rew, ds, _ = self._env.step(act)
+      with self._timer.phase('env_step'):
+        self._obs, rew, ds, infos = self._env.step(act)
+      self._episode_starts = ds.astype(np.float32)
+      for i in np.nonzero(ds)[0]:
+        # Reported by the baselines Monitor when a whole episode ends
+        episode = infos[i].get(INFO_EPISODE_KEY)
+        if episode is not None:
+          self._episodes.append((episode['r'], episode['l']))
       rewards.append(rew)
       dones.append(ds)
 
     # Store last values, $v(x_{n_steps+1})$ for bootstrapping the returns
-    _, last_values = self._actor_critic.step(self._obs)
+    with self._timer.phase('inference'):
+      _, last_values, _ = self._actor_critic.step(
+          self._obs, self._states, self._episode_starts)
 
     # Switch lists of [n_steps, n_envs] to [n_envs, n_steps]
-    observations = np.array(observations, dtype=self._obs_dtype).swapaxes(1, 0)\
-        .reshape(self._batch_obs_shape)
+    observations = self._obs_buffer.reshape(self._batch_obs_shape)
     actions = np.array(actions, dtype=self._act_dtype).swapaxes(1, 0)
     values = np.array(values, dtype=np.float32).swapaxes(1, 0)
     dones = np.array(dones, dtype=np.bool).swapaxes(1, 0)
     rewards = np.array(rewards, dtype=np.float32).swapaxes(1, 0)
 
-    returns = self._compute_future_returns(rewards, dones, last_values)
+    with self._timer.phase('returns'):
+      returns = self._compute_future_returns(rewards, dones, last_values)
 
     actions = actions.reshape(-1, self._act_dim)
     values = values.flatten()
     returns = returns.flatten()
 
-    return returns, actions, observations, values
+    bootstrap_observations = None
+    if self._record_log_probs:
+      # Frame stacking wrappers update their observation buffer in place
+      bootstrap_observations = np.copy(self._obs)
+      log_probs = np.array(log_probs, dtype=np.float32).swapaxes(1, 0)
+      log_probs = log_probs.flatten()
+    else:
+      log_probs = None
+
+    if not self._recurrent:
+      return Rollout(returns, actions, observations, values, None, None,
+                     rewards, dones, bootstrap_observations, log_probs)
+
+    return Rollout(returns, actions, observations, values, initial_states,
+                   self._episode_starts_buffer.flatten(), rewards, dones,
+                   bootstrap_observations, log_probs)
+
+  def pop_episodes(self):
+    ''' The (return, length) of each episode finished since the last call. '''
+    episodes, self._episodes = self._episodes, []
+    return episodes
 
   def _compute_future_returns(self, rewards, dones, last_values):
     r'''Compute the future returns for a given rollout of immediate rewards.
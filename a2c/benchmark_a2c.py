@@ -0,0 +1,234 @@
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import platform
+import queue
+import resource
+import time
+import traceback
+
+import gym
+import tensorflow as tf
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+
+from a2c import ActorCritic
+from a2c_runner import A2CRunner
+from profiling import PhaseTimer
+from synthetic_envs import FakeAtariEnv, make_mountain_car
+
+ENVS = ['fake_atari', 'mountain_car']
+# How often a benchmark process is checked for having died without a result
+RESULT_POLL_SECONDS = 1.0
+
+
+def main():
+  args = command_line_args()
+
+  configs = [
+      {'env': env, 'num_env': num_env, 'n_steps': n_steps,
+       'num_updates': args.num_updates, 'num_warmup_updates': args.num_warmup,
+       'step_cost': args.step_cost, 'vec_env': args.vec_env,
+       'num_threads': args.num_threads, 'seed': args.seed}
+      for env, num_env, n_steps in itertools.product(
+          args.envs, args.num_env, args.n_steps)]
+
+  # Each configuration runs in a fresh process so its peak RSS is its own
+  results = []
+  for config in configs:
+    result = run_in_subprocess(run_config, config, args.timeout)
+    results.append(result)
+    print("%s num_env=%d n_steps=%d: %.0f steps/s, update %.2fms, "
+          "peak RSS %.0fMB" %
+          (config['env'], config['num_env'], config['n_steps'],
+           result['steps_per_second'], 1000 * result['update_seconds'],
+           result['peak_rss_mb']))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+
+
+def machine_info():
+  return {
+      'platform': platform.platform(),
+      'python': platform.python_version(),
+      'tensorflow': tf.__version__,
+      'cpu_count': multiprocessing.cpu_count(),
+  }
+
+
+def run_in_subprocess(run_fn, config, timeout=None):
+  ''' Run run_fn(config) in a fresh spawned process. A Pool is not used as
+      its workers are daemonic and could not start SubprocVecEnv workers.
+
+    # Params
+      run_fn: A picklable function of the config returning its result.
+      config (dict): The configuration to benchmark.
+      timeout (float): Seconds to wait for the result, unlimited if None.
+
+    # Returns
+      result: What run_fn returned. Raises RuntimeError if run_fn raised,
+          the process died without a result or the timeout passed.
+  '''
+  context = multiprocessing.get_context('spawn')
+  result_queue = context.Queue()
+  process = context.Process(
+      target=_run_config_worker, args=(run_fn, config, result_queue))
+  process.start()
+  deadline = None if timeout is None else time.time() + timeout
+  try:
+    while True:
+      # Checked before waiting, so a result sent just before the process
+      # exited is still collected
+      alive = process.is_alive()
+      try:
+        result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+        break
+      except queue.Empty:
+        pass
+      if not alive:
+        raise RuntimeError(
+            'The benchmark process exited with code {} without a result'
+            .format(process.exitcode))
+      if deadline is not None and time.time() > deadline:
+        raise RuntimeError(
+            'The benchmark process gave no result in {}s'.format(timeout))
+  except BaseException:
+    process.terminate()
+    raise
+  finally:
+    process.join()
+
+  if isinstance(result, Exception):
+    raise result
+  return result
+
+
+def run_config(config):
+  ''' Drive A2CRunner and ActorCritic for a fixed number of updates.
+
+    # Returns
+      result (dict): The config with the mean seconds per update of each
+          phase, steps and frames per second, update seconds and the peak
+          resident memory of this process and its environment processes.
+  '''
+  env_fns = [functools.partial(_make_env, config, rank)
+             for rank in range(config['num_env'])]
+  if config['vec_env'] == 'subproc':
+    env = SubprocVecEnv(env_fns)
+  else:
+    env = DummyVecEnv(env_fns)
+  discrete = isinstance(env.action_space, gym.spaces.Discrete)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(config['seed'])
+    tf_config = tf.ConfigProto(
+        inter_op_parallelism_threads=config['num_threads'],
+        intra_op_parallelism_threads=config['num_threads'])
+    sess = tf.Session(config=tf_config, graph=graph)
+    total_updates = config['num_warmup_updates'] + config['num_updates']
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=env.observation_space,
+        act_space=env.action_space, cnn=config['env'] == 'fake_atari',
+        num_policy_updates=total_updates)
+
+  timer = PhaseTimer()
+  runner = A2CRunner(
+      actor_critic=actor_critic, env=env, n_steps=config['n_steps'],
+      gamma=0.99, discrete=discrete, timer=timer)
+
+  def update():
+    rollout = runner.generate_rollouts()
+    with timer.phase('train'):
+      actor_critic.train(
+          rollout.observations, rollout.returns, rollout.actions,
+          rollout.values, recurrent_states=rollout.recurrent_states,
+          episode_starts=rollout.episode_starts)
+    timer.end_update(rollout.returns.shape[0])
+
+  for _ in range(config['num_warmup_updates']):
+    update()
+  timer.report()
+
+  start_time = time.time()
+  for _ in range(config['num_updates']):
+    update()
+  update_seconds = (time.time() - start_time) / config['num_updates']
+
+  result = dict(config)
+  result.update(timer.report(frames_per_step=4 if discrete else 1))
+  result['update_seconds'] = update_seconds
+
+  env.close()
+  sess.close()
+
+  # ru_maxrss is in kilobytes on Linux
+  result['peak_rss_mb'] = \
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  result['peak_children_rss_mb'] = \
+      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+  return result
+
+
+def _run_config_worker(run_fn, config, result_queue):
+  try:
+    result_queue.put(run_fn(config))
+  except Exception:  # pylint: disable=broad-except
+    result_queue.put(RuntimeError(traceback.format_exc()))
+
+
+def _make_env(config, rank):
+  if config['env'] == 'fake_atari':
+    env = FakeAtariEnv(step_cost=config['step_cost'])
+  else:
+    env = make_mountain_car()
+  env.seed(config['seed'] + rank)
+  return env
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmarks A2C rollouts and updates on synthetic \
+      environments, which need no Atari ROMs.')
+  parser.add_argument(
+      '--envs', nargs='+', choices=ENVS, default=ENVS,
+      help='the environments to benchmark')
+  parser.add_argument(
+      '--num_env', type=int, nargs='+', default=[1, 4, 16],
+      help='the numbers of environments to benchmark')
+  parser.add_argument(
+      '--n_steps', type=int, nargs='+', default=[5, 20],
+      help='the numbers of steps per update to benchmark')
+  parser.add_argument(
+      '--num_updates', type=int, default=100,
+      help='the number of timed updates per configuration')
+  parser.add_argument(
+      '--num_warmup', type=int, default=5,
+      help='the number of untimed updates per configuration')
+  parser.add_argument(
+      '--step_cost', type=float, default=0.0,
+      help='seconds of CPU work per fake Atari step')
+  parser.add_argument(
+      '--vec_env', choices=['dummy', 'subproc'], default='subproc',
+      help='run the environments in the learner process or in subprocesses')
+  parser.add_argument(
+      '--num_threads', type=int, default=0,
+      help='tensorflow thread pool sizes, 0 lets tensorflow choose')
+  parser.add_argument(
+      '--output', type=str, default='a2c_benchmark.json',
+      help='file to write the results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  parser.add_argument(
+      '--timeout', type=float, default=None,
+      help='seconds a configuration may run before the benchmark fails, '
+      'unlimited by default')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+
+import gym
+import numpy as np
+import tensorflow as tf
+
+from a2c import ActorCritic, COMPUTE_DTYPES
+from a2c_runner import A2CRunner
+from env_factory import env_entry, make_vec_env
+from metrics_log import MetricsLogWriter
+
+ATARI_OBS_SHAPE = (84, 84, 4)
+NUM_ATARI_ACTIONS = 4
+
+
+def main():
+  args = command_line_args()
+  batch_size = args.num_env * args.n_steps
+
+  results = {
+      'batch_size': batch_size,
+      'rollout_observation_bytes': rollout_memory(args.num_env, args.n_steps),
+      'compute_dtypes': {},
+  }
+  print("Rollout observation memory: uint8 %d bytes, float32 %d bytes" %
+        (results['rollout_observation_bytes']['uint8'],
+         results['rollout_observation_bytes']['float32']))
+
+  for compute_dtype in args.compute_dtypes:
+    timings = benchmark_compute_dtype(
+        compute_dtype, batch_size, args.num_env, args.num_iterations,
+        args.num_threads, args.seed)
+    results['compute_dtypes'][compute_dtype] = timings
+    print("%s: step %.2fms, train %.2fms, %.0f train frames/s" %
+          (compute_dtype, 1000 * timings['step_seconds'],
+           1000 * timings['train_seconds'], timings['train_frames_per_second']))
+
+    if args.learning_updates > 0:
+      learning = learning_curves(
+          compute_dtype, args.env_id, args.num_env, args.n_steps,
+          args.learning_updates, args.num_threads, args.seed, args.log_dir)
+      timings['learning'] = learning
+      print("%s: %d updates in %.1fs, final pg_loss %.4f, val_loss %.4f, "
+            "entropy %.4f, %d non-finite updates, mean return %s" %
+            (compute_dtype, args.learning_updates, learning['seconds'],
+             learning['final_pg_loss'], learning['final_val_loss'],
+             learning['final_entropy'], learning['non_finite_updates'],
+             learning['return_mean']))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+def rollout_memory(num_env, n_steps):
+  ''' Bytes held by one rollout of stacked frames in uint8 and, for
+      comparison, if the frames were converted to float32 on the host.
+  '''
+  num_values = num_env * n_steps * int(np.prod(ATARI_OBS_SHAPE))
+  return {
+      'uint8': num_values * np.dtype(np.uint8).itemsize,
+      'float32': num_values * np.dtype(np.float32).itemsize,
+  }
+
+
+def benchmark_compute_dtype(compute_dtype, batch_size, num_env, num_iterations,
+                            num_threads, seed):
+  ''' Time inference on num_env observations and a training update on a batch
+      of batch_size observations for an Atari sized CNN.
+  '''
+  obs_space = gym.spaces.Box(
+      low=0, high=255, shape=ATARI_OBS_SHAPE, dtype=np.uint8)
+  act_space = gym.spaces.Discrete(NUM_ATARI_ACTIONS)
+  rng = np.random.RandomState(seed)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(seed)
+    tf_config = tf.ConfigProto(
+        inter_op_parallelism_threads=num_threads,
+        intra_op_parallelism_threads=num_threads)
+    sess = tf.Session(config=tf_config, graph=graph)
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=obs_space, act_space=act_space, cnn=True,
+        num_policy_updates=num_iterations + 1, compute_dtype=compute_dtype)
+
+    step_obs = rng.randint(
+        0, 256, size=(num_env,) + ATARI_OBS_SHAPE).astype(np.uint8)
+    train_obs = rng.randint(
+        0, 256, size=(batch_size,) + ATARI_OBS_SHAPE).astype(np.uint8)
+    returns = rng.randn(batch_size).astype(np.float32)
+    values = rng.randn(batch_size).astype(np.float32)
+    actions = rng.randint(0, NUM_ATARI_ACTIONS, size=(batch_size, 1))
+
+    # Warm up so graph optimisation is not timed
+    actor_critic.step(step_obs)
+    actor_critic.train(train_obs, returns, actions, values)
+
+    start_time = time.time()
+    for _ in range(num_iterations):
+      actor_critic.step(step_obs)
+    step_seconds = (time.time() - start_time) / num_iterations
+
+    start_time = time.time()
+    for _ in range(num_iterations):
+      actor_critic.train(train_obs, returns, actions, values)
+    train_seconds = (time.time() - start_time) / num_iterations
+
+    sess.close()
+
+  return {
+      'step_seconds': step_seconds,
+      'train_seconds': train_seconds,
+      'train_frames_per_second': batch_size / train_seconds,
+  }
+
+
+def learning_curves(compute_dtype, env_id, num_env, n_steps, num_updates,
+                    num_threads, seed, log_dir):
+  ''' Train from scratch on env_id for num_updates updates, with the same
+      seeds for every compute dtype, recording the losses of every update and
+      the finished episodes in metrics logs under
+      <log_dir>/<compute_dtype>/metrics/train and episodes (see plots.py).
+
+    # Returns
+      result (dict): The training seconds, the number of updates with a
+          non-finite loss (which the static loss scale would overflow to),
+          the mean losses and entropy over the last tenth of the updates, and
+          the number and mean return of the finished episodes.
+  '''
+  env = make_vec_env(env_id, num_env, seed)
+  discrete = isinstance(env.action_space, gym.spaces.Discrete)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(seed)
+    tf_config = tf.ConfigProto(
+        inter_op_parallelism_threads=num_threads,
+        intra_op_parallelism_threads=num_threads)
+    sess = tf.Session(config=tf_config, graph=graph)
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=env.observation_space,
+        act_space=env.action_space, cnn=env_entry(env_id).cnn,
+        num_policy_updates=num_updates, compute_dtype=compute_dtype)
+  runner = A2CRunner(
+      actor_critic=actor_critic, env=env, n_steps=n_steps, gamma=0.99,
+      discrete=discrete)
+
+  metrics_dir = os.path.join(log_dir, compute_dtype, 'metrics')
+  train_log = MetricsLogWriter(os.path.join(metrics_dir, 'train'))
+  episode_log = MetricsLogWriter(os.path.join(metrics_dir, 'episodes'))
+  total_timesteps = 0
+  non_finite_updates = 0
+  losses = []
+  returns = []
+
+  start_time = time.time()
+  for update in range(num_updates):
+    rollout = runner.generate_rollouts()
+    total_timesteps += rollout.returns.shape[0]
+    pg_loss, val_loss, expl_loss, ent, _ = actor_critic.train(
+        rollout.observations, rollout.returns, rollout.actions,
+        rollout.values)
+    if not np.all(np.isfinite([pg_loss, val_loss, expl_loss, ent])):
+      non_finite_updates += 1
+    losses.append((pg_loss, val_loss, ent))
+    train_log.append(
+        total_timesteps, update=update, pg_loss=pg_loss, val_loss=val_loss,
+        expl_loss=expl_loss, entropy=ent)
+    for episode_return, episode_length in runner.pop_episodes():
+      returns.append(episode_return)
+      episode_log.append(
+          total_timesteps, episode_return=episode_return,
+          episode_length=episode_length)
+  seconds = time.time() - start_time
+
+  train_log.close()
+  episode_log.close()
+  env.close()
+  sess.close()
+
+  final = np.mean(losses[-max(1, num_updates // 10):], axis=0)
+  return {
+      'env_id': env_id,
+      'num_updates': num_updates,
+      'seconds': seconds,
+      'non_finite_updates': non_finite_updates,
+      'final_pg_loss': float(final[0]),
+      'final_val_loss': float(final[1]),
+      'final_entropy': float(final[2]),
+      'num_episodes': len(returns),
+      'return_mean': float(np.mean(returns)) if returns else None,
+  }
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmarks the A2C Atari network with the convolutional \
+      layers computed in different precisions and, with --learning_updates, \
+      records the learning curves of each precision trained from the same \
+      seed.')
+  parser.add_argument(
+      '--compute_dtypes', nargs='+', choices=sorted(COMPUTE_DTYPES.keys()),
+      default=['float32', 'float16', 'bfloat16'],
+      help='the precisions to benchmark')
+  parser.add_argument(
+      '--num_env', type=int, default=16,
+      help='the number of environments stepped together')
+  parser.add_argument(
+      '--n_steps', type=int, default=5,
+      help='the number of steps per update')
+  parser.add_argument(
+      '--num_iterations', type=int, default=100,
+      help='the number of timed inference and training calls')
+  parser.add_argument(
+      '--num_threads', type=int, default=0,
+      help='tensorflow thread pool sizes, 0 lets tensorflow choose')
+  parser.add_argument(
+      '--learning_updates', type=int, default=0,
+      help='the number of updates each precision is trained for to record '
+      'its learning curves, 0 to only time it')
+  parser.add_argument(
+      '--env_id', type=str, default='FakeAtari',
+      help='the registered environment the learning curves are recorded on')
+  parser.add_argument(
+      '--log_dir', type=str, default='./compute_dtype_curves',
+      help='the directory for the metrics logs of the learning curves')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='file to write the results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# (name, directory relative to the repository, interpreter arguments). The
+# bare interpreter is the floor every other entry point pays.
+ENTRY_POINTS = [
+    ('python', '.', ['-c', 'pass']),
+    ('import a2c_agent', 'a2c', ['-c', 'import a2c_agent']),
+    ('run_a2c.py --help', 'a2c', ['run_a2c.py', '--help']),
+    ('import utils', '.', ['-c', 'import utils']),
+    ('import plots', '.', ['-c', 'import plots']),
+    ('import gaussian_process_agent', 'gaussian_processes',
+     ['-c', 'import gaussian_process_agent']),
+    ('run_gp.py --help', 'gaussian_processes', ['run_gp.py', '--help']),
+]
+
+
+def main():
+  args = command_line_args()
+
+  results = {}
+  for name, directory, arguments in ENTRY_POINTS:
+    result = benchmark_entry_point(
+        os.path.join(REPO_DIR, directory), arguments, args.repeats,
+        args.num_heaviest)
+    results[name] = result
+    if result['error'] is not None:
+      print("%s: failed\n%s" % (name, result['error']))
+      continue
+    print("%s: %.0fms (imports %.0fms)" % (
+        name, 1000 * result['seconds'], 1000 * result['import_seconds']))
+    for module, seconds in result['heaviest']:
+      print("    %s %.0fms" % (module, 1000 * seconds))
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)['results']
+    print("Against %s:" % args.baseline)
+    for name, result in results.items():
+      before = baseline.get(name)
+      if before is None or before['error'] is not None \
+          or result['error'] is not None:
+        continue
+      print("%s: %.0fms -> %.0fms (%.1fx)" % (
+          name, 1000 * before['seconds'], 1000 * result['seconds'],
+          before['seconds'] / max(result['seconds'], 1e-9)))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'python': sys.version, 'results': results}, f, indent=2)
+
+
+def benchmark_entry_point(directory, arguments, repeats, num_heaviest):
+  ''' Time a fresh interpreter running arguments in directory.
+
+    # Returns
+      result (dict): The median wall clock seconds of repeats runs, the
+          seconds spent importing modules as reported by -X importtime, the
+          num_heaviest imports made by the entry point's own imports with
+          their cumulative seconds, and the output of a failed run (None on
+          success).
+  '''
+  command = [sys.executable, '-X', 'importtime'] + arguments
+  wall_seconds = []
+  for _ in range(repeats):
+    start_time = time.time()
+    process = subprocess.run(
+        command, cwd=directory, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    wall_seconds.append(time.time() - start_time)
+    if process.returncode != 0:
+      return {'seconds': None, 'import_seconds': None, 'heaviest': [],
+              'error': _without_import_times(process.stderr)}
+
+  import_times = parse_import_times(process.stderr)
+  dependencies = {}
+  for depth, module, seconds in import_times:
+    if depth == 1:
+      dependencies[module] = dependencies.get(module, 0.0) + seconds
+  heaviest = sorted(dependencies.items(), key=lambda item: -item[1])
+  return {
+      'seconds': float(np.median(wall_seconds)),
+      'import_seconds': sum(seconds for depth, _, seconds in import_times
+                            if depth == 0),
+      'heaviest': heaviest[:num_heaviest],
+      'error': None,
+  }
+
+
+def parse_import_times(stderr):
+  ''' The imports in -X importtime output as (depth, module, cumulative
+      seconds). Depth 0 imports are made by the entry point itself, depth 1
+      imports by those, and so on.
+  '''
+  import_times = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:'):
+      continue
+    fields = line[len('import time:'):].split('|')
+    if len(fields) != 3 or not fields[1].strip().isdigit():
+      continue
+    module = fields[2].rstrip()
+    # Nested imports are indented two spaces per level below a leading space
+    depth = (len(module) - len(module.lstrip()) - 1) // 2
+    import_times.append((depth, module.strip(), int(fields[1]) / 1e6))
+  return import_times
+
+
+def _without_import_times(stderr):
+  return '\n'.join(line for line in stderr.splitlines()
+                   if not line.startswith('import time:'))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Times the start up of the A2C and GP entry points in fresh \
+      interpreters, with the heaviest imports of each.')
+  parser.add_argument(
+      '--repeats', type=int, default=5,
+      help='runs per entry point, the median is reported')
+  parser.add_argument(
+      '--num_heaviest', type=int, default=5,
+      help='the number of heaviest dependencies listed per entry point')
+  parser.add_argument(
+      '--baseline', type=str, default=None,
+      help='a results file from an earlier run to compare against')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='a file to write the results to as JSON')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import time
+
+import gym
+import numpy as np
+import tensorflow as tf
+
+from a2c import ActorCritic
+from networks import CNN_SPEC, MLP_SPEC
+
+ATARI_OBS_SHAPE = (84, 84, 4)
+MLP_OBS_SHAPE = (8,)
+NUM_ACTIONS = 4
+
+# name: (ActorCritic keyword arguments, summarise on every update)
+GRAPHS = {
+    'legacy': ({'legacy_graph': True}, True),
+    'pruned': ({}, False),
+}
+
+
+def main():
+  args = command_line_args()
+  specs = {'cnn': CNN_SPEC, 'mlp': MLP_SPEC}
+  if args.network_spec:
+    specs = {'custom': json.loads(args.network_spec)}
+
+  results = {}
+  for spec_name, spec in specs.items():
+    results[spec_name] = {}
+    for graph_name in args.graphs:
+      timings = benchmark_graph(
+          spec_name, spec, graph_name, args.batch_size, args.num_iterations,
+          args.seed)
+      results[spec_name][graph_name] = timings
+      print("%s %s: %d ops, forward %.2fms, forward/backward %.2fms" %
+            (spec_name, graph_name, timings['num_ops'],
+             1000 * timings['forward_seconds'],
+             1000 * timings['train_seconds']))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+def benchmark_graph(spec_name, spec, graph_name, batch_size, num_iterations,
+                    seed):
+  ''' Time inference and a training update of an ActorCritic built from spec,
+      either as the original graph (summaries fetched on every update) or the
+      pruned graph.
+  '''
+  kwargs, summarise = GRAPHS[graph_name]
+  cnn = spec_name == 'cnn' or bool(spec.get('conv'))
+  if cnn:
+    obs_space = gym.spaces.Box(
+        low=0, high=255, shape=ATARI_OBS_SHAPE, dtype=np.uint8)
+  else:
+    obs_space = gym.spaces.Box(
+        low=-1.0, high=1.0, shape=MLP_OBS_SHAPE, dtype=np.float32)
+  act_space = gym.spaces.Discrete(NUM_ACTIONS)
+  rng = np.random.RandomState(seed)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(seed)
+    sess = tf.Session(graph=graph)
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=obs_space, act_space=act_space, cnn=cnn,
+        num_policy_updates=num_iterations + 1, network_spec=spec, **kwargs)
+    num_ops = len(graph.get_operations())
+
+    if cnn:
+      obs = rng.randint(
+          0, 256, size=(batch_size,) + ATARI_OBS_SHAPE).astype(np.uint8)
+    else:
+      obs = rng.uniform(
+          -1.0, 1.0, size=(batch_size,) + MLP_OBS_SHAPE).astype(np.float32)
+    returns = rng.randn(batch_size).astype(np.float32)
+    values = rng.randn(batch_size).astype(np.float32)
+    actions = rng.randint(0, NUM_ACTIONS, size=(batch_size, 1))
+
+    # Warm up so graph optimisation is not timed
+    actor_critic.step(obs)
+    actor_critic.train(obs, returns, actions, values, summarise=summarise)
+
+    start_time = time.time()
+    for _ in range(num_iterations):
+      actor_critic.step(obs)
+    forward_seconds = (time.time() - start_time) / num_iterations
+
+    start_time = time.time()
+    for _ in range(num_iterations):
+      actor_critic.train(obs, returns, actions, values, summarise=summarise)
+    train_seconds = (time.time() - start_time) / num_iterations
+
+    sess.close()
+
+  return {
+      'num_ops': num_ops,
+      'forward_seconds': forward_seconds,
+      'train_seconds': train_seconds,
+  }
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Compares the forward and forward/backward latency of the \
+      original ActorCritic graph, which builds regularisers and histograms \
+      and evaluates summaries on every update, with the pruned graph.')
+  parser.add_argument(
+      '--network_spec', type=str, default=None,
+      help='JSON network spec to benchmark instead of the default CNN and MLP')
+  parser.add_argument(
+      '--graphs', nargs='+', choices=sorted(GRAPHS.keys()),
+      default=['legacy', 'pruned'], help='the graph variants to benchmark')
+  parser.add_argument(
+      '--batch_size', type=int, default=80,
+      help='the number of observations per call')
+  parser.add_argument(
+      '--num_iterations', type=int, default=100,
+      help='the number of timed calls')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='file to write the results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+import gym
+import tensorflow as tf
+
+from a2c import ActorCritic
+from a2c_runner import A2CRunner
+from benchmark_a2c import machine_info, run_in_subprocess
+from env_factory import env_entry, make_vec_env
+from profiling import PhaseTimer
+from resource_planner import (apply_plan, available_cpus, describe_plan,
+                              env_worker_pids, plan_resources)
+
+
+def main():
+  args = command_line_args()
+
+  num_cpu = len(available_cpus())
+  env_cpus = args.env_cpus
+  if env_cpus is None:
+    planned = len(plan_resources(args.num_env).env_cpus)
+    env_cpus = sorted(
+        set(range(0, num_cpu, max(1, num_cpu // 8))) | {planned})
+  configs = [
+      {'env_id': args.env_id, 'num_env': args.num_env, 'n_steps': args.n_steps,
+       'num_updates': args.num_updates, 'num_warmup_updates': args.num_warmup,
+       'env_kwargs': json.loads(args.env_kwargs) if args.env_kwargs else {},
+       'env_cpus': num_env_cpus, 'pin': not args.no_pin_cpus,
+       'seed': args.seed}
+      for num_env_cpus in env_cpus]
+  # The unplanned baseline: every session thread pool as large as the
+  # machine, nothing pinned
+  configs.append(dict(configs[0], env_cpus=None, pin=False, unplanned=True))
+
+  # Each split runs in a fresh process, so affinities do not carry over
+  results = []
+  for config in configs:
+    result = run_in_subprocess(run_config, config, args.timeout)
+    results.append(result)
+    print("%s: %.0f steps/s, update %.2fms" % (
+        result['plan'], result['steps_per_second'],
+        1000 * result['update_seconds']))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+
+
+def run_config(config):
+  ''' Train for a fixed number of updates with the cores split as planned for
+      config['env_cpus'] env worker cores.
+
+    # Returns
+      result (dict): The config with the plan, the mean seconds per update of
+          each phase, steps per second and update seconds.
+  '''
+  env = make_vec_env(config['env_id'], config['num_env'], config['seed'],
+                     backend='subproc', env_kwargs=config['env_kwargs'])
+  discrete = isinstance(env.action_space, gym.spaces.Discrete)
+
+  if config.get('unplanned'):
+    num_cpu = multiprocessing.cpu_count()
+    inter_op_threads = intra_op_threads = num_cpu
+    plan_description = 'unplanned, {} inter and intra op threads'.format(
+        num_cpu)
+  else:
+    plan = plan_resources(len(env_worker_pids(env)),
+                          env_cpus=config['env_cpus'])
+    if config['pin']:
+      apply_plan(plan, env)
+    inter_op_threads = plan.inter_op_threads
+    intra_op_threads = plan.intra_op_threads
+    plan_description = describe_plan(plan)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(config['seed'])
+    tf_config = tf.ConfigProto(
+        inter_op_parallelism_threads=inter_op_threads,
+        intra_op_parallelism_threads=intra_op_threads)
+    sess = tf.Session(config=tf_config, graph=graph)
+    total_updates = config['num_warmup_updates'] + config['num_updates']
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=env.observation_space,
+        act_space=env.action_space, cnn=env_entry(config['env_id']).cnn,
+        num_policy_updates=total_updates)
+
+  timer = PhaseTimer()
+  runner = A2CRunner(
+      actor_critic=actor_critic, env=env, n_steps=config['n_steps'],
+      gamma=0.99, discrete=discrete, timer=timer)
+
+  def update():
+    rollout = runner.generate_rollouts()
+    with timer.phase('train'):
+      actor_critic.train(
+          rollout.observations, rollout.returns, rollout.actions,
+          rollout.values)
+    timer.end_update(rollout.returns.shape[0])
+
+  for _ in range(config['num_warmup_updates']):
+    update()
+  timer.report()
+
+  start_time = time.time()
+  for _ in range(config['num_updates']):
+    update()
+  update_seconds = (time.time() - start_time) / config['num_updates']
+
+  result = dict(config)
+  result.update(timer.report())
+  result['plan'] = plan_description
+  result['update_seconds'] = update_seconds
+
+  env.close()
+  sess.close()
+  return result
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmarks A2C steps per second for different splits of \
+      the cores between env worker processes and the tensorflow learner.')
+  parser.add_argument(
+      '--env_id', type=str, default='FakeAtari',
+      help='the registered environment to benchmark')
+  parser.add_argument(
+      '--env_kwargs', type=str, default='{"step_cost": 0.0005}',
+      help='JSON keyword arguments for the environment')
+  parser.add_argument(
+      '--num_env', type=int, default=16, help='the number of env workers')
+  parser.add_argument(
+      '--n_steps', type=int, default=5,
+      help='the number of steps per update')
+  parser.add_argument(
+      '--env_cpus', type=int, nargs='+', default=None,
+      help='the numbers of env worker cores to benchmark, a spread of '
+      'splits and the planned one by default')
+  parser.add_argument(
+      '--no_pin_cpus', action='store_true',
+      help='only size the thread pools, without pinning')
+  parser.add_argument(
+      '--num_updates', type=int, default=100,
+      help='the number of timed updates per split')
+  parser.add_argument(
+      '--num_warmup', type=int, default=5,
+      help='the number of untimed updates per split')
+  parser.add_argument(
+      '--output', type=str, default='a2c_resources_benchmark.json',
+      help='file to write the results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  parser.add_argument(
+      '--timeout', type=float, default=None,
+      help='seconds a configuration may run before the benchmark fails, '
+      'unlimited by default')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
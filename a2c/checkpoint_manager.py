@@ -0,0 +1,207 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from json_index import read_index, write_index
+
+CHECKPOINT_PREFIX = 'ckpt-'
+CHECKPOINT_SUFFIX = '.npz'
+INDEX_FILE = 'checkpoints.json'
+
+
+class CheckpointManager(object):
+  ''' Non-blocking checkpointing. save() copies the variables to host memory
+      with a single session call and returns; a background thread writes the
+      snapshot to an npz file and applies the retention policy.
+
+      Checkpoints are written to a temporary file and renamed, so a crash
+      mid-write never leaves a truncated checkpoint, and an index of the
+      retained checkpoints is kept in checkpoints.json.
+
+      # Params
+        sess: The session holding the variables.
+        directory (str): The directory to write checkpoints to.
+        max_to_keep (int): The number of most recent checkpoints to keep.
+        keep_best (bool): Also keep the checkpoint with the best reported
+            metric (see report_metric), even when it is older.
+        var_list: The variables to save, all global variables (including
+            optimizer slots) by default.
+  '''
+  def __init__(self, sess, directory, max_to_keep=5, keep_best=True,
+               var_list=None):
+    self._sess = sess
+    self._directory = directory
+    self._max_to_keep = max_to_keep
+    self._keep_best = keep_best
+
+    if var_list is None:
+      var_list = tf.global_variables()
+    self._variables = list(var_list)
+    self._names = [variable.name for variable in self._variables]
+
+    with tf.name_scope('checkpoint_manager'):
+      self._placeholders = [
+          tf.placeholder(dtype=variable.dtype.base_dtype,
+                         shape=variable.shape)
+          for variable in self._variables]
+      self._restore_op = tf.group(*[
+          tf.assign(variable, placeholder) for variable, placeholder
+          in zip(self._variables, self._placeholders)])
+
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+
+    self._lock = threading.Lock()
+    self._steps, self._best = self._read_index()
+    # Metrics reported for checkpoints queued but not yet written, by step
+    self._queued_metrics = {}
+    self._error = None
+    self.last_write_seconds = None
+
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._write_loop)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def save(self, step):
+    ''' Snapshot the variables and queue them to be written.
+
+      # Params
+        step (int): The training step, used to name the checkpoint.
+
+      # Returns
+        stall_seconds (float): The time the caller was blocked for.
+    '''
+    self._raise_write_error()
+    start_time = time.time()
+    values = self._sess.run(self._variables)
+    with self._lock:
+      self._queued_metrics.setdefault(step, None)
+    self._queue.put((step, dict(zip(self._names, values))))
+    return time.time() - start_time
+
+  def report_metric(self, step, value):
+    ''' Report an evaluation metric (higher is better) for the checkpoint at
+        step. The best checkpoint is exempt from max_to_keep. A metric for a
+        checkpoint still being written is applied once it is written.
+    '''
+    with self._lock:
+      if step in self._queued_metrics:
+        self._queued_metrics[step] = value
+      elif step in self._steps and self._update_best(step, value):
+        self._write_index()
+
+  def restore(self, path=None):
+    ''' Load a checkpoint into the variables.
+
+      # Params
+        path (str): An npz checkpoint, the latest checkpoint by default.
+    '''
+    if path is None:
+      path = self.latest_checkpoint()
+      if path is None:
+        raise ValueError('No checkpoints in {}'.format(self._directory))
+
+    with np.load(path) as checkpoint:
+      missing = [name for name in self._names if name not in checkpoint.files]
+      if missing:
+        raise ValueError('Checkpoint {} is missing {}'.format(path, missing))
+      feed_dict = {placeholder: checkpoint[name] for name, placeholder
+                   in zip(self._names, self._placeholders)}
+    self._sess.run(self._restore_op, feed_dict=feed_dict)
+
+  def latest_checkpoint(self):
+    with self._lock:
+      if not self._steps:
+        return None
+      return self._checkpoint_path(self._steps[-1])
+
+  def best_checkpoint(self):
+    with self._lock:
+      if self._best is None:
+        return None
+      return self._checkpoint_path(self._best['step'])
+
+  def close(self):
+    ''' Wait for queued checkpoints to be written and stop the writer. '''
+    self._queue.put(None)
+    self._thread.join()
+    self._raise_write_error()
+
+  def _write_loop(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+
+      step, values = item
+      try:
+        start_time = time.time()
+        path = self._checkpoint_path(step)
+        # np.savez appends .npz to names without it
+        tmp_path = path + '.tmp' + CHECKPOINT_SUFFIX
+        np.savez(tmp_path, **values)
+        os.rename(tmp_path, path)
+
+        with self._lock:
+          if step not in self._steps:
+            self._steps.append(step)
+            self._steps.sort()
+          value = self._queued_metrics.pop(step, None)
+          if value is not None:
+            self._update_best(step, value)
+          self._apply_retention()
+          self._write_index()
+        self.last_write_seconds = time.time() - start_time
+      except Exception as e:  # pylint: disable=broad-except
+        with self._lock:
+          self._queued_metrics.pop(step, None)
+        self._error = e
+
+  def _update_best(self, step, value):
+    if self._best is not None and value <= self._best['value']:
+      return False
+    self._best = {'step': step, 'value': float(value)}
+    return True
+
+  def _apply_retention(self):
+    keep = set(self._steps[-self._max_to_keep:])
+    if self._keep_best and self._best is not None:
+      keep.add(self._best['step'])
+
+    for step in [s for s in self._steps if s not in keep]:
+      path = self._checkpoint_path(step)
+      if os.path.exists(path):
+        os.remove(path)
+    self._steps = [s for s in self._steps if s in keep]
+    if self._best is not None and self._best['step'] not in keep:
+      self._best = None
+
+  def _write_index(self):
+    write_index(os.path.join(self._directory, INDEX_FILE),
+                {'steps': self._steps, 'best': self._best}, indent=2)
+
+  def _read_index(self):
+    index = read_index(os.path.join(self._directory, INDEX_FILE))
+    if index is None:
+      return [], None
+    steps = [step for step in index['steps']
+             if os.path.exists(self._checkpoint_path(step))]
+    best = index['best']
+    if best is not None and best['step'] not in steps:
+      best = None
+    return steps, best
+
+  def _checkpoint_path(self, step):
+    return os.path.join(
+        self._directory,
+        '{}{}{}'.format(CHECKPOINT_PREFIX, step, CHECKPOINT_SUFFIX))
+
+  def _raise_write_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
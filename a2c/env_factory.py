@@ -0,0 +1,242 @@
+"""
+A registry of environments for A2C and a factory building vectorised
+environments from it.
+
+Each registered environment knows how to build one wrapped env, whether its
+steps are expensive, and the defaults A2C should use with it (frame stacking,
+frame skip, CNN or MLP). make_vec_env picks the vectorisation backend from
+that: cheap environments step in the learner process (DummyVecEnv), where
+pickling observations between processes would cost more than the step, and
+expensive ones step in worker processes (SubprocVecEnv, or ShmemVecEnv for
+image observations when baselines provides it).
+
+Atari and baselines imports are deferred to the builders, so environments
+which do not need ALE can be built without it.
+"""
+
+import collections
+import os
+import sys
+
+import gym
+
+from synthetic_envs import (GAUSSIAN_PROCESSES_DIR, FakeAtariEnv,
+                            make_mountain_car)
+
+BACKENDS = ['auto', 'dummy', 'subproc', 'shmem', 'native']
+ATARI_SUFFIX = 'NoFrameskip-v4'
+# make_atari repeats each action for 4 emulator frames
+ATARI_FRAME_SKIP = 4
+
+# builder(seed, monitor_path, video_dir, **env_kwargs) returns one env.
+# heavy(env_kwargs) says whether stepping it is expensive. vec_builder, if
+# given, builds a natively vectorised env as vec_builder(num_env, seed,
+# **env_kwargs).
+EnvEntry = collections.namedtuple('EnvEntry', [
+    'builder', 'heavy', 'frame_stack', 'frames_per_step', 'cnn',
+    'vec_builder'])
+
+_REGISTRY = collections.OrderedDict()
+
+
+def register(env_id, builder, heavy, frame_stack=0, frames_per_step=1,
+             cnn=False, vec_builder=None):
+  ''' Register an environment with the factory.
+
+    # Params
+      env_id (str): The name to build the environment by.
+      builder: Callable builder(seed, monitor_path, video_dir, **env_kwargs)
+          returning one wrapped gym environment.
+      heavy: Whether a step is expensive enough to run in worker processes,
+          either a bool or a callable of the env_kwargs.
+      frame_stack (int): The number of frames to stack, 0 for none.
+      frames_per_step (int): Emulator frames per environment step.
+      cnn (bool): Whether the observations are images.
+      vec_builder: Optional callable vec_builder(num_env, seed, **env_kwargs)
+          returning a natively vectorised environment.
+  '''
+  if not callable(heavy):
+    heavy = _constant(heavy)
+  _REGISTRY[env_id] = EnvEntry(
+      builder, heavy, frame_stack, frames_per_step, cnn, vec_builder)
+
+
+def registered_ids():
+  return list(_REGISTRY.keys())
+
+
+def env_entry(env_id):
+  ''' Look up a registered environment. Any Atari game without frame skip
+      (<Game>NoFrameskip-v4) is available even if not registered by name.
+  '''
+  if env_id in _REGISTRY:
+    return _REGISTRY[env_id]
+  if env_id.endswith(ATARI_SUFFIX):
+    register_atari(env_id)
+    return _REGISTRY[env_id]
+  raise ValueError('Unknown environment {}, choose from {} or any '
+                   '<Game>{}'.format(env_id, registered_ids(), ATARI_SUFFIX))
+
+
+def make_vec_env(env_id, num_env, seed, backend='auto', frame_stack=True,
+                 monitor_dir=None, video_dir=None, start_index=0,
+                 env_kwargs=None):
+  ''' Build a vectorised environment of num_env copies of env_id.
+
+    # Params
+      env_id (str): A registered environment.
+      num_env (int): The number of environments.
+      seed (int): Environment i is seeded with seed + start_index + i.
+      backend (str): One of BACKENDS. auto uses the native vectorised env if
+          there is one, worker processes for heavy environments and the
+          learner process otherwise.
+      frame_stack (bool): Stack frames if the environment asks for it.
+      monitor_dir (str): Directory for per environment baselines Monitor
+          logs, None to only report episodes through info.
+      video_dir (str): Record every episode with the gym Monitor here instead.
+      start_index (int): The rank of the first environment.
+      env_kwargs (dict): Keyword arguments for the builder.
+
+    # Returns
+      env: A baselines VecEnv.
+  '''
+  entry = env_entry(env_id)
+  env_kwargs = env_kwargs or {}
+  backend = _choose_backend(entry, backend, num_env, env_kwargs)
+
+  if backend == 'native':
+    vec_env = entry.vec_builder(num_env, seed + start_index, **env_kwargs)
+  else:
+    env_fns = [_EnvThunk(env_id, seed + start_index + rank,
+                         _monitor_path(monitor_dir, start_index + rank),
+                         video_dir, env_kwargs)
+               for rank in range(num_env)]
+    vec_env = _vec_env_class(backend, entry)(env_fns)
+
+  if frame_stack and entry.frame_stack > 1:
+    from baselines.common.vec_env.vec_frame_stack import VecFrameStack
+    vec_env = VecFrameStack(vec_env, entry.frame_stack)
+  return vec_env
+
+
+def _choose_backend(entry, backend, num_env, env_kwargs):
+  if backend not in BACKENDS:
+    raise ValueError('Unknown backend {}, choose from {}'.format(
+        backend, BACKENDS))
+  if backend == 'native' and entry.vec_builder is None:
+    raise ValueError('This environment has no native vectorised version')
+  if backend != 'auto':
+    return backend
+
+  if entry.vec_builder is not None:
+    return 'native'
+  if num_env > 1 and entry.heavy(env_kwargs):
+    return 'shmem' if entry.cnn else 'subproc'
+  return 'dummy'
+
+
+def _vec_env_class(backend, entry):
+  if backend == 'dummy':
+    from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+    return DummyVecEnv
+  if backend == 'shmem':
+    try:
+      from baselines.common.vec_env.shmem_vec_env import ShmemVecEnv
+      return ShmemVecEnv
+    except ImportError:
+      # Older baselines releases have no shared memory VecEnv
+      pass
+  from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+  return SubprocVecEnv
+
+
+class _EnvThunk(object):
+  ''' A picklable callable building one environment in a worker. '''
+  def __init__(self, env_id, seed, monitor_path, video_dir, env_kwargs):
+    self._env_id = env_id
+    self._seed = seed
+    self._monitor_path = monitor_path
+    self._video_dir = video_dir
+    self._env_kwargs = env_kwargs
+
+  def __call__(self):
+    entry = env_entry(self._env_id)
+    env = entry.builder(self._seed, self._monitor_path, self._video_dir,
+                        **self._env_kwargs)
+    env.seed(self._seed)
+    return env
+
+
+def _monitor_path(monitor_dir, rank):
+  if monitor_dir is None:
+    return None
+  return os.path.join(monitor_dir, str(rank))
+
+
+def _add_monitor(env, monitor_path, video_dir):
+  if video_dir is not None:
+    from gym.wrappers import Monitor as GymMonitor
+    return GymMonitor(env, video_dir, video_callable=lambda ep_id: True)
+  from baselines.bench import Monitor as BenchMonitor
+  return BenchMonitor(env, monitor_path)
+
+
+def _constant(value):
+  return lambda env_kwargs: value
+
+
+def register_atari(env_id):
+  def build_atari(seed, monitor_path, video_dir, **wrapper_kwargs):
+    from baselines.common.atari_wrappers import make_atari, wrap_deepmind
+    env = make_atari(env_id)
+    env = _add_monitor(env, monitor_path, video_dir)
+    return wrap_deepmind(env, **wrapper_kwargs)
+
+  register(env_id, build_atari, heavy=True, frame_stack=4,
+           frames_per_step=ATARI_FRAME_SKIP, cnn=True)
+
+
+def _build_gym(env_id):
+  def build_gym(seed, monitor_path, video_dir, **env_kwargs):
+    return _add_monitor(gym.make(env_id, **env_kwargs), monitor_path,
+                        video_dir)
+  return build_gym
+
+
+def _build_mountain_car(seed, monitor_path, video_dir, **env_kwargs):
+  return _add_monitor(make_mountain_car(**env_kwargs), monitor_path, video_dir)
+
+
+def _build_fake_atari(seed, monitor_path, video_dir, **env_kwargs):
+  return _add_monitor(FakeAtariEnv(**env_kwargs), monitor_path, video_dir)
+
+
+def _build_triple_pendulum(seed, monitor_path, video_dir, **env_kwargs):
+  _add_gaussian_processes_path()
+  from triple_pendulum_environment import TriplePendulumEnv
+  return _add_monitor(TriplePendulumEnv(**env_kwargs), monitor_path, video_dir)
+
+
+def _build_triple_pendulum_vec(num_env, seed, **env_kwargs):
+  _add_gaussian_processes_path()
+  from triple_pendulum_environment import TriplePendulumVecEnv
+  return TriplePendulumVecEnv(num_env, seed=seed, **env_kwargs)
+
+
+def _add_gaussian_processes_path():
+  if GAUSSIAN_PROCESSES_DIR not in sys.path:
+    sys.path.append(GAUSSIAN_PROCESSES_DIR)
+
+
+for _atari_game in ['Breakout', 'Pong', 'SpaceInvaders', 'Seaquest', 'Qbert']:
+  register_atari(_atari_game + ATARI_SUFFIX)
+
+for _gym_id in ['CartPole-v1', 'Acrobot-v1', 'Pendulum-v0',
+                'MountainCarContinuous-v0']:
+  register(_gym_id, _build_gym(_gym_id), heavy=False)
+
+register('ContinuousMountainCar', _build_mountain_car, heavy=False)
+register('TriplePendulum', _build_triple_pendulum, heavy=False,
+         vec_builder=_build_triple_pendulum_vec)
+register('FakeAtari', _build_fake_atari, cnn=True,
+         heavy=lambda env_kwargs: env_kwargs.get('step_cost', 0.0) > 0)
@@ -0,0 +1,191 @@
+"""
+Exports a trained A2C policy as a frozen inference graph and a SavedModel.
+
+Only the path from observations to actions and values is kept: the
+optimizer, losses, regularisers and summaries of the training graph are
+dropped, the variables are folded into constants, and the graph is
+simplified with the graph transform tool. The export directory holds
+
+  policy.pb        The frozen GraphDef, loaded by PolicyServer.
+  signature.json   The names, dtypes and shapes of its inputs and outputs.
+  saved_model/     The same graph as a SavedModel with a serving signature.
+"""
+
+import argparse
+import json
+import os
+
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from a2c import ActorCritic
+from checkpoint_manager import CHECKPOINT_SUFFIX, CheckpointManager
+from env_factory import env_entry, make_vec_env, registered_ids
+from networks import CNN_SPEC, MLP_SPEC, load_network_spec
+from policy_server import FROZEN_GRAPH_FILE, SIGNATURE_FILE
+
+SAVED_MODEL_DIR = 'saved_model'
+INPUT_NAMES = ['observations', 'states', 'masks']
+
+GRAPH_TRANSFORMS = [
+    'strip_unused_nodes',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'sort_by_execution_order',
+]
+
+
+def export_policy(sess, actor_critic, export_dir, optimize=True,
+                  saved_model=True):
+  ''' Freeze the inference path of actor_critic into export_dir.
+
+    # Params
+      sess: The session holding the trained variables.
+      actor_critic (ActorCritic): The policy, built in sess.graph.
+      export_dir (str): The directory to write to.
+      optimize (bool): Simplify the frozen graph with GRAPH_TRANSFORMS.
+      saved_model (bool): Also write a SavedModel.
+
+    # Returns
+      signature (dict): The inputs and outputs of the exported graph.
+  '''
+  tensors = actor_critic.inference_tensors
+  inputs = [name for name in INPUT_NAMES if name in tensors]
+  outputs = [name for name in sorted(tensors) if name not in INPUT_NAMES]
+  input_ops = [tensors[name].op.name for name in inputs]
+  output_ops = [tensors[name].op.name for name in outputs]
+
+  graph_def = tf.graph_util.convert_variables_to_constants(
+      sess, sess.graph.as_graph_def(), output_ops)
+  if optimize:
+    graph_def = TransformGraph(graph_def, input_ops, output_ops,
+                               GRAPH_TRANSFORMS)
+
+  if not os.path.exists(export_dir):
+    os.makedirs(export_dir)
+  with tf.gfile.GFile(os.path.join(export_dir, FROZEN_GRAPH_FILE), 'wb') as f:
+    f.write(graph_def.SerializeToString())
+
+  signature = {
+      'inputs': {name: _tensor_info(tensors[name]) for name in inputs},
+      'outputs': {name: _tensor_info(tensors[name]) for name in outputs},
+      'initial_state_size':
+          0 if actor_critic.initial_state is None
+          else int(actor_critic.initial_state.shape[0]),
+  }
+  with open(os.path.join(export_dir, SIGNATURE_FILE), 'w') as f:
+    json.dump(signature, f, indent=2)
+
+  if saved_model:
+    _write_saved_model(graph_def, signature,
+                       os.path.join(export_dir, SAVED_MODEL_DIR))
+  return signature
+
+
+def _tensor_info(tensor):
+  shape = tensor.shape.as_list() if tensor.shape.ndims is not None else None
+  return {'name': tensor.name, 'dtype': tensor.dtype.name, 'shape': shape}
+
+
+def _write_saved_model(graph_def, signature, path):
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.import_graph_def(graph_def, name='')
+    with tf.Session(graph=graph) as sess:
+      tf.saved_model.simple_save(
+          sess, path,
+          inputs={name: graph.get_tensor_by_name(info['name'])
+                  for name, info in signature['inputs'].items()},
+          outputs={name: graph.get_tensor_by_name(info['name'])
+                   for name, info in signature['outputs'].items()})
+
+
+def load_checkpoint(sess, checkpoint):
+  ''' Restore an .npz checkpoint written by A2CAgent, or a tf.train.Saver
+      checkpoint prefix.
+  '''
+  if checkpoint.endswith(CHECKPOINT_SUFFIX):
+    checkpoints = CheckpointManager(sess, os.path.dirname(checkpoint))
+    try:
+      checkpoints.restore(checkpoint)
+    finally:
+      checkpoints.close()
+  else:
+    tf.train.Saver().restore(sess, checkpoint)
+
+
+def main():
+  args = command_line_args()
+
+  entry = env_entry(args.env_id)
+  cnn = entry.cnn and not args.use_mlp
+  network_spec = load_network_spec(args.network_spec)
+  if args.lstm:
+    if network_spec is None:
+      network_spec = CNN_SPEC if cnn else MLP_SPEC
+    network_spec = dict(network_spec, lstm=args.lstm)
+
+  # The spaces of the training environment, with the same frame stacking
+  env = make_vec_env(args.env_id, 1, 0, backend='dummy',
+                     frame_stack=not args.lstm)
+  obs_space, act_space = env.observation_space, env.action_space
+  env.close()
+
+  graph = tf.Graph()
+  with graph.as_default():
+    sess = tf.Session(graph=graph)
+    actor_critic = ActorCritic(
+        sess=sess, obs_space=obs_space, act_space=act_space, cnn=cnn,
+        num_policy_updates=1, compute_dtype=args.compute_dtype,
+        network_spec=network_spec)
+    load_checkpoint(sess, args.checkpoint)
+    signature = export_policy(
+        sess, actor_critic, args.export_dir,
+        optimize=not args.no_optimize, saved_model=not args.no_saved_model)
+
+  print('Exported {} inputs {} and outputs {} to {}'.format(
+      args.env_id, sorted(signature['inputs']), sorted(signature['outputs']),
+      args.export_dir))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Exports a trained A2C policy as a frozen inference graph \
+      and a SavedModel.')
+  parser.add_argument(
+      '--checkpoint', type=str, required=True,
+      help='an .npz checkpoint, or the prefix of tf.train.Saver checkpoint \
+      files')
+  parser.add_argument(
+      '--export_dir', type=str, required=True,
+      help='the directory to write the exported policy to')
+  parser.add_argument(
+      '--env_id', type=str, default='BreakoutNoFrameskip-v4',
+      help='the environment the policy was trained on, one of {} or any '
+      'Atari <Game>NoFrameskip-v4'.format(registered_ids()))
+  parser.add_argument(
+      '--use_mlp', action='store_true',
+      help='the policy uses a multilayer perceptron architecture')
+  parser.add_argument(
+      '--compute_dtype', choices=['float32', 'float16', 'bfloat16'],
+      default='float32',
+      help='the precision the convolutional layers are computed in')
+  parser.add_argument(
+      '--network_spec', type=str, default=None,
+      help='the JSON network spec, or a file containing one, the policy was \
+      trained with')
+  parser.add_argument(
+      '--lstm', type=int, default=0,
+      help='the number of LSTM units of the policy')
+  parser.add_argument(
+      '--no_optimize', action='store_true',
+      help='write the frozen graph without graph transforms')
+  parser.add_argument(
+      '--no_saved_model', action='store_true',
+      help='only write the frozen graph')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,419 @@
+"""
+A micro-batching inference service, so many independent actors can share one
+policy.
+
+Actors submit single observations, in process (InferenceService.submit) or
+from other processes over a Unix socket (UnixSocketServer and
+InferenceClient). A worker thread gathers the pending requests into one batch,
+waiting at most max_latency after the first request of a batch arrives or
+until max_batch_size requests are waiting, runs one batched step of the
+policy and hands every actor its own action and value.
+
+Run as a script to serve a policy exported by export_policy.py.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import io
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Recent requests kept for the latency percentiles
+NUM_LATENCY_SAMPLES = 1000
+LATENCY_PERCENTILES = [50, 90, 99]
+_FRAME_HEADER = struct.Struct('!I')
+
+_Request = collections.namedtuple('_Request', [
+    'observation', 'state', 'episode_start', 'future', 'submit_time'])
+
+
+class InferenceService(object):
+  ''' Batches single observation requests into calls of a policy.
+
+      # Params
+        step_fn: The batched policy,
+            step_fn(observations, recurrent_states, episode_starts) returning
+            (actions, values, next_states), like ActorCritic.step and
+            PolicyServer.act. The states are None for feed forward policies.
+        max_batch_size (int): The most requests run in one call.
+        max_latency (float): Seconds the first request of a batch waits for
+            others to join it.
+        observation_shape (tuple): The shape of one observation, checked on
+            submit if given.
+        observation_dtype: The policy's observation dtype, checked on submit
+            if given.
+        recurrent (bool): Whether requests must carry a recurrent state,
+            checked on submit if given.
+  '''
+  def __init__(self, step_fn, max_batch_size=64, max_latency=0.005,
+               observation_shape=None, observation_dtype=None,
+               recurrent=None):
+    self._step_fn = step_fn
+    self._max_batch_size = max_batch_size
+    self._max_latency = max_latency
+    self._observation_shape = None if observation_shape is None \
+        else tuple(observation_shape)
+    self._observation_dtype = None if observation_dtype is None \
+        else np.dtype(observation_dtype)
+    self._recurrent = recurrent
+    self._requests = queue.Queue()
+
+    self._lock = threading.Lock()
+    self._num_requests = 0
+    self._num_batches = 0
+    self._max_queue_depth = 0
+    self._batch_sizes = collections.Counter()
+    self._latencies = collections.deque(maxlen=NUM_LATENCY_SAMPLES)
+
+    self._closed = False
+    self._thread = threading.Thread(target=self._serve)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, observation, recurrent_state=None, episode_start=False):
+    ''' Queue an observation for the next batch. Raises ValueError if the
+        request does not match the policy's observation shape, dtype or
+        recurrence, rather than failing the batch it would join.
+
+      # Returns
+        future (concurrent.futures.Future): Resolves to
+            (action, value, next_state).
+    '''
+    if self._closed:
+      raise RuntimeError('The inference service is closed')
+    observation = np.asarray(observation)
+    if self._observation_shape is not None \
+        and observation.shape != self._observation_shape:
+      raise ValueError('Observation of shape {}, the policy takes {}'.format(
+          observation.shape, self._observation_shape))
+    if self._observation_dtype is not None and not _castable(
+        observation.dtype, self._observation_dtype):
+      raise ValueError('Observation of dtype {}, the policy takes {}'.format(
+          observation.dtype, self._observation_dtype))
+    if self._recurrent is not None \
+        and (recurrent_state is not None) != self._recurrent:
+      raise ValueError('The policy is {}recurrent, the request has {}'.format(
+          '' if self._recurrent else 'not ',
+          'no recurrent state' if recurrent_state is None
+          else 'a recurrent state'))
+    future = concurrent.futures.Future()
+    self._requests.put(_Request(observation, recurrent_state,
+                                float(episode_start), future, time.time()))
+    return future
+
+  def act(self, observation, recurrent_state=None, episode_start=False):
+    ''' Block until the action for observation is ready. '''
+    return self.submit(observation, recurrent_state, episode_start).result()
+
+  def metrics(self):
+    ''' Counts of requests and batches, the mean and distribution of batch
+        sizes, the current and largest queue depth and percentiles of the
+        recent request latencies in seconds.
+    '''
+    with self._lock:
+      latencies = list(self._latencies)
+      stats = {
+          'num_requests': self._num_requests,
+          'num_batches': self._num_batches,
+          'mean_batch_size':
+              self._num_requests / float(max(self._num_batches, 1)),
+          'batch_sizes': dict(self._batch_sizes),
+          'queue_depth': self._requests.qsize(),
+          'max_queue_depth': self._max_queue_depth,
+      }
+    if latencies:
+      for percentile, value in zip(
+          LATENCY_PERCENTILES,
+          np.percentile(latencies, LATENCY_PERCENTILES)):
+        stats['latency_p{}'.format(percentile)] = float(value)
+    return stats
+
+  def close(self):
+    ''' Serve the queued requests and stop the worker. '''
+    self._closed = True
+    self._requests.put(None)
+    self._thread.join()
+
+  def _serve(self):
+    while True:
+      request = self._requests.get()
+      if request is None:
+        return
+      batch = [request]
+      queue_depth = self._requests.qsize() + 1
+      deadline = request.submit_time + self._max_latency
+
+      stop = False
+      while len(batch) < self._max_batch_size:
+        remaining = deadline - time.time()
+        try:
+          request = self._requests.get(timeout=max(remaining, 0.0)) \
+              if remaining > 0 else self._requests.get_nowait()
+        except queue.Empty:
+          break
+        if request is None:
+          stop = True
+          break
+        batch.append(request)
+
+      self._run_batch(batch, queue_depth)
+      if stop:
+        return
+
+  def _run_batch(self, batch, queue_depth):
+    try:
+      results = self._step(batch)
+    except Exception as e:  # pylint: disable=broad-except
+      if len(batch) == 1:
+        batch[0].future.set_exception(e)
+        return
+      # A request the checks on submit could not catch fails the whole
+      # batch, so run the requests one at a time and fail only the bad ones
+      for request in batch:
+        self._run_batch([request], queue_depth)
+      return
+
+    now = time.time()
+    for request, result in zip(batch, results):
+      request.future.set_result(result)
+
+    with self._lock:
+      self._num_requests += len(batch)
+      self._num_batches += 1
+      self._batch_sizes[len(batch)] += 1
+      self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+      self._latencies.extend(now - request.submit_time for request in batch)
+
+  def _step(self, batch):
+    observations = np.stack([request.observation for request in batch])
+    has_state = [request.state is not None for request in batch]
+    if any(has_state) != all(has_state):
+      raise ValueError('A batch mixes requests with and without states')
+    states, starts = None, None
+    if has_state[0]:
+      states = np.stack([request.state for request in batch])
+      starts = np.array([request.episode_start for request in batch],
+                        dtype=np.float32)
+    actions, values, next_states = self._step_fn(observations, states, starts)
+    values = np.reshape(values, [-1])
+    return [(actions[i], values[i],
+             None if next_states is None else next_states[i])
+            for i in range(len(batch))]
+
+
+class UnixSocketServer(object):
+  ''' Serves an InferenceService to other processes over a Unix socket. Each
+      connection is handled by its own thread, so requests from many clients
+      are batched together.
+
+      # Params
+        service (InferenceService): The service to forward requests to.
+        path (str): The socket path, replaced if it exists.
+  '''
+  def __init__(self, service, path):
+    if os.path.exists(path):
+      os.remove(path)
+    self.path = path
+
+    class Handler(socketserver.BaseRequestHandler):
+      def handle(self):
+        _handle_connection(service, self.request)
+
+    self._server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    self._server.daemon_threads = True
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def close(self):
+    self._server.shutdown()
+    self._server.server_close()
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+class InferenceClient(object):
+  ''' Requests actions from a UnixSocketServer. One request is in flight per
+      client; use a client per actor.
+  '''
+  def __init__(self, path):
+    self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._socket.connect(path)
+
+  def act(self, observation, recurrent_state=None, episode_start=False):
+    ''' The action, value and next recurrent state (None for a feed forward
+        policy) for observation.
+    '''
+    arrays = [np.asarray(observation)]
+    if recurrent_state is not None:
+      arrays += [np.asarray(recurrent_state),
+                 np.array(float(episode_start), dtype=np.float32)]
+    _send_arrays(self._socket, arrays)
+    response = _recv_arrays(self._socket)
+    if len(response) == 1:
+      raise RuntimeError(_decode_text(response[0]))
+    action, value = response[0], response[1]
+    next_state = response[2] if len(response) > 2 else None
+    return action, float(value), next_state
+
+  def metrics(self):
+    ''' The service's metrics, see InferenceService.metrics. '''
+    _send_arrays(self._socket, [])
+    return json.loads(_decode_text(_recv_arrays(self._socket)[0]))
+
+  def close(self):
+    self._socket.close()
+
+
+def _handle_connection(service, connection):
+  while True:
+    try:
+      arrays = _recv_arrays(connection)
+    except EOFError:
+      return
+
+    if not arrays:
+      _send_arrays(connection, [_encode_text(json.dumps(service.metrics()))])
+      continue
+
+    observation = arrays[0]
+    state = arrays[1] if len(arrays) > 1 else None
+    episode_start = bool(arrays[2]) if len(arrays) > 2 else False
+    try:
+      action, value, next_state = service.act(
+          observation, state, episode_start)
+    except Exception as e:  # pylint: disable=broad-except
+      _send_arrays(connection, [_encode_text(repr(e))])
+      continue
+
+    response = [np.asarray(action), np.asarray(value)]
+    if next_state is not None:
+      response.append(np.asarray(next_state))
+    _send_arrays(connection, response)
+
+
+def _castable(dtype, policy_dtype):
+  # Any integers pass for integer observations, e.g. a list of pixel values
+  # for uint8 frames, but not floats
+  if dtype.kind in 'biu' and policy_dtype.kind in 'iu':
+    return True
+  return np.can_cast(dtype, policy_dtype, casting='same_kind')
+
+
+def _send_arrays(connection, arrays):
+  # A message is the number of arrays followed by each array as a length
+  # prefixed .npy frame
+  frames = []
+  for array in arrays:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    frame = buffer.getvalue()
+    frames.append(_FRAME_HEADER.pack(len(frame)) + frame)
+  connection.sendall(_FRAME_HEADER.pack(len(arrays)) + b''.join(frames))
+
+
+def _recv_arrays(connection):
+  num_arrays = _FRAME_HEADER.unpack(
+      _recv_exactly(connection, _FRAME_HEADER.size))[0]
+  arrays = []
+  for _ in range(num_arrays):
+    length = _FRAME_HEADER.unpack(
+        _recv_exactly(connection, _FRAME_HEADER.size))[0]
+    arrays.append(np.load(io.BytesIO(_recv_exactly(connection, length)),
+                          allow_pickle=False))
+  return arrays
+
+
+def _recv_exactly(connection, num_bytes):
+  chunks = []
+  while num_bytes > 0:
+    chunk = connection.recv(num_bytes)
+    if not chunk:
+      raise EOFError('Connection closed')
+    chunks.append(chunk)
+    num_bytes -= len(chunk)
+  return b''.join(chunks)
+
+
+def _encode_text(text):
+  return np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_text(array):
+  return array.tobytes().decode('utf-8')
+
+
+def main():
+  args = command_line_args()
+
+  # Imported here so the service itself does not need tensorflow
+  from policy_server import PolicyServer
+  policy = PolicyServer(args.export_dir, num_threads=args.num_threads,
+                        warmup=True)
+
+  def step_fn(observations, recurrent_states, episode_starts):
+    return policy.act(observations, recurrent_states, episode_starts,
+                      greedy=args.greedy)
+
+  service = InferenceService(
+      step_fn, max_batch_size=args.max_batch_size,
+      max_latency=args.max_latency_ms / 1000.0,
+      observation_shape=policy.observation_shape,
+      observation_dtype=policy.observation_dtype, recurrent=policy.recurrent)
+  server = UnixSocketServer(service, args.socket)
+  stop = threading.Event()
+  signal.signal(signal.SIGTERM, lambda *_: stop.set())
+  server.start()
+  print('Serving {} on {}'.format(args.export_dir, args.socket))
+  try:
+    while not stop.wait(1.0):
+      pass
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+    service.close()
+    policy.close()
+    print(json.dumps(service.metrics(), indent=2))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Serves an exported A2C policy to many actors over a Unix \
+      socket, batching their requests.')
+  parser.add_argument(
+      '--export_dir', type=str, required=True,
+      help='a directory written by export_policy.py')
+  parser.add_argument(
+      '--socket', type=str, default='/tmp/a2c_policy.sock',
+      help='the Unix socket to listen on')
+  parser.add_argument(
+      '--max_batch_size', type=int, default=64,
+      help='the most requests run in one batch')
+  parser.add_argument(
+      '--max_latency_ms', type=float, default=5.0,
+      help='milliseconds the first request of a batch waits for others')
+  parser.add_argument(
+      '--num_threads', type=int, default=1,
+      help='tensorflow thread pool sizes, 0 lets tensorflow choose')
+  parser.add_argument(
+      '--greedy', action='store_true',
+      help='take the most likely actions instead of sampling')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
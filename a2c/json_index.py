@@ -0,0 +1,25 @@
+"""
+The JSON index files of the on-disk logs and stores (metrics logs,
+checkpoints, weight histories, embedding stores). An index is written to a
+temporary file and renamed over the old one, so readers and crashed writers
+never leave a partial index.
+"""
+
+import json
+import os
+
+
+def read_index(path):
+  ''' The index at path, None if there is none. '''
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+
+def write_index(path, index, indent=None):
+  ''' Atomically replace the index at path. '''
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(index, f, indent=indent)
+  os.rename(tmp_path, path)
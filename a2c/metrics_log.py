@@ -0,0 +1,235 @@
+"""
+An append-only, chunked columnar log of training metrics.
+
+A log is a directory with one subdirectory per column, holding the column in
+.npy chunks of chunk_size rows, and index.json listing the columns and the
+number of rows of each chunk:
+
+  train/
+    index.json
+    step/000000.npy, 000001.npy, ...
+    entropy/000000.npy, ...
+
+Rows are buffered in memory and a chunk is written (to a temporary file which
+is renamed, so readers never see a partial chunk) when it fills up or the log
+is flushed. Readers memory map the chunks, so plotting a long run only pages
+in the chunks it touches, and running averages are computed chunk by chunk.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from json_index import read_index, write_index
+
+INDEX_FILE = 'index.json'
+STEP_COLUMN = 'step'
+CHUNK_SUFFIX = '.npy'
+
+
+class MetricsLogWriter(object):
+  ''' Streams rows of scalars into a metrics log.
+
+      # Params
+        directory (str): The log directory, appended to if it exists.
+        chunk_size (int): Rows per chunk file.
+  '''
+  def __init__(self, directory, chunk_size=65536):
+    self._directory = directory
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+
+    index = _read_index(directory)
+    if index is not None:
+      chunk_size = index['chunk_size']
+      self._chunk_rows = index['chunk_rows']
+      self._columns = index['columns']
+      # Continue a partially filled last chunk
+      if self._chunk_rows and self._chunk_rows[-1] < chunk_size:
+        num_rows = self._chunk_rows.pop()
+      else:
+        num_rows = 0
+    else:
+      self._chunk_rows = []
+      self._columns = [STEP_COLUMN]
+      num_rows = 0
+
+    self._chunk_size = chunk_size
+    self._buffers = {}
+    self._num_rows = 0
+    for column in self._columns:
+      self._buffers[column] = self._new_buffer()
+    if num_rows:
+      chunk_index = len(self._chunk_rows)
+      for column in self._columns:
+        path = _chunk_path(directory, column, chunk_index)
+        if os.path.exists(path):
+          self._buffers[column][:num_rows] = np.load(path)
+      self._num_rows = num_rows
+
+  def append(self, step, **values):
+    ''' Add a row. Columns missing from the row are NaN, and a column seen
+        for the first time is NaN in all earlier rows.
+
+      # Params
+        step (int): The x value of the row, e.g. the number of environment
+            steps.
+        values: Scalar values by column name.
+    '''
+    for column in values:
+      if column not in self._buffers:
+        self._columns.append(column)
+        self._buffers[column] = self._new_buffer()
+
+    row = self._num_rows
+    for column, buffer in self._buffers.items():
+      buffer[row] = values.get(column, np.nan)
+    self._buffers[STEP_COLUMN][row] = step
+    self._num_rows += 1
+
+    if self._num_rows == self._chunk_size:
+      self._write_chunk()
+      self._chunk_rows.append(self._num_rows)
+      self._num_rows = 0
+      self._write_index()
+
+  def flush(self):
+    ''' Write the rows of the partially filled chunk. '''
+    if self._num_rows:
+      self._write_chunk()
+    self._write_index()
+
+  def close(self):
+    self.flush()
+
+  def _new_buffer(self):
+    return np.full(self._chunk_size, np.nan, dtype=np.float64)
+
+  def _write_chunk(self):
+    chunk_index = len(self._chunk_rows)
+    for column, buffer in self._buffers.items():
+      column_dir = os.path.join(self._directory, column)
+      if not os.path.exists(column_dir):
+        os.makedirs(column_dir)
+      path = _chunk_path(self._directory, column, chunk_index)
+      # np.save appends .npy to names without it
+      tmp_path = path + '.tmp' + CHUNK_SUFFIX
+      np.save(tmp_path, buffer[:self._num_rows])
+      os.rename(tmp_path, path)
+      if self._num_rows == self._chunk_size:
+        buffer.fill(np.nan)
+
+  def _write_index(self):
+    chunk_rows = list(self._chunk_rows)
+    if self._num_rows:
+      chunk_rows.append(self._num_rows)
+    write_index(os.path.join(self._directory, INDEX_FILE),
+                {'chunk_size': self._chunk_size, 'columns': self._columns,
+                 'chunk_rows': chunk_rows})
+
+
+class MetricsLogReader(object):
+  ''' Reads a metrics log written by MetricsLogWriter, memory mapping its
+      chunks. Rows written after the reader was opened are not seen.
+  '''
+  def __init__(self, directory):
+    index = _read_index(directory)
+    if index is None:
+      raise ValueError('No metrics log in {}'.format(directory))
+    self._directory = directory
+    self._chunk_rows = index['chunk_rows']
+    self.columns = index['columns']
+
+  @property
+  def num_rows(self):
+    return sum(self._chunk_rows)
+
+  def chunks(self, column):
+    ''' Yield (steps, values) of each chunk as memory mapped arrays. Chunks
+        from before the column was added are all NaN.
+    '''
+    if column not in self.columns:
+      raise ValueError('No column {}, choose from {}'.format(
+          column, self.columns))
+    for chunk_index, num_rows in enumerate(self._chunk_rows):
+      steps = self._load(STEP_COLUMN, chunk_index, num_rows)
+      values = self._load(column, chunk_index, num_rows)
+      yield steps, values
+
+  def column(self, column):
+    ''' The whole column and its steps, dropping NaN rows. Loads the column
+        into memory; prefer chunks or running_mean for long logs.
+    '''
+    steps, values = [], []
+    for chunk_steps, chunk_values in self.chunks(column):
+      valid = ~np.isnan(chunk_values)
+      steps.append(chunk_steps[valid])
+      values.append(chunk_values[valid])
+    if not steps:
+      return np.empty(0), np.empty(0)
+    return np.concatenate(steps), np.concatenate(values)
+
+  def running_mean(self, column, window, max_points=0):
+    ''' The trailing mean of the last window values of column, computed
+        incrementally chunk by chunk, so only one chunk and window values
+        are in memory at a time. The first window - 1 points average all
+        values so far. NaN rows are skipped.
+
+      # Params
+        column (str): The column to average.
+        window (int): The number of values averaged.
+        max_points (int): Keep every n-th point so at most about max_points
+            are returned, 0 to keep all.
+
+      # Returns
+        steps: The step of each point.
+        means: The running mean at each point.
+    '''
+    stride = 1
+    if max_points:
+      stride = max(1, int(math.ceil(self.num_rows / float(max_points))))
+
+    carry = np.empty(0)
+    num_seen = 0
+    out_steps, out_means = [], []
+    for steps, values in self.chunks(column):
+      valid = ~np.isnan(values)
+      steps, values = steps[valid], np.asarray(values[valid])
+      if values.size == 0:
+        continue
+
+      # Cumulative sums over the carried window and this chunk only, so the
+      # sums stay small however long the log is
+      x = np.concatenate([carry, values])
+      cumsum = np.concatenate([[0.0], np.cumsum(x)])
+      k = np.arange(values.size)
+      end = carry.size + k + 1
+      count = np.minimum(num_seen + k + 1, window)
+      means = (cumsum[end] - cumsum[end - count]) / count
+
+      keep = (num_seen + k) % stride == 0
+      out_steps.append(steps[keep])
+      out_means.append(means[keep])
+
+      carry = x[-(window - 1):] if window > 1 else np.empty(0)
+      num_seen += values.size
+
+    if not out_steps:
+      return np.empty(0), np.empty(0)
+    return np.concatenate(out_steps), np.concatenate(out_means)
+
+  def _load(self, column, chunk_index, num_rows):
+    path = _chunk_path(self._directory, column, chunk_index)
+    if not os.path.exists(path):
+      return np.full(num_rows, np.nan)
+    return np.load(path, mmap_mode='r')[:num_rows]
+
+
+def _chunk_path(directory, column, chunk_index):
+  return os.path.join(directory, column,
+                      '{:06d}{}'.format(chunk_index, CHUNK_SUFFIX))
+
+
+def _read_index(directory):
+  return read_index(os.path.join(directory, INDEX_FILE))
@@ -0,0 +1,247 @@
+"""
+Declarative network specifications for the ActorCritic trunk.
+
+A spec is a dict, which can be loaded from JSON, with the keys
+  conv: List of [filters, kernel_size, stride] convolutional layers, applied to
+      uint8 pixel observations which are scaled to [0, 1] in the graph.
+  dense: List of fully connected layer sizes applied after the convolutions.
+  shared: Whether the actor and critic share one trunk or each get their own.
+  lstm: The number of units of an LSTM applied after the trunk, 0 for a feed
+      forward network. An LSTM needs a shared trunk.
+
+Only the ops the model uses are built. Activation histograms and the unused L2
+regularisers of the original graph are opt in.
+"""
+
+import json
+import os
+
+import tensorflow as tf
+
+MAX_PIXEL_VALUE = 255.0
+
+# The CNN architecture as described in the A3C Paper
+CNN_SPEC = {'conv': [[16, 8, 4], [32, 4, 2]], 'dense': [256], 'shared': True}
+MLP_SPEC = {'conv': [], 'dense': [64, 64], 'shared': True}
+
+CRITIC_TRUNK_SCOPE = 'critic_trunk'
+
+
+def validate_spec(spec):
+  ''' Check a network spec and fill in missing keys with their defaults.
+
+    # Params
+      spec (dict): The network spec.
+
+    # Returns
+      spec (dict): A copy of the spec with every key present.
+  '''
+  unknown_keys = set(spec.keys()) - {'conv', 'dense', 'shared', 'lstm'}
+  if unknown_keys:
+    raise ValueError('Unknown network spec keys: {}'.format(
+        sorted(unknown_keys)))
+
+  conv = [list(layer) for layer in spec.get('conv', [])]
+  for layer in conv:
+    if len(layer) != 3 or not all(
+        isinstance(x, int) and x > 0 for x in layer):
+      raise ValueError('Conv layers are [filters, kernel_size, stride] '
+                       'positive integers, got {}'.format(layer))
+
+  dense = list(spec.get('dense', []))
+  if not all(isinstance(units, int) and units > 0 for units in dense):
+    raise ValueError('Dense layer sizes must be positive integers, got '
+                     '{}'.format(dense))
+
+  if not conv and not dense:
+    raise ValueError('A network spec needs at least one layer')
+
+  shared = bool(spec.get('shared', True))
+  lstm = spec.get('lstm', 0)
+  if not isinstance(lstm, int) or lstm < 0:
+    raise ValueError('The LSTM size must be a non-negative integer, got '
+                     '{}'.format(lstm))
+  if lstm and not shared:
+    raise ValueError('An LSTM needs the actor and critic to share a trunk')
+
+  return {'conv': conv, 'dense': dense, 'shared': shared, 'lstm': lstm}
+
+
+def load_network_spec(network_spec):
+  ''' Parse a network spec given as a JSON string or the path of a JSON file.
+  '''
+  if network_spec is None:
+    return None
+  if os.path.isfile(network_spec):
+    with open(network_spec) as f:
+      return json.load(f)
+  return json.loads(network_spec)
+
+
+def build_trunks(inputs, spec, compute_dtype=tf.float32, histograms=False,
+                 legacy=False):
+  ''' Build the hidden layers feeding the actor and critic heads.
+
+    # Params
+      inputs: The observation placeholder.
+      spec (dict): The network spec.
+      compute_dtype: The dtype the layers are computed in. Variables are always
+          stored in float32.
+      histograms (bool): Add activation histogram summaries.
+      legacy (bool): Rebuild the original graph, with L2 regularisers and
+          histograms on every layer, for comparison.
+
+    # Returns
+      actor_hidden: The features for the actor head (float32).
+      critic_hidden: The features for the critic head (float32), the same
+          tensor as actor_hidden if the trunk is shared.
+  '''
+  spec = validate_spec(spec)
+  histograms = histograms or legacy
+
+  actor_hidden = _build_trunk(inputs, spec, compute_dtype, histograms, legacy)
+  if spec['shared']:
+    return actor_hidden, actor_hidden
+
+  with tf.variable_scope(CRITIC_TRUNK_SCOPE):
+    critic_hidden = _build_trunk(
+        inputs, spec, compute_dtype, histograms, legacy)
+  return actor_hidden, critic_hidden
+
+
+def build_lstm(features, states, masks, units):
+  ''' An LSTM over the trunk features of n_envs sequences, unrolled with a
+      single scan. The input projection of every time step is one matmul
+      before the scan, so only the recurrent matmul is sequential.
+
+    # Params
+      features: Trunk features, dimension [n_envs * n_steps, feature_dim],
+          ordered environment major as the runner lays out rollouts.
+      states: The cell and hidden states at the first step, concatenated,
+          dimension [n_envs, 2 * units].
+      masks: 1.0 where an episode starts at that step (the environment was
+          done on the previous step) and the state is reset, dimension
+          [n_envs * n_steps].
+      units (int): The LSTM size.
+
+    # Returns
+      outputs: The hidden states, dimension [n_envs * n_steps, units]
+      final_states: The states after the last step, dimension
+          [n_envs, 2 * units]
+  '''
+  n_envs = tf.shape(states)[0]
+  feature_dim = features.shape[-1].value
+
+  with tf.variable_scope('lstm'):
+    input_kernel = tf.get_variable(
+        'input_kernel', shape=[feature_dim, 4 * units],
+        initializer=tf.glorot_normal_initializer())
+    recurrent_kernel = tf.get_variable(
+        'recurrent_kernel', shape=[units, 4 * units],
+        initializer=tf.orthogonal_initializer())
+    bias = tf.get_variable(
+        'bias', shape=[4 * units], initializer=tf.zeros_initializer())
+
+  # [n_envs * n_steps, ...] to time major [n_steps, n_envs, ...]
+  projected = tf.matmul(features, input_kernel) + bias
+  projected = tf.transpose(
+      tf.reshape(projected, [n_envs, -1, 4 * units]), [1, 0, 2])
+  resets = tf.transpose(tf.reshape(masks, [n_envs, -1]))[:, :, tf.newaxis]
+  cell, hidden = tf.split(states, 2, axis=1)
+
+  def _lstm_step(carry, inputs):
+    cell, hidden = carry
+    projected_input, reset = inputs
+    cell = cell * (1.0 - reset)
+    hidden = hidden * (1.0 - reset)
+    gates = projected_input + tf.matmul(hidden, recurrent_kernel)
+    input_gate, forget_gate, output_gate, update = tf.split(gates, 4, axis=1)
+    cell = tf.sigmoid(forget_gate) * cell \
+        + tf.sigmoid(input_gate) * tf.tanh(update)
+    hidden = tf.sigmoid(output_gate) * tf.tanh(cell)
+    return cell, hidden
+
+  cells, hiddens = tf.scan(
+      _lstm_step, (projected, resets), initializer=(cell, hidden))
+
+  outputs = tf.reshape(tf.transpose(hiddens, [1, 0, 2]), [-1, units])
+  final_states = tf.concat([cells[-1], hiddens[-1]], axis=1)
+  return outputs, final_states
+
+
+def _build_trunk(inputs, spec, compute_dtype, histograms, legacy):
+  if compute_dtype != tf.float32:
+    # Keep float32 master copies of the trunk variables and only cast them to
+    # the compute dtype where they are used, so the optimizer updates float32
+    # weights.
+    with tf.variable_scope(tf.get_variable_scope(),
+                           custom_getter=_float32_variable_storage_getter,
+                           auxiliary_name_scope=False):
+      hidden = _build_layers(inputs, spec, compute_dtype, histograms, legacy)
+    return tf.cast(hidden, tf.float32)
+
+  return _build_layers(inputs, spec, compute_dtype, histograms, legacy)
+
+
+def _build_layers(inputs, spec, compute_dtype, histograms, legacy):
+  regularizer = tf.nn.l2_loss if legacy else None
+
+  if spec['conv']:
+    # Observations stay uint8 until here; one multiply scales them to [0, 1]
+    hidden = tf.cast(inputs, compute_dtype) \
+        * tf.constant(1.0 / MAX_PIXEL_VALUE, dtype=compute_dtype)
+  else:
+    hidden = tf.cast(inputs, compute_dtype)
+
+  for i, (filters, kernel_size, stride) in enumerate(spec['conv']):
+    name = 'conv_{}'.format(i + 1)
+    hidden = tf.layers.conv2d(
+        inputs=hidden,
+        filters=filters,
+        kernel_size=[kernel_size, kernel_size],
+        strides=[stride, stride],
+        padding="same",
+        activation=tf.nn.relu,
+        kernel_initializer=tf.glorot_normal_initializer(),
+        use_bias=True,
+        bias_initializer=tf.zeros_initializer(),
+        data_format='channels_last',
+        name=name,
+        kernel_regularizer=regularizer)
+    if histograms:
+      tf.summary.histogram(name, tf.cast(hidden, tf.float32))
+
+  if spec['conv']:
+    hidden = tf.layers.flatten(hidden)
+
+  for i, units in enumerate(spec['dense']):
+    name = _dense_layer_name(i, bool(spec['conv']))
+    hidden = tf.layers.dense(
+        inputs=hidden, units=units, activation=tf.nn.relu, name=name,
+        kernel_initializer=tf.glorot_normal_initializer(), use_bias=True,
+        bias_initializer=tf.zeros_initializer(),
+        kernel_regularizer=regularizer)
+    if histograms:
+      tf.summary.histogram(name, tf.cast(hidden, tf.float32))
+
+  return hidden
+
+
+def _dense_layer_name(index, after_conv):
+  # Matches the layer names of the original fixed architectures, so existing
+  # checkpoints and plots keep working
+  if not after_conv:
+    return 'dense_{}'.format(index)
+  return 'conv_fc' if index == 0 else 'conv_fc_{}'.format(index)
+
+
+def _float32_variable_storage_getter(getter, name, shape=None, dtype=None,
+                                     initializer=None, regularizer=None,
+                                     trainable=True, *args, **kwargs):
+  storage_dtype = tf.float32 if trainable else dtype
+  variable = getter(name, shape, dtype=storage_dtype, initializer=initializer,
+                    regularizer=regularizer, trainable=trainable,
+                    *args, **kwargs)
+  if trainable and dtype != tf.float32:
+    variable = tf.cast(variable, dtype)
+  return variable
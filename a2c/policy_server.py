@@ -0,0 +1,143 @@
+"""
+Serves a policy exported by export_policy.py. Only tensorflow and numpy are
+needed: the training graph, gym and baselines are not imported.
+"""
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+FROZEN_GRAPH_FILE = 'policy.pb'
+SIGNATURE_FILE = 'signature.json'
+
+
+class PolicyServer(object):
+  ''' Batched inference with a frozen A2C policy.
+
+      The graph is loaded once and each combination of outputs is compiled
+      into a session callable, so a request is a single call into the
+      runtime with no graph or feed lookups. Requests larger than
+      max_batch_size are split, bounding the peak memory of a call.
+
+      # Params
+        export_dir (str): A directory written by export_policy.
+        num_threads (int): Tensorflow thread pool sizes, 0 lets tensorflow
+            choose. One thread gives the lowest latency for small batches.
+        max_batch_size (int): The largest batch run in one call, 0 for no
+            limit.
+        warmup (bool): Run a request at load time, so the first real request
+            does not pay for the runtime's initialisation.
+  '''
+  def __init__(self, export_dir, num_threads=1, max_batch_size=0,
+               warmup=True):
+    with open(os.path.join(export_dir, SIGNATURE_FILE)) as f:
+      self._signature = json.load(f)
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(os.path.join(export_dir, FROZEN_GRAPH_FILE), 'rb') as f:
+      graph_def.ParseFromString(f.read())
+
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      tf.import_graph_def(graph_def, name='')
+    tf_config = tf.ConfigProto(
+        inter_op_parallelism_threads=num_threads,
+        intra_op_parallelism_threads=num_threads)
+    self._sess = tf.Session(graph=self._graph, config=tf_config)
+
+    self._max_batch_size = max_batch_size
+    self._inputs = sorted(self._signature['inputs'])
+    self._callables = {}
+
+    obs_info = self._signature['inputs']['observations']
+    self.observation_shape = tuple(obs_info['shape'][1:])
+    self.observation_dtype = np.dtype(obs_info['dtype'])
+    state_size = self._signature['initial_state_size']
+    self.initial_state = np.zeros(state_size, dtype=np.float32) \
+        if state_size else None
+
+    if warmup:
+      self.act(np.zeros((1,) + self.observation_shape,
+                        dtype=self.observation_dtype))
+
+  @property
+  def recurrent(self):
+    return self.initial_state is not None
+
+  def act(self, observations, recurrent_states=None, episode_starts=None,
+          greedy=False):
+    ''' Actions and values for a batch of observations.
+
+      # Params
+        observations: Observations, dimension (batch, obs_dim).
+        recurrent_states: LSTM states of each observation's episode, initial
+            states if None. Only for recurrent policies.
+        episode_starts: 1.0 for observations starting an episode, all ones if
+            None. Only for recurrent policies.
+        greedy (bool): Take the most likely actions instead of sampling.
+
+      # Returns
+        actions: The actions, dimension (batch, ...)
+        values: The predicted values, dimension (batch,)
+        recurrent_states: The states after the observations, None for a feed
+            forward policy
+    '''
+    observations = np.asarray(observations, dtype=self.observation_dtype)
+    batch_size = observations.shape[0]
+    if self.recurrent and recurrent_states is None:
+      recurrent_states, episode_starts = self._initial_inputs(batch_size)
+
+    chunk_size = self._max_batch_size or batch_size
+    results = []
+    for begin in range(0, batch_size, chunk_size):
+      end = begin + chunk_size
+      feeds = {'observations': observations[begin:end]}
+      if self.recurrent:
+        feeds['states'] = recurrent_states[begin:end]
+        feeds['masks'] = episode_starts[begin:end]
+      results.append(self._run(feeds, greedy))
+
+    actions = np.concatenate([result[0] for result in results])
+    # The critic output is squeezed, so a batch of one comes back a scalar
+    values = np.concatenate(
+        [np.reshape(result[1], [-1]) for result in results])
+    next_states = None
+    if self.recurrent:
+      next_states = np.concatenate([result[2] for result in results])
+    return actions, values, next_states
+
+  def act_one(self, observation, recurrent_state=None, episode_start=False,
+              greedy=False):
+    ''' The action and value for a single observation. '''
+    states, starts = None, None
+    if self.recurrent:
+      if recurrent_state is None:
+        recurrent_state, episode_start = self.initial_state, True
+      states = recurrent_state[np.newaxis]
+      starts = np.array([float(episode_start)], dtype=np.float32)
+    actions, values, next_states = self.act(
+        np.asarray(observation)[np.newaxis], states, starts, greedy)
+    return (actions[0], values[0],
+            None if next_states is None else next_states[0])
+
+  def close(self):
+    self._sess.close()
+
+  def _initial_inputs(self, batch_size):
+    if not self.recurrent:
+      return None, None
+    return (np.tile(self.initial_state, (batch_size, 1)),
+            np.ones(batch_size, dtype=np.float32))
+
+  def _run(self, feeds, greedy):
+    if greedy not in self._callables:
+      outputs = ['greedy_actions' if greedy else 'actions', 'values']
+      if self.recurrent:
+        outputs.append('next_states')
+      fetches = [self._graph.get_tensor_by_name(
+          self._signature['outputs'][name]['name']) for name in outputs]
+      feed_list = [self._graph.get_tensor_by_name(
+          self._signature['inputs'][name]['name']) for name in self._inputs]
+      self._callables[greedy] = self._sess.make_callable(fetches, feed_list)
+    return self._callables[greedy](*[feeds[name] for name in self._inputs])
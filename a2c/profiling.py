@@ -0,0 +1,93 @@
+import collections
+import contextlib
+import time
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+# The phases of a training update, in the order they are reported
+PHASES = ['env_step', 'inference', 'returns', 'replay', 'train', 'summaries',
+          'eval', 'checkpoint']
+
+
+class PhaseTimer(object):
+  ''' Accumulates the wall clock time spent in named phases of the training
+      loop between reports. Timing a phase costs two time.time() calls.
+  '''
+  def __init__(self):
+    self._seconds = collections.defaultdict(float)
+    self._num_updates = 0
+    self._num_steps = 0
+    self._report_time = time.time()
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self._seconds[name] += time.time() - start_time
+
+  def end_update(self, num_steps):
+    ''' Mark the end of a policy update which consumed num_steps environment
+        steps.
+    '''
+    self._num_updates += 1
+    self._num_steps += num_steps
+
+  def report(self, frames_per_step=1):
+    ''' Summarise the time since the last report and start a new interval.
+
+      # Params
+        frames_per_step (int): Emulator frames per environment step, for
+            environments that skip frames.
+
+      # Returns
+        stats (dict): The mean seconds per update of each phase (time_<phase>),
+            the time outside the timed phases (time_other), and the
+            steps_per_second and frames_per_second over the interval.
+    '''
+    now = time.time()
+    elapsed = max(now - self._report_time, 1e-12)
+    num_updates = max(self._num_updates, 1)
+
+    stats = {}
+    for name in PHASES + sorted(set(self._seconds) - set(PHASES)):
+      stats['time_' + name] = self._seconds.get(name, 0.0) / num_updates
+    stats['time_other'] = max(
+        elapsed - sum(self._seconds.values()), 0.0) / num_updates
+    stats['steps_per_second'] = self._num_steps / elapsed
+    stats['frames_per_second'] = \
+        self._num_steps * frames_per_step / elapsed
+
+    self._seconds.clear()
+    self._num_updates = 0
+    self._num_steps = 0
+    self._report_time = now
+    return stats
+
+
+class NullTimer(object):
+  ''' A PhaseTimer that records nothing. '''
+  @contextlib.contextmanager
+  def phase(self, name):
+    yield
+
+  def end_update(self, num_steps):
+    pass
+
+
+def stats_summary(stats, prefix):
+  ''' Pack a dict of scalars into a tensorboard Summary under prefix/. '''
+  return tf.Summary(value=[
+      tf.Summary.Value(tag='{}/{}'.format(prefix, key), simple_value=value)
+      for key, value in sorted(stats.items())])
+
+
+def write_timeline(run_metadata, path):
+  ''' Write the step stats of a traced session run as a Chrome trace, which
+      can be opened at chrome://tracing.
+  '''
+  trace = timeline.Timeline(run_metadata.step_stats)
+  with open(path, 'w') as f:
+    f.write(trace.generate_chrome_trace_format())
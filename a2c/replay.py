@@ -0,0 +1,96 @@
+"""
+Experience reuse for A2C: a bounded buffer of recent rollouts and V-trace
+off-policy corrected returns (Espeholt et al. 2018, IMPALA), so each rollout
+can be learnt from more than once after the policy which collected it has
+moved on.
+"""
+
+import collections
+
+import numpy as np
+
+# exp() of log ratios above this overflows float32
+MAX_LOG_RHO = 80.0
+
+
+class RolloutBuffer(object):
+  ''' Keeps the most recent rollouts, dropping the oldest when full.
+
+      # Params
+        capacity (int): The number of rollouts to keep.
+  '''
+  def __init__(self, capacity):
+    self._rollouts = collections.deque(maxlen=capacity)
+
+  def __len__(self):
+    return len(self._rollouts)
+
+  def add(self, rollout):
+    ''' Store a rollout recorded with its behaviour log probabilities. The
+        observations are copied, as the runner reuses its buffer.
+    '''
+    if rollout.log_probs is None:
+      raise ValueError('Rollouts must be recorded with log probabilities to '
+                       'be replayed')
+    self._rollouts.append(rollout._replace(
+        observations=np.copy(rollout.observations)))
+
+  def rollouts(self, rng=np.random):
+    ''' The stored rollouts in a random order. '''
+    order = rng.permutation(len(self._rollouts))
+    return [self._rollouts[i] for i in order]
+
+
+def vtrace(behaviour_log_probs, target_log_probs, rewards, dones, values,
+           bootstrap_values, gamma, rho_max=1.0, c_max=1.0):
+  r''' V-trace targets and policy gradient advantages for a batch of
+      rollouts. All environments are corrected at once; only the recursion
+      over the steps of the rollout is sequential.
+
+    # Params
+      behaviour_log_probs: Log probabilities of the actions under the policy
+          which took them (dimension [n_envs, n_steps])
+      target_log_probs: Log probabilities of the actions under the current
+          policy (dimension [n_envs, n_steps])
+      rewards: Immediate rewards (dimension [n_envs, n_steps])
+      dones: Done flags after each step (dimension [n_envs, n_steps])
+      values: Current value estimates of the observations (dimension
+          [n_envs, n_steps])
+      bootstrap_values: Current value estimates of the observations after the
+          rollout (dimension [n_envs])
+      gamma (float): The discounting factor.
+      rho_max (float): Truncation $\bar{\rho}$ of the importance weights in
+          the temporal differences, which sets the value function V-trace
+          converges to.
+      c_max (float): Truncation $\bar{c}$ of the trace coefficients, which
+          sets the speed of convergence.
+
+    # Returns
+      vs: The V-trace value targets (dimension [n_envs, n_steps])
+      advantages: The importance weighted policy gradient advantages
+          $\rho_t(r_t + \gamma v_{t+1} - V(x_t))$ (dimension [n_envs, n_steps])
+      rhos: The untruncated importance weights (dimension [n_envs, n_steps])
+  '''
+  log_rhos = np.minimum(target_log_probs - behaviour_log_probs, MAX_LOG_RHO)
+  rhos = np.exp(log_rhos)
+  clipped_rhos = np.minimum(rhos, rho_max)
+  cs = np.minimum(rhos, c_max)
+
+  discounts = gamma * (1.0 - dones.astype(np.float32))
+  next_values = np.concatenate(
+      [values[:, 1:], bootstrap_values[:, np.newaxis]], axis=1)
+  deltas = clipped_rhos * (rewards + discounts * next_values - values)
+
+  # v_s - V(x_s) = delta_s + gamma c_s (v_{s+1} - V(x_{s+1}))
+  corrections = np.empty_like(deltas)
+  acc = np.zeros_like(bootstrap_values)
+  for t in reversed(range(deltas.shape[1])):
+    acc = deltas[:, t] + discounts[:, t] * cs[:, t] * acc
+    corrections[:, t] = acc
+  vs = values + corrections
+
+  next_vs = np.concatenate(
+      [vs[:, 1:], bootstrap_values[:, np.newaxis]], axis=1)
+  advantages = clipped_rhos * (rewards + discounts * next_vs - values)
+  return (vs.astype(np.float32), advantages.astype(np.float32),
+          rhos.astype(np.float32))
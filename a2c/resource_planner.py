@@ -0,0 +1,126 @@
+"""
+Splits the cores of the machine between the environment worker processes and
+the tensorflow learner, so they do not oversubscribe it.
+
+Without a plan every env worker and both of the learner's thread pools
+compete for all cores: with 16 Atari workers and inter and intra op pools of
+cpu_count() threads each, several times more runnable threads than cores. A
+ResourcePlan gives the env workers and the learner disjoint sets of cores,
+pins them there, and sizes the learner's thread pools to its share.
+"""
+
+import collections
+import multiprocessing
+import os
+
+# The A2C graph has little parallelism between ops, so a couple of inter op
+# threads keep the intra op pool busy
+MAX_INTER_OP_THREADS = 2
+
+ResourcePlan = collections.namedtuple('ResourcePlan', [
+    'env_cpus', 'learner_cpus', 'inter_op_threads', 'intra_op_threads'])
+
+
+def available_cpus():
+  ''' The cores this process may run on. '''
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(multiprocessing.cpu_count()))
+
+
+def plan_resources(num_env_workers, cpus=None, env_cpus=None,
+                   intra_op_threads=None, inter_op_threads=None):
+  ''' Split cores between env worker processes and the learner.
+
+    # Params
+      num_env_workers (int): The number of env worker processes, 0 if the
+          environments step in the learner process.
+      cpus ([int]): The cores to split, those available to this process by
+          default.
+      env_cpus (int): Override the number of cores for the env workers.
+      intra_op_threads (int): Override the learner's intra op threads.
+      inter_op_threads (int): Override the learner's inter op threads.
+
+    # Returns
+      plan (ResourcePlan): The cores of the env workers (empty if there are
+          none) and the learner, and the learner's thread pool sizes.
+  '''
+  cpus = available_cpus() if cpus is None else sorted(cpus)
+  num_cpu = len(cpus)
+
+  if env_cpus is None:
+    if num_env_workers == 0:
+      env_cpus = 0
+    else:
+      # Workers get a core each, up to half the machine; beyond that the
+      # learner's batched inference and updates need the cores as much as
+      # the workers do
+      env_cpus = min(num_env_workers, num_cpu // 2)
+  env_cpus = max(0, min(env_cpus, num_cpu - 1))
+
+  # The learner takes the low cores, the workers the high ones
+  learner_cpus = cpus[:num_cpu - env_cpus]
+  worker_cpus = cpus[num_cpu - env_cpus:]
+
+  if intra_op_threads is None:
+    intra_op_threads = len(learner_cpus)
+  if inter_op_threads is None:
+    inter_op_threads = min(MAX_INTER_OP_THREADS, len(learner_cpus))
+  return ResourcePlan(worker_cpus, learner_cpus, inter_op_threads,
+                      intra_op_threads)
+
+
+def env_worker_pids(vec_env):
+  ''' The process ids of the workers of a baselines SubprocVecEnv or
+      ShmemVecEnv, looking through VecEnvWrappers. Empty for environments
+      stepping in this process.
+  '''
+  while True:
+    processes = getattr(vec_env, 'ps', None) or getattr(vec_env, 'procs', None)
+    if processes:
+      return [process.pid for process in processes]
+    if not hasattr(vec_env, 'venv'):
+      return []
+    vec_env = vec_env.venv
+
+
+def apply_plan(plan, vec_env=None):
+  ''' Pin the env workers of vec_env and the calling thread to their cores.
+      Call before creating the tensorflow session, whose thread pools inherit
+      the calling thread's affinity. Does nothing where affinity cannot be
+      set.
+  '''
+  if not hasattr(os, 'sched_setaffinity'):
+    return
+  if vec_env is not None and plan.env_cpus:
+    for pid in env_worker_pids(vec_env):
+      os.sched_setaffinity(pid, plan.env_cpus)
+  pin_thread(plan.learner_cpus)
+
+
+def pin_thread(cpus):
+  ''' Restrict the calling thread, and the threads it starts, to cpus. On
+      Linux the affinity of pid 0 is that of the calling thread. Does nothing
+      where affinity cannot be set.
+  '''
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, cpus)
+
+
+def describe_plan(plan):
+  return 'env workers on cores {}, learner on cores {} with {} inter and ' \
+      '{} intra op threads'.format(
+          _core_ranges(plan.env_cpus) or 'none',
+          _core_ranges(plan.learner_cpus), plan.inter_op_threads,
+          plan.intra_op_threads)
+
+
+def _core_ranges(cpus):
+  ranges = []
+  for cpu in sorted(cpus):
+    if ranges and cpu == ranges[-1][1] + 1:
+      ranges[-1][1] = cpu
+    else:
+      ranges.append([cpu, cpu])
+  return ','.join(str(low) if low == high else '{}-{}'.format(low, high)
+                  for low, high in ranges)
@@ -1,20 +1,14 @@
 import argparse
 import datetime
+import functools
+import json
 import os
-import gym
 
-import numpy as np
-import tensorflow as tf
-
-from gym.wrappers import Monitor as GymMonitor
-from baselines.bench import Monitor as BenchMonitor
-
-from a2c_agent import A2CAgent
+from env_factory import BACKENDS, env_entry, make_vec_env, registered_ids
+from resource_planner import (apply_plan, describe_plan, env_worker_pids,
+                              plan_resources)
 from baselines import logger
 from baselines.common import set_global_seeds
-from baselines.common.atari_wrappers import make_atari, wrap_deepmind
-from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
-from baselines.common.vec_env.vec_frame_stack import VecFrameStack
 
 # Breakout actions = ['noop', 'fire', 'right', 'left']
 BREAKOUT_ID = 'BreakoutNoFrameskip-v4'
@@ -22,6 +16,10 @@ BREAKOUT_ID = 'BreakoutNoFrameskip-v4'
 
 def main():
   args = command_line_args()
+  # Imported once the arguments are parsed, so --help and argument errors do
+  # not wait for tensorflow
+  from a2c_agent import A2CAgent
+  from networks import CNN_SPEC, MLP_SPEC, load_network_spec
 
   set_global_seeds(args.seed)
   model_dir = '{}/{}_{:%Y-%m-%d_%H:%M:%S}'.format(
@@ -29,17 +27,52 @@ def main():
   logger.configure(model_dir)
 
   num_env = args.num_env if not args.evaluate else 1
+  entry = env_entry(args.env_id)
+  env_kwargs = json.loads(args.env_kwargs) if args.env_kwargs else {}
 
-  train_envs, eval_env = make_atari_env(
-      env_id=args.env_id, num_env=num_env, seed=args.seed) 
-  train_envs = VecFrameStack(train_envs, 4)
-  eval_env = VecFrameStack(eval_env, 4)
-
-  if not args.use_mlp:
+  if entry.cnn and not args.use_mlp:
     cnn = True
   else:
     cnn = False
 
+  network_spec = load_network_spec(args.network_spec)
+  if args.lstm:
+    if network_spec is None:
+      network_spec = CNN_SPEC if cnn else MLP_SPEC
+    network_spec = dict(network_spec, lstm=args.lstm)
+
+  # A recurrent policy carries its own memory, so frames are not stacked
+  frame_stack = network_spec is None or not network_spec.get('lstm')
+
+  # The training envs use the baselines Monitor, which periodically flushes
+  # progress. One evaluation environment records video with the gym Monitor.
+  train_envs = make_vec_env(
+      args.env_id, num_env, args.seed, backend=args.vec_env,
+      frame_stack=frame_stack, monitor_dir=logger.get_dir(),
+      env_kwargs=env_kwargs)
+  eval_env = make_vec_env(
+      args.env_id, 1, args.seed + num_env, backend='dummy',
+      frame_stack=frame_stack,
+      video_dir=os.path.join(logger.get_dir(), 'eval'),
+      env_kwargs=env_kwargs)
+
+  eval_env_fn = None
+  if args.num_eval_env > 0 and not args.evaluate:
+    eval_env_fn = functools.partial(
+        make_vec_env, args.env_id, args.num_eval_env,
+        args.seed + num_env + 1, backend=args.vec_env,
+        frame_stack=frame_stack, env_kwargs=env_kwargs)
+
+  # Split the cores between the env workers and the learner before the
+  # session is created, so its thread pools start on the learner's cores
+  plan = plan_resources(
+      len(env_worker_pids(train_envs)), env_cpus=args.env_cpus,
+      intra_op_threads=args.intra_op_threads,
+      inter_op_threads=args.inter_op_threads)
+  if not args.no_pin_cpus:
+    apply_plan(plan, train_envs)
+  logger.log(describe_plan(plan))
+
   agent = A2CAgent(
       train_envs,
       eval_env,
@@ -54,7 +87,25 @@ def main():
       seed=args.seed,
       save_every=args.save_every,
       load_checkpoint=args.load_checkpoint,
-      checkpoint_prefix=args.checkpoint_prefix)
+      checkpoint_prefix=args.checkpoint_prefix,
+      compute_dtype=args.compute_dtype,
+      network_spec=network_spec,
+      histograms=args.histograms,
+      eval_env_fn=eval_env_fn,
+      num_eval_episodes=args.num_eval_episodes,
+      max_checkpoints=args.max_checkpoints,
+      frames_per_step=entry.frames_per_step,
+      trace_every=args.trace_every,
+      replay_rollouts=args.replay_rollouts,
+      replay_epochs=args.replay_epochs,
+      vtrace_rho_max=args.vtrace_rho_max,
+      vtrace_c_max=args.vtrace_c_max,
+      inter_op_threads=plan.inter_op_threads,
+      intra_op_threads=plan.intra_op_threads,
+      weight_history_every=args.weight_history_every,
+      weight_history_patterns=args.weight_history_patterns,
+      # Evaluation shares the env workers' cores, not the learner's
+      eval_cpus=None if args.no_pin_cpus else plan.env_cpus)
 
   if args.evaluate:
     agent.evaluate()
@@ -83,6 +134,44 @@ def command_line_args():
       '--summary_every', type=int, help='summary every n steps', default=25)
   parser.add_argument(
       '--save_every', type=int, help='save every n steps', default=100)
+  parser.add_argument(
+      '--trace_every', type=int, default=0,
+      help='write a timeline of the training step every n steps, 0 to disable')
+  parser.add_argument(
+      '--weight_history_every', type=int, default=0,
+      help='record the selected weights in <model_dir>/weights every n '
+      'steps, 0 to disable')
+  parser.add_argument(
+      '--weight_history_patterns', type=str, nargs='+', default=None,
+      help='regular expressions of the variable names to record, the first '
+      'convolution\'s kernels by default')
+  parser.add_argument(
+      '--replay_rollouts', type=int, default=0,
+      help='keep the last n rollouts and learn from them with V-trace '
+      'corrections, 0 for on-policy A2C')
+  parser.add_argument(
+      '--replay_epochs', type=int, default=1,
+      help='passes over the replayed rollouts after each rollout')
+  parser.add_argument(
+      '--vtrace_rho_max', type=float, default=1.0,
+      help='truncation of the V-trace importance weights')
+  parser.add_argument(
+      '--vtrace_c_max', type=float, default=1.0,
+      help='truncation of the V-trace trace coefficients')
+  parser.add_argument(
+      '--env_cpus', type=int, default=None,
+      help='cores reserved for the env worker processes, planned from the '
+      'number of workers by default')
+  parser.add_argument(
+      '--intra_op_threads', type=int, default=None,
+      help='tensorflow intra op threads, the learner cores by default')
+  parser.add_argument(
+      '--inter_op_threads', type=int, default=None,
+      help='tensorflow inter op threads')
+  parser.add_argument(
+      '--no_pin_cpus', action='store_true',
+      help='plan thread counts but leave the env workers and the learner '
+      'free to run on any core')
   parser.add_argument(
       '--gamma', type=float, default=0.99,
       help='value of gamma for Bellman equations')
@@ -94,79 +183,58 @@ def command_line_args():
   parser.add_argument(
       '--use_mlp', action='store_true',
       help='use a multilayer perceptron architecture')
+  parser.add_argument(
+      '--compute_dtype', choices=['float32', 'float16', 'bfloat16'],
+      default='float32',
+      help='the precision the convolutional layers are computed in')
+  parser.add_argument(
+      '--network_spec', type=str, default=None,
+      help='JSON network spec, or a file containing one, overriding the \
+      default CNN or MLP (see networks.py)')
+  parser.add_argument(
+      '--lstm', type=int, default=0,
+      help='the number of LSTM units after the network, 0 for a feed forward \
+      policy (frames are not stacked for LSTM policies)')
+  parser.add_argument(
+      '--histograms', action='store_true',
+      help='add activation histograms to the tensorboard summaries')
   parser.add_argument(
       '--load_checkpoint', action='store_true',
       help='restore the model from a checkpoint')
   parser.add_argument(
-      '--checkpoint_prefix', help='prefix of checkpoint files', default='')
+      '--checkpoint_prefix', default='',
+      help='an .npz checkpoint, or the prefix of tf.train.Saver checkpoint \
+      files')
   parser.add_argument(
-      '--env_id', choices=[BREAKOUT_ID], default=BREAKOUT_ID,
-      help='The environment to use for the A2C algorithm (default: {0})'
-      .format(BREAKOUT_ID))
+      '--max_checkpoints', type=int, default=5,
+      help='the number of recent checkpoints to keep, besides the best')
+  parser.add_argument(
+      '--env_id', default=BREAKOUT_ID,
+      help='The environment to use for the A2C algorithm, one of {0} or any \
+      Atari <Game>NoFrameskip-v4 (default: {1})'
+      .format(', '.join(registered_ids()), BREAKOUT_ID))
+  parser.add_argument(
+      '--env_kwargs', type=str, default=None,
+      help='JSON keyword arguments for the environment builder, for example \
+      {"step_cost": 0.001} for FakeAtari')
+  parser.add_argument(
+      '--vec_env', choices=BACKENDS, default='auto',
+      help='how to vectorise the environments, auto chooses from the cost \
+      of a step')
   parser.add_argument(
       '--num_env',
       help="The number of different environments", type=int, default=16)
+  parser.add_argument(
+      '--num_eval_env', type=int, default=4,
+      help='the number of environments evaluating the policy in a separate \
+      process, 0 evaluates synchronously on one environment')
+  parser.add_argument(
+      '--num_eval_episodes', type=int, default=8,
+      help='the number of episodes per evaluation')
   parser.add_argument(
       '--seed', help='The random number generator seed', default=1, type=int)
   return parser.parse_args()
 
-# def make_atari_env(env_id, num_env, seed, wrapper_kwargs=None, start_index=0):
-#     """
-#     Create a wrapped, monitored SubprocVecEnv for Atari.
-#     """
-#     if wrapper_kwargs is None: wrapper_kwargs = {}
-#     # Make the training envs which use the BenchMonitor and periodically flush
-#     # progress.
-#     def make_env(rank): # pylint: disable=C0111
-#         def _thunk():
-#             env = make_atari(env_id)
-#             env.seed(seed + rank)
-#             env = BenchMonitor(env, logger.get_dir() and os.path.join(logger.get_dir(), str(rank)))
-#             return wrap_deepmind(env, **wrapper_kwargs)
-#         return _thunk
-#     set_global_seeds(seed)
-#     return SubprocVecEnv([make_env(i + start_index) for i in range(num_env)])
-
-
-def make_atari_env(env_id, num_env, seed, wrapper_kwargs=None, start_index=0):
-  """
-  Create a wrapped, monitored SubprocVecEnv for Atari. Note this is altered from
-  the OpenAI baselines.common.cmd_util
-  This version changes the Monitors to the OpenAI gym monitor, for recording
-  video and statistics, and provides an evaluation agent in addition to the
-  SubprocVecEnv wrapped training environments.
-  """
-  if wrapper_kwargs is None:
-    wrapper_kwargs = {}
-
-  def make_bench_monitor_env(rank):
-    def _thunk():
-      env = make_atari(env_id)
-      env.seed(seed + rank)
-      env = BenchMonitor(env, logger.get_dir()
-                         and os.path.join(logger.get_dir(), str(rank)))
-      return wrap_deepmind(env, **wrapper_kwargs)
-    return _thunk
-  
-  def make_gym_monitor_env(name):
-    def _thunk():
-      env = make_atari(env_id)
-      env.seed(seed+num_env)
-      env = GymMonitor(env, os.path.join(logger.get_dir(), name),
-                       video_callable=lambda ep_id: True)
-      return wrap_deepmind(env, **wrapper_kwargs)
-    return _thunk
-
-  # Make the training envs which use the BenchMonitor and periodically flush
-  # progress.
-  train_envs = SubprocVecEnv(
-      [make_bench_monitor_env(i+start_index) for i in range(num_env)])
-
-  # Create one evaluation environment with a GymMonitor which can record video
-  eval_env = SubprocVecEnv([make_gym_monitor_env('eval')])
-
-  return train_envs, eval_env
-
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,452 @@
+"""
+Trains a population of A2C agents with different hyperparameters
+concurrently in one process.
+
+Every trial runs in its own thread with its own graph and a session whose
+thread pools are sized (and, on Linux, pinned to a set of cores) for that
+trial, rather than every session claiming all cores. The trials share one
+vectorised environment: each owns a slice of its environments, and the slices
+are stepped together with one call, so the sweep starts one pool of env
+workers instead of one per trial.
+
+With --pbt_interval set the sweep does population based training (Jaderberg
+et al. 2017): every pbt_interval updates the trials are ranked by their
+recent training returns, and each trial in the bottom pbt_fraction copies the
+weights and hyperparameters of a random trial in the top pbt_fraction, then
+perturbs its learning rate and entropy coefficient.
+"""
+
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import threading
+import time
+import traceback
+
+import gym
+import numpy as np
+import tensorflow as tf
+
+from a2c import ActorCritic
+from a2c_runner import A2CRunner
+from env_factory import BACKENDS, env_entry, make_vec_env, registered_ids
+from resource_planner import pin_thread
+
+INFO_EPISODE_KEY = 'episode'
+# Training episodes averaged to score a trial
+NUM_SCORE_EPISODES = 20
+PERTURB_FACTORS = [0.8, 1.25]
+
+
+class SharedVecEnv(object):
+  ''' Steps one VecEnv on behalf of several threads in lockstep.
+
+      Each thread steps its own slice of the environments (see VecEnvSlice).
+      Once every slice has submitted its actions, the whole VecEnv is stepped
+      with one call by the last thread to arrive, and each slice receives its
+      part of the results.
+
+      # Params
+        env: A baselines VecEnv with num_slices * slice_size environments.
+        num_slices (int): The number of threads sharing env.
+  '''
+  def __init__(self, env, num_slices):
+    if env.num_envs % num_slices != 0:
+      raise ValueError('{} environments cannot be split into {} slices'.format(
+          env.num_envs, num_slices))
+    self._env = env
+    self.observation_space = env.observation_space
+    self.action_space = env.action_space
+    self._slice_size = env.num_envs // num_slices
+    self._actions = [None] * num_slices
+    self._results = None
+    self._barrier = threading.Barrier(num_slices, action=self._step)
+    self._obs = env.reset()
+
+  @property
+  def slice_size(self):
+    return self._slice_size
+
+  def slice(self, index):
+    return VecEnvSlice(self, index)
+
+  def abort(self):
+    ''' Release all waiting threads, which raise BrokenBarrierError. '''
+    self._barrier.abort()
+
+  def close(self):
+    self._env.close()
+
+  def step_slice(self, index, actions):
+    self._actions[index] = actions
+    self._barrier.wait()
+    begin = index * self._slice_size
+    end = begin + self._slice_size
+    obs, rewards, dones, infos = self._results
+    # The observations are copied, as frame stacking updates its buffer in
+    # place on the next step
+    return (np.copy(obs[begin:end]), rewards[begin:end], dones[begin:end],
+            infos[begin:end])
+
+  def reset_slice(self, index):
+    begin = index * self._slice_size
+    return np.copy(self._obs[begin:begin + self._slice_size])
+
+  def _step(self):
+    self._results = self._env.step(np.concatenate(self._actions))
+
+
+class VecEnvSlice(object):
+  ''' A VecEnv view of some of the environments of a SharedVecEnv. Episodes
+      are not reset by reset(), which returns the current observations, as
+      the environments reset themselves when done.
+
+      The returns of finished episodes (reported by the baselines Monitor)
+      are kept in episode_returns.
+  '''
+  def __init__(self, shared_env, index):
+    self._shared_env = shared_env
+    self._index = index
+    self.num_envs = shared_env.slice_size
+    self.observation_space = shared_env.observation_space
+    self.action_space = shared_env.action_space
+    self.episode_returns = collections.deque(maxlen=NUM_SCORE_EPISODES)
+
+  def reset(self):
+    return self._shared_env.reset_slice(self._index)
+
+  def step(self, actions):
+    obs, rewards, dones, infos = self._shared_env.step_slice(
+        self._index, actions)
+    for info in infos:
+      episode = info.get(INFO_EPISODE_KEY)
+      if episode is not None:
+        self.episode_returns.append(float(episode['r']))
+    return obs, rewards, dones, infos
+
+  def close(self):
+    pass
+
+
+class Trial(object):
+  ''' One member of the population, trained on a slice of the shared
+      environments in its own thread.
+
+    # Params
+      index (int): The trial's position in the population.
+      env: A VecEnvSlice.
+      hyperparameters (dict): The initial learning_rate and ent_coeff of the
+          trial's ActorCritic.
+      model_kwargs (dict): The remaining ActorCritic keyword arguments.
+      n_steps (int): Steps per environment per update.
+      gamma (float): The discounting factor.
+      num_threads (int): Tensorflow thread pool sizes.
+      cpus ([int]): Cores to pin the trial's threads to, None to not pin.
+      seed (int): The graph level random seed.
+  '''
+  def __init__(self, index, env, hyperparameters, model_kwargs, n_steps, gamma,
+               num_threads, cpus, seed):
+    self.index = index
+    self.env = env
+    self.hyperparameters = dict(hyperparameters)
+    self.history = []
+    self.actor_critic = None
+
+    self._model_kwargs = model_kwargs
+    self._n_steps = n_steps
+    self._gamma = gamma
+    self._num_threads = num_threads
+    self._cpus = cpus
+    self._seed = seed
+    self._runner = None
+
+  def build(self):
+    ''' Build the trial's graph and session. Called from the trial's thread,
+        so the session's thread pools inherit its affinity.
+    '''
+    if self._cpus is not None:
+      pin_thread(self._cpus)
+
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.set_random_seed(self._seed)
+      tf_config = tf.ConfigProto(
+          inter_op_parallelism_threads=self._num_threads,
+          intra_op_parallelism_threads=self._num_threads)
+      sess = tf.Session(config=tf_config, graph=graph)
+      self.actor_critic = ActorCritic(
+          sess=sess,
+          initial_learning_rate=self.hyperparameters['learning_rate'],
+          initial_ent_coeff=self.hyperparameters['ent_coeff'],
+          **self._model_kwargs)
+
+    discrete = isinstance(self.env.action_space, gym.spaces.Discrete)
+    self._runner = A2CRunner(
+        actor_critic=self.actor_critic, env=self.env, n_steps=self._n_steps,
+        gamma=self._gamma, discrete=discrete)
+
+  def update(self):
+    rollout = self._runner.generate_rollouts()
+    self.actor_critic.train(
+        rollout.observations, rollout.returns, rollout.actions,
+        rollout.values)
+
+  def score(self):
+    ''' The mean return of the recent training episodes, None before any
+        episode has finished.
+    '''
+    if not self.env.episode_returns:
+      return None
+    return float(np.mean(self.env.episode_returns))
+
+  def current_hyperparameters(self):
+    scales = self.actor_critic.hyperparameter_scales
+    return {name: self.hyperparameters[name] * scales[name]
+            for name in ['learning_rate', 'ent_coeff']}
+
+
+class PopulationSweep(object):
+  ''' Runs trials concurrently and applies population based training.
+
+    # Params
+      trials ([Trial]): The population.
+      shared_env (SharedVecEnv): The environments the trials step.
+      num_updates (int): Updates per trial.
+      pbt_interval (int): Updates between exploit/explore rounds, 0 to only
+          train the trials side by side.
+      pbt_fraction (float): The fraction of the population replaced in each
+          round, and the fraction they copy from.
+      report_every (int): Updates between progress reports.
+      seed (int): Seed for choosing trials to copy and perturbations.
+  '''
+  def __init__(self, trials, shared_env, num_updates, pbt_interval=0,
+               pbt_fraction=0.25, report_every=100, seed=0):
+    self._trials = trials
+    self._shared_env = shared_env
+    self._num_updates = num_updates
+    self._pbt_interval = pbt_interval
+    self._pbt_fraction = pbt_fraction
+    self._report_every = report_every
+    self._rng = np.random.RandomState(seed)
+    self._sync = threading.Barrier(len(trials), action=self._on_sync)
+    self._sync_update = 0
+    self._errors = []
+    self._start_time = None
+
+  def run(self):
+    self._start_time = time.time()
+    threads = [threading.Thread(target=self._run_trial, args=(trial,))
+               for trial in self._trials]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    if self._errors:
+      raise RuntimeError(self._errors[0])
+    return self.results()
+
+  def results(self):
+    return [{'trial': trial.index,
+             'initial_hyperparameters': trial.hyperparameters,
+             'hyperparameters': trial.current_hyperparameters(),
+             'score': trial.score(),
+             'history': trial.history} for trial in self._trials]
+
+  def _run_trial(self, trial):
+    try:
+      trial.build()
+      for update in range(1, self._num_updates + 1):
+        trial.update()
+        if self._sync_due(update):
+          # Every trial reaches the barrier at the same update
+          self._sync_update = update
+          self._sync.wait()
+    except threading.BrokenBarrierError:
+      # Another trial failed
+      pass
+    except Exception:  # pylint: disable=broad-except
+      self._errors.append(traceback.format_exc())
+      self._shared_env.abort()
+      self._sync.abort()
+
+  def _sync_due(self, update):
+    return (self._pbt_interval and update % self._pbt_interval == 0) \
+        or update % self._report_every == 0 or update == self._num_updates
+
+  def _on_sync(self):
+    # Runs in one trial thread while all the others wait, so the models are
+    # not training while weights are copied
+    update = self._sync_update
+    for trial in self._trials:
+      trial.history.append(dict(
+          trial.current_hyperparameters(), update=update, score=trial.score()))
+
+    if self._pbt_interval and update % self._pbt_interval == 0 \
+        and update < self._num_updates:
+      self._exploit_and_explore()
+    if update % self._report_every == 0 or update == self._num_updates:
+      self._report(update)
+
+  def _exploit_and_explore(self):
+    scored = [trial for trial in self._trials if trial.score() is not None]
+    num_replaced = int(math.floor(len(scored) * self._pbt_fraction))
+    if num_replaced < 1:
+      return
+
+    ranked = sorted(scored, key=lambda trial: trial.score())
+    bottom, top = ranked[:num_replaced], ranked[-num_replaced:]
+    for trial in bottom:
+      source = top[self._rng.randint(len(top))]
+      trial.actor_critic.set_params(source.actor_critic.get_params())
+      for name, scale in source.actor_critic.hyperparameter_scales.items():
+        # The copy starts from the source's values, then perturbs them
+        source_value = source.hyperparameters[name] * scale
+        perturbed = source_value * self._rng.choice(PERTURB_FACTORS)
+        trial.actor_critic.hyperparameter_scales[name] = \
+            perturbed / trial.hyperparameters[name]
+      trial.env.episode_returns.clear()
+
+  def _report(self, update):
+    elapsed = time.time() - self._start_time
+    print('update %d (%.0fs)' % (update, elapsed))
+    for trial in self._trials:
+      hyperparameters = trial.current_hyperparameters()
+      score = trial.score()
+      print('  trial %d: lr %.2e ent %.2e return %s' % (
+          trial.index, hyperparameters['learning_rate'],
+          hyperparameters['ent_coeff'],
+          'n/a' if score is None else '%.2f' % score))
+
+
+def trial_cpus(num_trials, threads_per_trial, first_cpu=0):
+  ''' Disjoint core sets for each trial, wrapping around if there are more
+      trial threads than cores.
+  '''
+  num_cpu = multiprocessing.cpu_count()
+  return [{(first_cpu + i * threads_per_trial + j) % num_cpu
+           for j in range(threads_per_trial)} for i in range(num_trials)]
+
+
+def sample_hyperparameters(rng, num_trials, learning_rate_range,
+                           ent_coeff_range):
+  ''' Log uniform samples of the initial learning rate and entropy
+      coefficient.
+  '''
+  def log_uniform(low, high):
+    return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+  return [{'learning_rate': log_uniform(*learning_rate_range),
+           'ent_coeff': log_uniform(*ent_coeff_range)}
+          for _ in range(num_trials)]
+
+
+def main():
+  args = command_line_args()
+  rng = np.random.RandomState(args.seed)
+
+  entry = env_entry(args.env_id)
+  env = make_vec_env(args.env_id, args.num_trials * args.num_env, args.seed,
+                     backend=args.vec_env)
+  shared_env = SharedVecEnv(env, args.num_trials)
+
+  num_updates = args.num_learning_steps // (args.n_steps * args.num_env)
+  model_kwargs = {
+      'obs_space': env.observation_space,
+      'act_space': env.action_space,
+      'cnn': entry.cnn,
+      'num_policy_updates': num_updates,
+      'max_grad_norm': args.max_grad_norm,
+  }
+
+  threads_per_trial = args.threads_per_trial or max(
+      1, (multiprocessing.cpu_count() - args.env_cpus) // args.num_trials)
+  cpus = trial_cpus(args.num_trials, threads_per_trial, args.env_cpus) \
+      if args.pin_threads else [None] * args.num_trials
+
+  trials = [
+      Trial(index, shared_env.slice(index), hyperparameters, model_kwargs,
+            args.n_steps, args.gamma, threads_per_trial, cpus[index],
+            args.seed + index)
+      for index, hyperparameters in enumerate(sample_hyperparameters(
+          rng, args.num_trials, args.learning_rate_range,
+          args.ent_coeff_range))]
+
+  sweep = PopulationSweep(
+      trials, shared_env, num_updates, pbt_interval=args.pbt_interval,
+      pbt_fraction=args.pbt_fraction, report_every=args.report_every,
+      seed=args.seed)
+  try:
+    results = sweep.run()
+  finally:
+    shared_env.close()
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'args': vars(args), 'trials': results}, f, indent=2)
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Trains a population of A2C agents with different \
+      hyperparameters concurrently, optionally with population based training.')
+  parser.add_argument(
+      '--env_id', type=str, default='CartPole-v1',
+      help='environment to train on, one of {} or any Atari '
+      '<Game>NoFrameskip-v4'.format(registered_ids()))
+  parser.add_argument(
+      '--vec_env', choices=BACKENDS, default='auto',
+      help='how the shared environments are vectorised')
+  parser.add_argument(
+      '--num_trials', type=int, default=4, help='the population size')
+  parser.add_argument(
+      '--num_env', type=int, default=8,
+      help='the number of environments per trial')
+  parser.add_argument(
+      '--n_steps', type=int, default=5,
+      help='the number of steps per environment per update')
+  parser.add_argument(
+      '--num_learning_steps', type=int, default=int(1e6),
+      help='environment steps per trial')
+  parser.add_argument(
+      '--gamma', type=float, default=0.99,
+      help='value of gamma for Bellman equations')
+  parser.add_argument(
+      '--learning_rate_range', type=float, nargs=2, default=[1e-4, 3e-3],
+      help='range the initial learning rates are sampled log uniformly from')
+  parser.add_argument(
+      '--ent_coeff_range', type=float, nargs=2, default=[1e-3, 5e-2],
+      help='range the initial entropy coefficients are sampled log '
+      'uniformly from')
+  parser.add_argument(
+      '--max_grad_norm', type=float, default=1.0,
+      help='the global norm gradients are clipped to')
+  parser.add_argument(
+      '--pbt_interval', type=int, default=0,
+      help='updates between population based training rounds, 0 to disable')
+  parser.add_argument(
+      '--pbt_fraction', type=float, default=0.25,
+      help='fraction of the population replaced in each round')
+  parser.add_argument(
+      '--threads_per_trial', type=int, default=0,
+      help='tensorflow threads per trial, 0 to split the learner cores '
+      'evenly')
+  parser.add_argument(
+      '--env_cpus', type=int, default=0,
+      help='cores left to the environment workers, excluded from pinning')
+  parser.add_argument(
+      '--pin_threads', action='store_true',
+      help='pin each trial to its own cores')
+  parser.add_argument(
+      '--report_every', type=int, default=100,
+      help='updates between progress reports')
+  parser.add_argument(
+      '--output', type=str, default='a2c_sweep.json',
+      help='file to write the trial results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
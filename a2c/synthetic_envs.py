@@ -0,0 +1,99 @@
+"""
+Stand-in environments for benchmarking the A2C stack without Atari ROMs.
+"""
+
+import os
+import sys
+import time
+
+import gym
+import numpy as np
+from gym import spaces
+from gym.wrappers import TimeLimit
+
+ATARI_OBS_SHAPE = (84, 84, 4)
+NUM_ATARI_ACTIONS = 4
+# Distinct frames cycled through, so producing an observation costs a copy
+# rather than a random number draw
+NUM_FRAMES = 16
+
+GAUSSIAN_PROCESSES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'gaussian_processes')
+
+
+class FakeAtariEnv(gym.Env):
+  ''' An environment with the observation and action spaces of a frame stacked
+      Atari game after the DeepMind wrappers, whose dynamics are noise.
+
+      # Params
+        step_cost (float): Seconds of busy CPU work per step, standing in for
+            the emulator.
+        episode_length (int): Steps per life.
+        num_lives (int): Lives per episode; losing a life sets done, as the
+            EpisodicLifeEnv wrapper does.
+  '''
+  metadata = {'render.modes': []}
+
+  def __init__(self, step_cost=0.0, episode_length=1000, num_lives=5):
+    self.observation_space = spaces.Box(
+        low=0, high=255, shape=ATARI_OBS_SHAPE, dtype=np.uint8)
+    self.action_space = spaces.Discrete(NUM_ATARI_ACTIONS)
+
+    self._step_cost = step_cost
+    self._episode_length = episode_length
+    self._num_lives = num_lives
+
+    self.seed()
+    self.reset()
+
+  def seed(self, seed=None):
+    self._np_random = np.random.RandomState(seed)
+    self._frames = self._np_random.randint(
+        0, 256, size=(NUM_FRAMES,) + ATARI_OBS_SHAPE).astype(np.uint8)
+    return [seed]
+
+  def reset(self):
+    self._t = 0
+    self._lives = self._num_lives
+    return self._observation()
+
+  def step(self, action):
+    if self._step_cost > 0:
+      end_time = time.time() + self._step_cost
+      while time.time() < end_time:
+        pass
+
+    self._t += 1
+    reward = float(self._np_random.rand() < 0.05)
+
+    done = False
+    if self._t % self._episode_length == 0:
+      self._lives -= 1
+      done = True
+      if self._lives < 1:
+        self._lives = self._num_lives
+
+    return self._observation(), reward, done, {'ale.lives': self._lives}
+
+  def _observation(self):
+    return np.copy(self._frames[self._t % NUM_FRAMES])
+
+
+class ScalarActionWrapper(gym.ActionWrapper):
+  ''' Passes one dimensional actions to the wrapped environment as floats. '''
+  def action(self, action):
+    return float(np.squeeze(action))
+
+
+def make_mountain_car(max_episode_steps=200, gaussian_reward_scale=0.05):
+  ''' The continuous mountain car of gaussian_processes/gym_environment.py,
+      terminating at the goal and truncated after max_episode_steps.
+  '''
+  if GAUSSIAN_PROCESSES_DIR not in sys.path:
+    sys.path.append(GAUSSIAN_PROCESSES_DIR)
+  from gym_environment import Continuous_MountainCarEnv
+
+  env = Continuous_MountainCarEnv(
+      gaussian_reward_scale=gaussian_reward_scale, terminating=True)
+  return TimeLimit(ScalarActionWrapper(env),
+                   max_episode_steps=max_episode_steps)
@@ -0,0 +1,195 @@
+"""
+A compact on-disk history of selected weight tensors over training.
+
+Each tensor is kept in its own memory mapped .npy array of snapshots, with
+the training step of each snapshot alongside, and index.json lists the
+tensors and the number of snapshots of each:
+
+  weights/
+    index.json
+    conv_1-kernel-0.npy        (capacity, 8, 8, 4, 16) float32
+    conv_1-kernel-0.steps.npy  (capacity,) int64
+
+A snapshot of a conv layer is a few kilobytes, so the filters can be
+recorded every few updates and their evolution plotted (see
+plots.conv_filters_plot) without restoring checkpoints or building graphs.
+The arrays double in capacity when full; index.json is replaced atomically
+on flush, so readers only see complete snapshots.
+"""
+
+import os
+import re
+
+import numpy as np
+
+from json_index import read_index, write_index
+
+INDEX_FILE = 'index.json'
+STEPS_SUFFIX = '.steps.npy'
+ARRAY_SUFFIX = '.npy'
+# The first convolution's filters, of the actor and any separate critic trunk
+DEFAULT_PATTERNS = ['conv_1/kernel']
+
+
+class WeightHistoryWriter(object):
+  ''' Appends weight snapshots to a history.
+
+      # Params
+        directory (str): The history directory, appended to if it exists.
+        initial_capacity (int): Snapshots allocated per tensor at first.
+  '''
+  def __init__(self, directory, initial_capacity=256):
+    self._directory = directory
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    self._initial_capacity = initial_capacity
+
+    self._tensors = _read_index(directory) or {}
+    self._arrays = {}
+    self._steps = {}
+    for name, info in self._tensors.items():
+      self._arrays[name] = np.load(
+          os.path.join(directory, info['file'] + ARRAY_SUFFIX), mmap_mode='r+')
+      self._steps[name] = np.load(
+          os.path.join(directory, info['file'] + STEPS_SUFFIX), mmap_mode='r+')
+
+  def append(self, step, tensors):
+    ''' Add a snapshot of each tensor.
+
+      # Params
+        step (int): The training step of the snapshot.
+        tensors (dict): Arrays keyed by tensor name. A tensor seen for the
+            first time starts its own history.
+    '''
+    for name, value in tensors.items():
+      value = np.asarray(value)
+      if name not in self._tensors:
+        self._create(name, value)
+      info = self._tensors[name]
+      if tuple(info['shape']) != value.shape:
+        raise ValueError('{} has shape {}, its history {}'.format(
+            name, value.shape, tuple(info['shape'])))
+      if info['count'] == self._arrays[name].shape[0]:
+        self._grow(name)
+      self._arrays[name][info['count']] = value
+      self._steps[name][info['count']] = step
+      info['count'] += 1
+
+  def flush(self):
+    ''' Write the snapshots and the index. '''
+    for name in self._tensors:
+      self._arrays[name].flush()
+      self._steps[name].flush()
+    write_index(os.path.join(self._directory, INDEX_FILE),
+                {'tensors': self._tensors})
+
+  def close(self):
+    self.flush()
+
+  def _create(self, name, value):
+    filename = _file_name(name)
+    self._tensors[name] = {'file': filename, 'shape': list(value.shape),
+                           'dtype': value.dtype.name, 'count': 0}
+    self._arrays[name] = self._allocate(
+        filename + ARRAY_SUFFIX, value.dtype, value.shape,
+        self._initial_capacity)
+    self._steps[name] = self._allocate(
+        filename + STEPS_SUFFIX, np.int64, (), self._initial_capacity)
+
+  def _grow(self, name):
+    filename = self._tensors[name]['file']
+    count = self._tensors[name]['count']
+    for arrays, suffix in ((self._arrays, ARRAY_SUFFIX),
+                           (self._steps, STEPS_SUFFIX)):
+      old = arrays[name]
+      # Written under a temporary name and renamed, so the old array stays
+      # readable until the new one is complete
+      new = self._allocate(filename + '.tmp' + suffix, old.dtype,
+                           old.shape[1:], 2 * old.shape[0])
+      new[:count] = old[:count]
+      new.flush()
+      del old
+      arrays[name] = None
+      os.rename(os.path.join(self._directory, filename + '.tmp' + suffix),
+                os.path.join(self._directory, filename + suffix))
+      arrays[name] = np.load(os.path.join(self._directory, filename + suffix),
+                             mmap_mode='r+')
+
+  def _allocate(self, filename, dtype, shape, capacity):
+    return np.lib.format.open_memmap(
+        os.path.join(self._directory, filename), mode='w+', dtype=dtype,
+        shape=(capacity,) + tuple(shape))
+
+
+class WeightHistoryReader(object):
+  ''' Reads a history written by WeightHistoryWriter, memory mapping the
+      snapshots. Snapshots written after the reader was opened are not seen.
+  '''
+  def __init__(self, directory):
+    tensors = _read_index(directory)
+    if tensors is None:
+      raise ValueError('No weight history in {}'.format(directory))
+    self._directory = directory
+    self._tensors = tensors
+    self.names = sorted(tensors)
+
+  def steps(self, name):
+    ''' The training step of each snapshot of the tensor. '''
+    info = self._tensors[self.resolve(name)]
+    return np.load(os.path.join(self._directory, info['file'] + STEPS_SUFFIX),
+                   mmap_mode='r')[:info['count']]
+
+  def history(self, name):
+    ''' The snapshots of the tensor, dimension (snapshots,) + shape, memory
+        mapped.
+    '''
+    info = self._tensors[self.resolve(name)]
+    return np.load(os.path.join(self._directory, info['file'] + ARRAY_SUFFIX),
+                   mmap_mode='r')[:info['count']]
+
+  def at(self, name, step=None):
+    ''' The last snapshot of the tensor taken at or before step, the latest
+        if step is None.
+
+      # Returns
+        step (int): The step of the snapshot.
+        value: The tensor.
+    '''
+    steps = self.steps(name)
+    if steps.size == 0:
+      raise ValueError('No snapshots of {}'.format(name))
+    if step is None:
+      index = steps.size - 1
+    else:
+      index = np.searchsorted(steps, step, side='right') - 1
+      if index < 0:
+        raise ValueError('The first snapshot of {} is at step {}, after {}'
+                         .format(name, int(steps[0]), step))
+    return int(steps[index]), np.array(self.history(name)[index])
+
+  def resolve(self, name):
+    ''' The full name of the one tensor matching name, e.g. conv_1/kernel
+        for conv_1/kernel:0.
+    '''
+    if name in self._tensors:
+      return name
+    matches = select_names(self.names, [name])
+    if len(matches) != 1:
+      raise ValueError('{} matches {} of the recorded tensors {}'.format(
+          name, matches or 'none', self.names))
+    return matches[0]
+
+
+def select_names(names, patterns):
+  ''' The names matching any of the regular expression patterns. '''
+  return [name for name in names
+          if any(re.search(pattern, name) for pattern in patterns)]
+
+
+def _file_name(name):
+  return re.sub(r'[^A-Za-z0-9_.]', '-', name)
+
+
+def _read_index(directory):
+  index = read_index(os.path.join(directory, INDEX_FILE))
+  return None if index is None else index['tensors']
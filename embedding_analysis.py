@@ -0,0 +1,375 @@
+"""
+Embedding analysis of the A2C policy's hidden layer over large rollouts.
+
+Activations of the actor's last hidden layer, the critic's values and a
+thumbnail of each observation are streamed from rollouts into an
+EmbeddingStore, a directory of memory mapped .npy arrays:
+
+  embed_out/
+    index.json        The number of stored points.
+    embeddings.npy    (capacity, hidden_dim) float32
+    values.npy        (capacity,) float32
+    thumbnails.npy    (capacity, height, width) uint8
+
+The analysis reduces the activations with an incremental PCA fitted a chunk
+at a time, so only one chunk is in memory, then embeds the reduced points in
+two dimensions with Barnes-Hut t-SNE, which scales to tens of thousands of
+points. The thumbnails are tiled into a sprite atlas with a single reshape.
+
+Run as a script to analyse a store:
+
+  python embedding_analysis.py --store embed_out --output_dir embed_out
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'a2c'))
+from json_index import read_index, write_index
+
+INDEX_FILE = 'index.json'
+ARRAY_FILES = {
+    'embeddings': 'embeddings.npy',
+    'values': 'values.npy',
+    'thumbnails': 'thumbnails.npy',
+}
+# The largest sprite the TensorBoard projector loads
+MAX_SPRITE_PIXELS = 8192
+
+
+class EmbeddingStore(object):
+  ''' An append-only store of hidden activations backed by memory mapped
+      arrays. The arrays are created at full capacity on the first append,
+      their shapes taken from it.
+
+      # Params
+        directory (str): The store directory, reopened if it exists.
+        capacity (int): The most points stored. A reopened store keeps the
+            capacity it was created with.
+        overwrite (bool): Whether to discard an existing store and start an
+            empty one.
+  '''
+  def __init__(self, directory, capacity=50000, overwrite=False):
+    self._directory = directory
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    if overwrite:
+      for filename in [INDEX_FILE] + list(ARRAY_FILES.values()):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+          os.remove(path)
+
+    self._arrays = {}
+    self._count = 0
+    self._capacity = capacity
+    index = read_index(os.path.join(directory, INDEX_FILE))
+    if index is not None:
+      self._count = index['count']
+      for name, filename in ARRAY_FILES.items():
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+          self._arrays[name] = np.load(path, mmap_mode='r+')
+      # A store flushed before its first append has no arrays yet
+      if 'embeddings' in self._arrays:
+        self._capacity = self._arrays['embeddings'].shape[0]
+
+  def __len__(self):
+    return self._count
+
+  @property
+  def full(self):
+    return self._count >= self._capacity
+
+  @property
+  def embeddings(self):
+    return self._array('embeddings')
+
+  @property
+  def values(self):
+    return self._array('values')
+
+  @property
+  def thumbnails(self):
+    ''' The stored thumbnails, None if no observations were stored. '''
+    if 'thumbnails' not in self._arrays:
+      return None
+    return self._array('thumbnails')
+
+  def append(self, embeddings, values, observations=None):
+    ''' Store a batch of points, as many as fit. Raises ValueError if the
+        store is full or the batch's shapes differ from the stored points'.
+
+      # Params
+        embeddings: Hidden activations, dimension (batch, hidden_dim)
+        values: The predicted values, dimension (batch,)
+        observations: The observations, see thumbnails, or None.
+
+      # Returns
+        num_stored (int): The number of points stored.
+    '''
+    batch = {
+        'embeddings': np.reshape(embeddings, [len(embeddings), -1]),
+        'values': np.reshape(values, [-1]),
+    }
+    if observations is not None:
+      batch['thumbnails'] = thumbnails(observations)
+    if not self._arrays:
+      self._create(batch)
+    if self.full:
+      raise ValueError('The store in {} is full, with {} points'.format(
+          self._directory, self._count))
+    for name, array in batch.items():
+      if name in self._arrays \
+          and array.shape[1:] != self._arrays[name].shape[1:]:
+        raise ValueError('{} of shape {} do not match the stored {}'.format(
+            name, array.shape[1:], self._arrays[name].shape[1:]))
+
+    num_stored = min(len(batch['embeddings']), self._capacity - self._count)
+    end = self._count + num_stored
+    for name, array in batch.items():
+      if name in self._arrays:
+        self._arrays[name][self._count:end] = array[:num_stored]
+    self._count = end
+    return num_stored
+
+  def flush(self):
+    ''' Write the stored points and the count to disk. '''
+    for array in self._arrays.values():
+      array.flush()
+    write_index(os.path.join(self._directory, INDEX_FILE),
+                {'count': self._count})
+
+  def close(self):
+    self.flush()
+
+  def _array(self, name):
+    if name not in self._arrays:
+      return np.empty(0)
+    return self._arrays[name][:self._count]
+
+  def _create(self, batch):
+    for name, array in batch.items():
+      dtype = np.uint8 if name == 'thumbnails' else np.float32
+      self._arrays[name] = np.lib.format.open_memmap(
+          os.path.join(self._directory, ARRAY_FILES[name]), mode='w+',
+          dtype=dtype, shape=(self._capacity,) + array.shape[1:])
+
+
+def thumbnails(observations):
+  ''' Grayscale thumbnails of observations. Frame stacked observations,
+      dimension (batch, height, width, frames), are merged into one image
+      with older frames fainter, showing the motion; single frames are kept.
+  '''
+  observations = np.asarray(observations)
+  if observations.ndim == 4:
+    num_frames = observations.shape[-1]
+    weights = np.arange(1, num_frames + 1, dtype=np.float32) / num_frames
+    observations = np.max(observations * weights, axis=-1)
+  return np.clip(observations, 0, 255).astype(np.uint8)
+
+
+def collect_embeddings(actor_critic, env, store, num_steps):
+  ''' Play the policy in env, storing the hidden activations, values and
+      observation thumbnails of every step until num_steps steps are played
+      or the store is full.
+
+    # Params
+      actor_critic (ActorCritic): The policy.
+      env: A baselines VecEnv.
+      store (EmbeddingStore): The store to append to.
+      num_steps (int): The number of vectorised steps.
+  '''
+  num_envs = env.num_envs
+  obs = env.reset()
+  states = None
+  if actor_critic.initial_state is not None:
+    states = np.tile(actor_critic.initial_state, (num_envs, 1))
+  episode_starts = np.ones(num_envs, dtype=np.float32)
+
+  for _ in range(num_steps):
+    if store.full:
+      break
+    embeddings, values = actor_critic.embed(obs, states, episode_starts)
+    store.append(embeddings, values, obs)
+    actions, _, states = actor_critic.step(obs, states, episode_starts)
+    obs, _, dones, _ = env.step(actions)
+    episode_starts = dones.astype(np.float32)
+  store.flush()
+
+
+def reduce_dimensions(embeddings, num_components=50, indices=None,
+                      chunk_size=4096):
+  ''' Project embeddings onto their leading principal components with an
+      incremental PCA, reading the (possibly memory mapped) array a chunk at
+      a time.
+
+    # Params
+      embeddings: The points, dimension (num_points, dim)
+      num_components (int): The dimension to reduce to. Points of no more
+          dimensions are returned as they are.
+      indices: The points to project, all if None. The PCA is fitted on all.
+      chunk_size (int): Points read at a time.
+
+    # Returns
+      reduced: The projected points, dimension (len(indices), num_components)
+  '''
+  num_points, dim = embeddings.shape
+  if indices is None:
+    indices = np.arange(num_points)
+  if dim <= num_components or num_points <= num_components:
+    return np.asarray(embeddings[indices], dtype=np.float32)
+
+  from sklearn.decomposition import IncrementalPCA
+  pca = IncrementalPCA(n_components=num_components)
+  chunk_size = max(chunk_size, num_components)
+  # Every partial fit needs at least num_components points, so a short last
+  # chunk is fitted with the one before it
+  bounds = list(range(0, num_points, chunk_size)) + [num_points]
+  if len(bounds) > 2 and bounds[-1] - bounds[-2] < num_components:
+    del bounds[-2]
+  for begin, end in zip(bounds[:-1], bounds[1:]):
+    pca.partial_fit(embeddings[begin:end])
+
+  reduced = np.empty((len(indices), num_components), dtype=np.float32)
+  for begin in range(0, len(indices), chunk_size):
+    chunk = indices[begin:begin + chunk_size]
+    reduced[begin:begin + chunk_size] = pca.transform(embeddings[chunk])
+  return reduced
+
+
+def tsne_embedding(embeddings, pca_dim=50, perplexity=30.0, max_points=0,
+                   seed=0):
+  ''' Embed points in two dimensions with PCA pre-reduction and Barnes-Hut
+      t-SNE.
+
+    # Params
+      embeddings: The points, dimension (num_points, dim)
+      pca_dim (int): The dimension the points are reduced to first.
+      perplexity (float): The t-SNE perplexity.
+      max_points (int): Embed a random subset of at most this many points,
+          0 for all.
+      seed (int): The seed of the subset and of t-SNE.
+
+    # Returns
+      indices: The embedded points, sorted.
+      points: Their two dimensional embedding, dimension (len(indices), 2)
+  '''
+  from sklearn.manifold import TSNE
+
+  num_points = embeddings.shape[0]
+  rng = np.random.RandomState(seed)
+  if max_points and num_points > max_points:
+    indices = np.sort(rng.choice(num_points, max_points, replace=False))
+  else:
+    indices = np.arange(num_points)
+
+  reduced = reduce_dimensions(embeddings, pca_dim, indices)
+  tsne = TSNE(n_components=2, perplexity=min(perplexity, len(indices) - 1),
+              init='pca', method='barnes_hut', random_state=seed)
+  return indices, tsne.fit_transform(reduced)
+
+
+def sprite_atlas(images):
+  ''' Tile images into a square atlas, each image scaled to the full
+      intensity range, padded with white.
+
+    # Params
+      images: The images, dimension (num_images, height, width)
+
+    # Returns
+      atlas: The uint8 atlas, dimension (side * height, side * width)
+  '''
+  images = np.asarray(images, dtype=np.float32)
+  num_images, height, width = images.shape
+  side = int(math.ceil(math.sqrt(num_images)))
+
+  low = images.min(axis=(1, 2), keepdims=True)
+  spread = images.max(axis=(1, 2), keepdims=True) - low
+  tiles = np.full((side * side, height, width), 255, dtype=np.uint8)
+  tiles[:num_images] = (255 * (images - low) / np.maximum(spread, 1e-8))
+  # (row, col, y, x) -> (row, y, col, x) lays the tiles out in one write
+  return tiles.reshape(side, side, height, width).transpose(0, 2, 1, 3) \
+      .reshape(side * height, side * width)
+
+
+def analyse_store(store, output_dir, pca_dim=50, perplexity=30.0,
+                  max_points=20000, seed=0, dpi=150):
+  ''' Embed the points of store with tsne_embedding and write to output_dir
+      tsne.npz (the indices and points), tsne.png (the points coloured by
+      value) and, with thumbnails, sprite.png of the embedded points' first
+      thumbnails that fit a MAX_SPRITE_PIXELS square.
+  '''
+  # Drawn without pyplot, so any backend the caller uses is left alone
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  from matplotlib.figure import Figure
+  from matplotlib.image import imsave
+
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+  indices, points = tsne_embedding(
+      store.embeddings, pca_dim, perplexity, max_points, seed)
+  values = np.asarray(store.values[indices])
+  np.savez(os.path.join(output_dir, 'tsne.npz'), indices=indices,
+           points=points, values=values)
+
+  fig = Figure(figsize=(12, 12))
+  FigureCanvasAgg(fig)
+  ax = fig.subplots()
+  scatter = ax.scatter(points[:, 0], points[:, 1], c=values, s=2,
+                       cmap='viridis')
+  fig.colorbar(scatter, ax=ax, label='Critic Output')
+  ax.set_axis_off()
+  ax.set_title('t-SNE of the Actor Hidden Layer')
+  fig.savefig(os.path.join(output_dir, 'tsne.png'), dpi=dpi)
+
+  images = store.thumbnails
+  if images is not None:
+    per_side = MAX_SPRITE_PIXELS // max(images.shape[1:])
+    sprite_indices = indices[:per_side * per_side]
+    imsave(os.path.join(output_dir, 'sprite.png'),
+           sprite_atlas(images[sprite_indices]), cmap='gray', vmin=0, vmax=255)
+
+
+def main():
+  args = command_line_args()
+  store = EmbeddingStore(args.store)
+  start_time = time.time()
+  analyse_store(store, args.output_dir or args.store, args.pca_dim,
+                args.perplexity, args.max_points, args.seed)
+  print('Embedded {} of {} points in {:.1f}s'.format(
+      min(len(store), args.max_points or len(store)), len(store),
+      time.time() - start_time))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Embeds the stored hidden activations of an A2C policy \
+      with PCA and Barnes-Hut t-SNE.')
+  parser.add_argument(
+      '--store', type=str, required=True,
+      help='an embedding store directory')
+  parser.add_argument(
+      '--output_dir', type=str, default=None,
+      help='the directory to write the embedding and figures to, the store \
+      by default')
+  parser.add_argument(
+      '--pca_dim', type=int, default=50,
+      help='the dimension the activations are reduced to before t-SNE')
+  parser.add_argument(
+      '--perplexity', type=float, default=30.0, help='the t-SNE perplexity')
+  parser.add_argument(
+      '--max_points', type=int, default=20000,
+      help='embed a random subset of at most this many points, 0 for all')
+  parser.add_argument(
+      '--seed', type=int, default=0, help='the random seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
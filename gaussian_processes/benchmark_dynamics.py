@@ -0,0 +1,238 @@
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from sklearn.metrics import mean_squared_error
+
+from gaussian_process_agent import GaussianProcessAgent
+from gym_environment import Continuous_MountainCarEnv
+
+DEFAULT_TRAINING_SIZES = [25, 50, 75, 100, 125, 150, 200, 250, 300]
+CSV_FIELDS = ['num_examples', 'rep', 'seed', 'fit_seconds', 'predict_seconds',
+              'x_rms', 'x_dot_rms']
+
+# Per-process state, populated once by _init_worker so that the validation set
+# is pickled once per worker rather than once per task.
+_worker_agent = None
+_worker_validation = None
+
+
+def main():
+  args = command_line_args()
+
+  if not os.path.exists(args.output_dir):
+    os.makedirs(args.output_dir)
+
+  agent = _make_agent(args.gaussian_reward_scale)
+  validation = load_validation_set(
+      agent, args.validation_cache, args.num_validation_examples, args.seed,
+      {'gaussian_reward_scale': args.gaussian_reward_scale})
+
+  tasks = make_tasks(args.training_sizes, args.num_reps, args.seed)
+  print("Running %s dynamics fits on %s processes" %
+        (len(tasks), args.num_processes))
+
+  start_time = time.time()
+  pool = multiprocessing.Pool(
+      processes=args.num_processes, initializer=_init_worker,
+      initargs=(args.gaussian_reward_scale, validation))
+  try:
+    results = pool.map(_run_cell, tasks, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  wall_seconds = time.time() - start_time
+
+  summary = summarise(results)
+  for row in summary:
+    print("Number of training samples: %s, x_rms: %.5f, x_dot_rms: %.5f, "
+          "fit: %.2fs" % (row['num_examples'], row['x_rms_mean'],
+                          row['x_dot_rms_mean'], row['fit_seconds_mean']))
+  print("Total wall time: %.1fs" % wall_seconds)
+
+  save_results(args.output_dir, results, summary, vars(args), wall_seconds)
+  plot_results(args.output_dir, summary)
+
+
+def make_tasks(training_sizes, num_reps, seed):
+  ''' Build the (size, rep) grid, giving every cell its own seed so that
+      results do not depend on scheduling order or the number of processes.
+  '''
+  cells = [(size, rep) for size in training_sizes for rep in range(num_reps)]
+  seeds = np.random.RandomState(seed).randint(
+      0, np.iinfo(np.int32).max, size=len(cells))
+  return [(size, rep, int(task_seed))
+          for (size, rep), task_seed in zip(cells, seeds)]
+
+
+def load_validation_set(agent, cache_path, num_examples, seed, env_settings):
+  ''' Load the validation transitions from cache_path, generating and caching
+      them through the environment if the cache is missing or was generated
+      with another seed, number of examples or environment.
+
+    # Params
+      env_settings (dict): The environment settings the benchmark was run
+          with, e.g. the reward scale, recorded with the cached transitions.
+  '''
+  # Round tripped through JSON, as the cached settings are
+  settings = json.loads(json.dumps(dict(
+      env_settings, seed=seed, num_examples=num_examples,
+      state_low=agent.state_low.tolist(), state_high=agent.state_high.tolist(),
+      action_low=agent.action_low.tolist(),
+      action_high=agent.action_high.tolist()), sort_keys=True))
+
+  if cache_path and os.path.exists(cache_path):
+    with np.load(cache_path) as cached:
+      if 'settings' in cached.files \
+          and json.loads(str(cached['settings'])) == settings:
+        print("Loaded validation set from %s" % cache_path)
+        return cached['inputs'], cached['next_states']
+    print("Regenerating the validation set, %s was generated with other "
+          "settings" % cache_path)
+
+  inputs, next_states = agent.sample_transitions(
+      num_examples, random_state=np.random.RandomState(seed))
+
+  if cache_path:
+    np.savez(cache_path, inputs=inputs, next_states=next_states,
+             settings=json.dumps(settings, sort_keys=True))
+    print("Cached validation set to %s" % cache_path)
+
+  return inputs, next_states
+
+
+def summarise(results):
+  summary = []
+  for size in sorted(set(r['num_examples'] for r in results)):
+    cells = [r for r in results if r['num_examples'] == size]
+    row = {'num_examples': size, 'num_reps': len(cells)}
+    for key in ['fit_seconds', 'predict_seconds', 'x_rms', 'x_dot_rms']:
+      vals = np.array([c[key] for c in cells])
+      row[key + '_mean'] = float(np.mean(vals))
+      row[key + '_std'] = float(np.std(vals))
+    summary.append(row)
+  return summary
+
+
+def save_results(output_dir, results, summary, config, wall_seconds):
+  with open(os.path.join(output_dir, 'dynamics_benchmark.csv'), 'w') as f:
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for row in results:
+      writer.writerow(row)
+
+  with open(os.path.join(output_dir, 'dynamics_benchmark.json'), 'w') as f:
+    json.dump({'config': config, 'wall_seconds': wall_seconds,
+               'summary': summary, 'cells': results}, f, indent=2)
+
+
+def plot_results(output_dir, summary):
+  sizes = [row['num_examples'] for row in summary]
+
+  fig, ax = plt.subplots()
+  for key, label in [('x_rms', 'X'), ('x_dot_rms', 'X_DOT')]:
+    ax.errorbar(sizes, [row[key + '_mean'] for row in summary],
+                yerr=[row[key + '_std'] for row in summary], label=label,
+                capsize=3)
+  ax.legend()
+  ax.set_ylabel('RMS Error')
+  ax.set_xlabel('Number of Training Examples')
+  fig.savefig(os.path.join(output_dir, 'dynamics_rms.png'), dpi=300)
+  plt.close(fig)
+
+  fig, ax = plt.subplots()
+  for key, label in [('fit_seconds', 'Fit'), ('predict_seconds', 'Predict')]:
+    ax.errorbar(sizes, [row[key + '_mean'] for row in summary],
+                yerr=[row[key + '_std'] for row in summary], label=label,
+                capsize=3)
+  ax.legend()
+  ax.set_ylabel('Time (s)')
+  ax.set_xlabel('Number of Training Examples')
+  fig.savefig(os.path.join(output_dir, 'dynamics_timing.png'), dpi=300)
+  plt.close(fig)
+
+
+def _make_agent(gaussian_reward_scale):
+  env = Continuous_MountainCarEnv(gaussian_reward_scale=gaussian_reward_scale)
+  return GaussianProcessAgent(env)
+
+
+def _init_worker(gaussian_reward_scale, validation):
+  global _worker_agent, _worker_validation
+  _worker_agent = _make_agent(gaussian_reward_scale)
+  _worker_validation = validation
+
+
+def _run_cell(task):
+  num_examples, rep, seed = task
+  inputs, next_states = _worker_validation
+  rng = np.random.RandomState(seed)
+
+  train_inputs, train_next_states = _worker_agent.sample_transitions(
+      num_examples, random_state=rng)
+
+  start_time = time.time()
+  gp_x, gp_x_dot = _worker_agent.fit_dynamics(
+      train_inputs, train_next_states, random_state=rng)
+  fit_seconds = time.time() - start_time
+
+  start_time = time.time()
+  estimated_next_xs = gp_x.predict(inputs)
+  estimated_next_x_dots = gp_x_dot.predict(inputs)
+  predict_seconds = time.time() - start_time
+
+  next_xs, next_x_dots = next_states[:, 0], next_states[:, 1]
+
+  return {
+      'num_examples': num_examples,
+      'rep': rep,
+      'seed': seed,
+      'fit_seconds': fit_seconds,
+      'predict_seconds': predict_seconds,
+      'x_rms': math.sqrt(mean_squared_error(next_xs, estimated_next_xs)),
+      'x_dot_rms': math.sqrt(
+          mean_squared_error(next_x_dots, estimated_next_x_dots)),
+  }
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmarks the sample efficiency of the Gaussian Process \
+      dynamics model over a grid of training set sizes.')
+  parser.add_argument(
+      '--training_sizes', type=int, nargs='+', default=DEFAULT_TRAINING_SIZES,
+      help='the training set sizes to evaluate')
+  parser.add_argument(
+      '--num_reps', type=int, default=10,
+      help='the number of repetitions per training set size')
+  parser.add_argument(
+      '--num_validation_examples', type=int, default=1000,
+      help='the number of held out transitions to evaluate on')
+  parser.add_argument(
+      '--validation_cache', type=str, default='dynamics_validation.npz',
+      help='file in which the validation transitions are cached, with the '
+      'seed and settings they were generated with')
+  parser.add_argument(
+      '--num_processes', type=int, default=multiprocessing.cpu_count(),
+      help='the number of worker processes')
+  parser.add_argument(
+      '--gaussian_reward_scale', type=float, default=0.05,
+      help='the length scale of the gaussian reward')
+  parser.add_argument(
+      '--output_dir', type=str, default='./dynamics_benchmark',
+      help='the output directory for results and plots')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
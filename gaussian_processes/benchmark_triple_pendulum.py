@@ -0,0 +1,115 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from triple_pendulum_environment import (SUBSTEPS, TriplePendulumEnv,
+                                         TriplePendulumVecEnv, integrate)
+
+
+def main():
+  args = command_line_args()
+  results = {}
+
+  if args.recording:
+    results['recording'] = compare_to_recording(args.recording, args.substeps)
+    print("Max abs error against %s: velocities %.3e, angles %.3e" %
+          (args.recording, results['recording']['max_velocity_error'],
+           results['recording']['max_angle_error']))
+
+  results['single_env_steps_per_second'] = benchmark_single_env(
+      args.num_steps, args.substeps, args.seed)
+  print("Single env: %.0f steps/s" % results['single_env_steps_per_second'])
+
+  results['vec_env_steps_per_second'] = {}
+  for num_envs in args.num_envs:
+    steps_per_second = benchmark_vec_env(
+        num_envs, max(1, args.num_steps // num_envs), args.substeps, args.seed)
+    results['vec_env_steps_per_second'][num_envs] = steps_per_second
+    print("Vec env, %s envs: %.0f steps/s" % (num_envs, steps_per_second))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+def compare_to_recording(path, substeps):
+  ''' Replay the controls of a trajectory recorded with
+      pilco_triple_pendulum/record_trajectory_tp.m and compare the states.
+
+    # Params
+      path (str): CSV with one row per time step of
+          (t, dt1, dt2, dt3, t1, t2, t3, u1, u2, u3), where u is the torque
+          applied from that state until the next row.
+      substeps (int): Runge-Kutta steps per time step.
+  '''
+  recording = np.loadtxt(path, delimiter=',', ndmin=2)
+  times, states, torques = recording[:, 0], recording[:, 1:7], recording[:, 7:10]
+
+  simulated = np.zeros_like(states)
+  simulated[0] = states[0]
+  for i in range(1, states.shape[0]):
+    simulated[i] = integrate(simulated[i-1:i], torques[i-1:i],
+                             dt=times[i]-times[i-1], substeps=substeps)[0]
+
+  errors = np.abs(simulated - states)
+  return {
+      'num_steps': int(states.shape[0] - 1),
+      'max_velocity_error': float(np.max(errors[:, :3])),
+      'max_angle_error': float(np.max(errors[:, 3:])),
+  }
+
+
+def benchmark_single_env(num_steps, substeps, seed):
+  env = TriplePendulumEnv(substeps=substeps)
+  env.seed(seed)
+  env.reset()
+  actions = np.random.RandomState(seed).uniform(-3, 3, size=(num_steps, 3))
+
+  start_time = time.time()
+  for action in actions:
+    _, _, done, _ = env.step(action)
+    if done:
+      env.reset()
+  return num_steps / (time.time() - start_time)
+
+
+def benchmark_vec_env(num_envs, num_steps, substeps, seed):
+  env = TriplePendulumVecEnv(num_envs, seed=seed, substeps=substeps)
+  actions = np.random.RandomState(seed).uniform(
+      -3, 3, size=(num_steps, num_envs, 3))
+
+  start_time = time.time()
+  for action in actions:
+    env.step(action)
+  return num_steps * num_envs / (time.time() - start_time)
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmarks the throughput of the triple pendulum \
+      simulator and optionally checks it against a recorded MATLAB \
+      trajectory.')
+  parser.add_argument(
+      '--recording', type=str, default=None,
+      help='CSV trajectory written by record_trajectory_tp.m')
+  parser.add_argument(
+      '--num_envs', type=int, nargs='+', default=[1, 16, 256, 4096],
+      help='the batch sizes to benchmark the vectorised environment with')
+  parser.add_argument(
+      '--num_steps', type=int, default=20000,
+      help='the total number of environment steps per benchmark')
+  parser.add_argument(
+      '--substeps', type=int, default=SUBSTEPS,
+      help='the number of Runge-Kutta steps per environment step')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='file to write the results to as JSON')
+  parser.add_argument(
+      '--seed', type=int, default=1, help='the random number generator seed')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -2,83 +2,119 @@ import itertools
 import math
 import pickle
 
-import matplotlib.lines as mlines
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib import cm
-from matplotlib.ticker import FormatStrFormatter, LinearLocator
-from mpl_toolkits.mplot3d import Axes3D
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF, ConstantKernel, WhiteKernel
 from sklearn.metrics import mean_squared_error
+from scipy.linalg import cho_solve
+
+from moment_matching import MomentMatchingDynamics, expected_reward
+from value_model import IncrementalValueGP
 
 
 class GaussianProcessAgent(object):
   ''' The agent in the reinforcement learning framework. The agent must
       first learn a value function before
       it can act optimally with respect to that value function.
-  '''
-
-  def __init__(self, environment, visualise=None):
-    self.x_min, self.x_max = -1, 1
-    self.x_points = 21
-    self.x = np.linspace(self.x_min, self.x_max, num=self.x_points)
 
-    self.x_dot_min, self.x_dot_max = -2, 2
-    self.x_dot_points = 21
-    self.x_dot = np.linspace(
-        self.x_dot_max, self.x_dot_min, num=self.x_dot_points)
+      The state and action spaces are discretised on grids of support points,
+      one 1-D support per dimension. The defaults reproduce the 2-D
+      MountainCar setup, other tasks pass their own supports and target.
+
+      # Params
+        environment: The environment, which must support reset(state=...),
+            step(action) and get_state().
+        visualise (bool): Save out plots of the value function (2-D only).
+        value_reoptimise_every (int): See IncrementalValueGP.
+        state_supports ([np.array]): Support points for each state dimension.
+        action_supports ([np.array]): Support points for each action dimension.
+        target (np.array): The state at the centre of the Gaussian reward.
+        reward_length_scale (float): Length scale of the Gaussian reward.
+        num_dynamics_examples (int): Transitions used to learn the dynamics.
+        max_chunk_elements (int): Upper bound on the number of elements of the
+            intermediate arrays built when maximising over actions.
+        support_values_file (str): File the learned support values are cached
+            in between runs.
+  '''
 
-    self.a_min, self.a_max = -4, 4
-    self.a_points = 21
-    self.a = np.linspace(self.a_min, self.a_max, num=self.a_points)
+  def __init__(self, environment, visualise=None, value_reoptimise_every=None,
+               state_supports=None, action_supports=None, target=None,
+               reward_length_scale=None, num_dynamics_examples=50,
+               max_chunk_elements=2**24, support_values_file='support_values'):
+    if state_supports is None:
+      state_supports = [np.linspace(-1, 1, num=21),
+                        np.linspace(2, -2, num=21)]
+    if action_supports is None:
+      action_supports = [np.linspace(-4, 4, num=21)]
+    if target is None:
+      target = [environment._goal_position, environment._goal_velocity]
+    if reward_length_scale is None:
+      reward_length_scale = environment._gaussian_reward_length_scale
+
+    self.state_supports = [np.asarray(s, dtype=np.float64)
+                           for s in state_supports]
+    self.action_supports = [np.asarray(s, dtype=np.float64)
+                            for s in action_supports]
+    self.state_dim = len(self.state_supports)
+    self.action_dim = len(self.action_supports)
+    self.state_low = np.array([np.amin(s) for s in self.state_supports])
+    self.state_high = np.array([np.amax(s) for s in self.state_supports])
+    self.action_low = np.array([np.amin(s) for s in self.action_supports])
+    self.action_high = np.array([np.amax(s) for s in self.action_supports])
+
+    # Support states and candidate actions, first dimension varying fastest
+    self.states = _grid(self.state_supports)
+    self.actions = _grid(self.action_supports)
+
+    self.target = np.asarray(target, dtype=np.float64)
+    self.reward_length_scale = reward_length_scale
 
     self.gamma = 0.8
     self.converged_threshold = 0.001
+    self.num_dynamics_examples = num_dynamics_examples
+    self.max_chunk_elements = max_chunk_elements
+    self.support_values_file = support_values_file
 
-    self.support_values = np.zeros((self.x_points * self.x_dot_points, 1))
+    self.support_values = np.zeros((self.states.shape[0], 1))
+    kernel = ConstantKernel(constant_value=1.0, constant_value_bounds=(
+        1e-3, 100)) * RBF(length_scale=[0.1] * self.state_dim,
+                          length_scale_bounds=(0.05, 10.0))
+    self.value_model = IncrementalValueGP(
+        kernel=kernel, alpha=0.01, reoptimise_every=value_reoptimise_every)
     self.environment = environment
     self.visualise = visualise if visualise is not None else False
 
-    self.states = np.zeros((self.x_points * self.x_dot_points, 2))
-    for i in range(self.x_dot_points):
-      for j in range(self.x_points):
-        self.states[i * self.x_points + j][0] = self.x[j]
-        self.states[i * self.x_points + j][1] = self.x_dot[i]
-
-    self.num_fine_points = 250
-    self.x_fine = np.linspace(self.x_min, self.x_max, num=self.num_fine_points)
-    self.x_dot_fine = np.linspace(
-        self.x_dot_max, self.x_dot_min, num=self.num_fine_points)
-    self.states_fine = np.zeros((self.num_fine_points ** 2, 2))
-
-    for i in range(250):
-      for j in range(250):
-        self.states_fine[i * 250 + j][0] = self.x_fine[j]
-        self.states_fine[i * 250 + j][1] = self.x_dot_fine[i]
+    if self.state_dim == 2:
+      self.num_fine_points = 250
+      self.fine_supports = [
+          np.linspace(s[0], s[-1], num=self.num_fine_points)
+          for s in self.state_supports]
+      self.states_fine = _grid(self.fine_supports)
 
   def initialise_support_values(self):
-    for i in range(self.x_points * self.x_dot_points):
-      state = self.states[i]
-      reward, _ = self.environment._reward(state)
-      self.support_values[i][0] = reward
+    self.support_values = self.expected_reward(
+        self.states, np.zeros_like(self.states)).reshape((-1, 1))
 
   def learn_value_function(self, states, values):
-    kernel = ConstantKernel(constant_value=1.0, constant_value_bounds=(
-        1e-3, 100)) * RBF(length_scale=[0.1, 0.1], length_scale_bounds=(0.05, 10.0))
-    gp_val = GaussianProcessRegressor(kernel=kernel, alpha=0.01)
-    gp_val = gp_val.fit(states, values)
-
-    return gp_val
+    # The support states are fixed across sweeps, so after the first fit this
+    # only re-solves for alpha_ against the cached Cholesky factor.
+    return self.value_model.fit(states, values)
 
   def visualise_value_function(self, iter_num, maximising_actions=None, show_fig=False):
-    if not self.visualise:
+    if not self.visualise or self.state_dim != 2:
       return
 
+    # matplotlib is only loaded when visualising
+    import matplotlib.pyplot as plt
+    from matplotlib import cm
+    from matplotlib.ticker import FormatStrFormatter, LinearLocator
+    # Registers the 3d projection
+    from mpl_toolkits.mplot3d import Axes3D  # pylint: disable=unused-import
+
     fig = plt.figure()
     ax = fig.gca(projection='3d')
 
-    X, X_DOT = np.meshgrid(self.x_fine, self.x_dot_fine)
+    X, X_DOT = np.meshgrid(*self.fine_supports)
     predicted_vals = self.gp_val.predict(self.states_fine).reshape(
         (self.num_fine_points, self.num_fine_points))
     surf = ax.plot_surface(X, X_DOT, predicted_vals,
@@ -98,11 +134,10 @@ class GaussianProcessAgent(object):
     plt.colorbar(contour, shrink=0.5)
     plt.savefig("values%s.png" % iter_num, dpi=300)
 
-    if maximising_actions is not None:
+    if maximising_actions is not None and self.action_dim == 1:
       plt.clf()
-      X, X_DOT = np.meshgrid(self.x, self.x_dot)
-      maximising_actions = maximising_actions.reshape(
-          (self.x_points, self.x_dot_points))
+      X, X_DOT = np.meshgrid(*self.state_supports)
+      maximising_actions = maximising_actions.reshape(X.shape)
       contour = plt.contourf(X, X_DOT, maximising_actions)
       plt.colorbar(contour, shrink=0.5)
       plt.savefig("actions%s.png" % iter_num, dpi=300)
@@ -110,95 +145,104 @@ class GaussianProcessAgent(object):
     if show_fig:
       plt.show()
 
-  def learn_dynamics(self, num_dynamics_examples):
-    x = np.random.uniform(low=self.x_min, high=self.x_max,
-                          size=num_dynamics_examples)
-    x_dot = np.random.uniform(
-        low=self.x_dot_min, high=self.x_dot_max, size=num_dynamics_examples)
-    a = np.random.uniform(low=self.a_min, high=self.a_max,
-                          size=num_dynamics_examples)
-
-    start_states = list(zip(x, x_dot, a))
-    next_xs, next_x_dots = [], []
-
-    for state in start_states:
-      x, x_dot, a = state
-      self.environment.reset(state=[x, x_dot])
-      self.environment.step(a)
-      next_x, next_x_dot = self.environment.get_state()
-      next_xs.append(next_x)
-      next_x_dots.append(next_x_dot)
-
+  def sample_transitions(self, num_examples, random_state=None):
+    ''' Sample state-action pairs uniformly over the state and action ranges
+        and step the environment once from each of them.
+
+      # Params
+        num_examples (int): The number of transitions to sample.
+        random_state (np.random.RandomState): Source of randomness. Defaults to
+            the global numpy random number generator.
+
+      # Returns
+        inputs: Array of concatenated (state, action) pairs, dimension
+            [num_examples, state_dim + action_dim]
+        next_states: Array of resulting states, dimension
+            [num_examples, state_dim]
+    '''
+    rng = random_state if random_state is not None else np.random
+
+    states = rng.uniform(low=self.state_low, high=self.state_high,
+                         size=(num_examples, self.state_dim))
+    actions = rng.uniform(low=self.action_low, high=self.action_high,
+                          size=(num_examples, self.action_dim))
+
+    next_states = np.zeros((num_examples, self.state_dim))
+
+    for i, (state, action) in enumerate(zip(states, actions)):
+      self.environment.reset(state=state)
+      self.environment.step(self._env_action(action))
+      next_states[i] = self.environment.get_state()
+
+    return np.hstack([states, actions]), next_states
+
+  def fit_dynamics(self, inputs, next_states, random_state=None):
+    ''' Fit one GP per state dimension, mapping (state, action) to the next
+        value of that dimension.
+    '''
+    input_dim = self.state_dim + self.action_dim
     kernel = ConstantKernel(constant_value=1.0, constant_value_bounds=(1e-3, 1e3))\
-                * RBF(length_scale=[0.25, 0.25, 0.25], length_scale_bounds=(1e-3, 20))\
+                * RBF(length_scale=[0.25] * input_dim, length_scale_bounds=(1e-3, 20))\
                 + WhiteKernel(noise_level=1e-3, noise_level_bounds=(1e-5, 10.0))
 
-    gp_x = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=9)
-    gp_x.fit(start_states, next_xs)
+    gp_dynamics = []
+    for d in range(self.state_dim):
+      gp = GaussianProcessRegressor(
+          kernel=kernel, n_restarts_optimizer=9, random_state=random_state)
+      gp.fit(inputs, next_states[:, d])
+      gp_dynamics.append(gp)
 
-    gp_x_dot = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=9)
-    gp_x_dot.fit(start_states, next_x_dots)
+    return gp_dynamics
 
-    return gp_x, gp_x_dot
+  def learn_dynamics(self, num_dynamics_examples, random_state=None):
+    inputs, next_states = self.sample_transitions(
+        num_dynamics_examples, random_state=random_state)
+
+    return self.fit_dynamics(inputs, next_states, random_state=random_state)
 
   def test_learn_dynamics(self):
+    ''' Quick serial sweep of dynamics RMS error against training set size.
+        See benchmark_dynamics.py for the parallel, headless version.
+    '''
     num_training_examples = [25, 50, 75, 100, 125, 150, 200, 250, 300]
     num_validation_examples = 1000
 
-    x = np.random.uniform(low=self.x_min, high=self.x_max,
-                          size=num_validation_examples)
-    x_dot = np.random.uniform(
-        low=self.x_dot_min, high=self.x_dot_max, size=num_validation_examples)
-    a = np.random.uniform(low=self.a_min, high=self.a_max,
-                          size=num_validation_examples)
-
-    start_states = list(zip(x, x_dot, a))
-    next_xs, next_x_dots = [], []
-    x_rmss, x_dot_rmss = [], []
-
-    for state in start_states:
-      x, x_dot, a = state
-      self.environment.reset(state=[x, x_dot])
-      self.environment.step(a)
-      next_x, next_x_dot = self.environment.get_state()
-      next_xs.append(next_x)
-      next_x_dots.append(next_x_dot)
+    inputs, next_states = self.sample_transitions(num_validation_examples)
+    rmss = []
 
     for num_examples in num_training_examples:
-      x_rms, x_dot_rms = 0, 0
+      rms = np.zeros(self.state_dim)
       num_reps = 10
 
       for i in range(num_reps):
-        gp_x, gp_x_dot = self.learn_dynamics(num_examples)
-        estimated_next_xs = gp_x.predict(start_states)
-        estimated_next_x_dots = gp_x_dot.predict(start_states)
-        x_rms += math.sqrt(mean_squared_error(next_xs, estimated_next_xs))
-        x_dot_rms += math.sqrt(mean_squared_error(next_x_dots,
-                                                  estimated_next_x_dots))
-
-      x_dot_rmss.append(x_dot_rms/num_reps)
-      x_rmss.append(x_rms/num_reps)
-
-      print("Number of training samples: %s, x_rms: %s, x_dot_rms: %s" %
-            (num_examples, x_rms, x_dot_rms))
-
-    x_rms_handle, = plt.plot(num_training_examples, x_rmss, label="X")
-    x_dot_rms_handle, = plt.plot(
-        num_training_examples, x_dot_rmss, label="X_DOT")
-    plt.legend(handles=[x_rms_handle, x_dot_rms_handle])
+        gp_dynamics = self.learn_dynamics(num_examples)
+        for d, gp in enumerate(gp_dynamics):
+          rms[d] += math.sqrt(
+              mean_squared_error(next_states[:, d], gp.predict(inputs)))
+
+      rmss.append(rms/num_reps)
+
+      print("Number of training samples: %s, rms: %s" % (num_examples, rms))
+
+    import matplotlib.pyplot as plt
+    rmss = np.array(rmss)
+    handles = []
+    for d in range(self.state_dim):
+      handle, = plt.plot(num_training_examples, rmss[:, d],
+                         label="State %s" % d)
+      handles.append(handle)
+    plt.legend(handles=handles)
     plt.ylabel('RMS Error')
     plt.xlabel('Number of Training Examples')
     plt.show()
 
   def learn(self):
-    num_training_examples = 50
-
     # Try loading prelearned value function
     try:
-      with open('support_values', 'rb') as fp:
+      with open(self.support_values_file, 'rb') as fp:
         print("successfully loaded support_values file")
         self.support_values = pickle.load(fp)
-        self.gp_x, self.gp_x_dot = self.learn_dynamics(num_training_examples)
+        self.gp_dynamics = self.learn_dynamics(self.num_dynamics_examples)
         self.gp_val = self.learn_value_function(
             self.states, self.support_values)
         return
@@ -207,38 +251,27 @@ class GaussianProcessAgent(object):
       self.initialise_support_values()
 
     self.gp_val = self.learn_value_function(self.states, self.support_values)
-    self.gp_x, self.gp_x_dot = self.learn_dynamics(num_training_examples)
+    self.gp_dynamics = self.learn_dynamics(self.num_dynamics_examples)
 
+    num_states = self.states.shape[0]
     converged = False
     iter_num = 1
+    k_v_inv = None
 
     while not converged:
-      k_v_chol = self.gp_val.L_.dot(self.gp_val.L_.T)
-      k_v_inv = np.linalg.inv(k_v_chol)
-
-      v_squared, l1, l2 = np.exp(self.gp_val.kernel_.theta)
-
-      print("Learned GP hyperparameters: v_squared: %s, l1: %s, l2: %s" %
-            (v_squared, l1, l2))
-
-      R = np.zeros((self.x_points * self.x_dot_points, 1))
-      W = np.zeros((self.x_points * self.x_dot_points,
-                    self.x_points * self.x_dot_points))
-      maximising_actions = np.zeros((self.x_points * self.x_dot_points, 1))
+      if k_v_inv is None or self.value_model.factorisation_changed:
+        k_v_inv = cho_solve(
+            (self.gp_val.L_, True), np.eye(self.gp_val.L_.shape[0]))
 
-      for state_index in range(len(self.states)):
-        x, x_dot = self.states[state_index]
+        hyperparameters = np.exp(self.gp_val.kernel_.theta)
+        print("Learned GP hyperparameters: v_squared: %s, lengths: %s" %
+              (hyperparameters[0], hyperparameters[1:]))
 
-        max_val_index, r, w = self.find_max_action(x, x_dot)
+      max_val_indices, R, W = self.find_max_actions(self.states)
+      maximising_actions = self.actions[max_val_indices]
 
-        maximising_actions[state_index][0] = self.a[max_val_index]
-        R[state_index][0] = r
-        W[state_index] = w
-
-      intermediate1 = np.eye(
-          self.x_points * self.x_dot_points) - self.gamma * W.dot(k_v_inv)
-      intermediate2 = np.linalg.inv(intermediate1)
-      new_v = intermediate2.dot(R)
+      intermediate = np.eye(num_states) - self.gamma * W.dot(k_v_inv)
+      new_v = np.linalg.solve(intermediate, R.reshape((-1, 1)))
 
       change_in_val = mean_squared_error(self.support_values, new_v)
       print("rms change in support point values: %s" % (change_in_val))
@@ -252,63 +285,151 @@ class GaussianProcessAgent(object):
           maximising_actions=maximising_actions, iter_num=iter_num)
       iter_num += 1
 
-      with open('support_values', 'wb') as fp:
+      with open(self.support_values_file, 'wb') as fp:
         pickle.dump(self.support_values, fp)
 
-  def find_max_action(self, x, x_dot):
-    target = np.array([self.environment._goal_position,
-                       self.environment._goal_velocity]).reshape((-1, 1))
-    k_v_inv_v = self.gp_val.alpha_
-
-    v_squared, l1, l2 = np.exp(self.gp_val.kernel_.theta)
-    lengths = np.array([l1, l2]).reshape((-1, 1))
-    lengths_squared = np.square(lengths)
-
-    state_actions = np.array(list(itertools.product([x], [x_dot], self.a)))
-
-    mu_x, std_dev_x = self.gp_x.predict(state_actions, return_std=True)
-    mu_x_dot, std_dev_x_dot = self.gp_x_dot.predict(
-        state_actions, return_std=True)
-
-    means = np.array([mu_x, mu_x_dot])
-    var = np.square(np.array([std_dev_x, std_dev_x_dot]))
-    length_squared_plus_var = np.add(var, lengths_squared)
-    state_diffs = np.subtract(self.states[:, :, np.newaxis], means)
-    state_diffs_squared = np.square(state_diffs)
-    state_diffs_squared_divided_length_plus_var = np.divide(
-        state_diffs_squared, length_squared_plus_var)
-    summed = -0.5 * np.sum(state_diffs_squared_divided_length_plus_var, axis=1)
-    exponentiated = np.exp(summed)
-    product = np.prod(length_squared_plus_var, axis=0)
-    square_root = np.sqrt(product)
-
-    w = np.prod(lengths) * v_squared * np.divide(exponentiated, square_root)
-
-    target_minus_mean = np.subtract(target, means)
-    squared_target_minus_mean = np.square(target_minus_mean)
-    var_plus = var + self.environment._gaussian_reward_length_scale ** 2
-    divided = np.divide(squared_target_minus_mean, var_plus)
-    summed = -0.5 * np.sum(divided, axis=0)
-    exponentiated = np.exp(summed)
-    product = np.prod(var_plus, axis=0)
-    square_root = np.sqrt(product)
-    r = np.divide(exponentiated, square_root)
-    r /= (2 * math.pi * 63.66)  # Note renormalising
-
-    v = self.gamma * w.T.dot(k_v_inv_v)
-    val_i = r + v.T
-
-    max_val_index = np.argmax(val_i)
-
-    return max_val_index, r[max_val_index], w[:, max_val_index]
+  def find_max_actions(self, query_states):
+    ''' Find the action maximising the expected reward plus discounted value
+        of the next state, for each of a batch of states.
+
+        With Gaussian predictive distributions over the next state and an
+        ARD squared exponential value kernel, both the expected reward and
+        the expected kernel values W against the support states have closed
+        forms. The query states are processed in chunks so the
+        [n_support, chunk, n_actions] intermediates stay within
+        max_chunk_elements.
+
+      # Params
+        query_states: States to maximise over, dimension [n_query, state_dim]
+
+      # Returns
+        max_val_indices: Index into self.actions of the maximising action,
+            dimension [n_query]
+        r: Expected reward of the maximising action, dimension [n_query]
+        w: Expected kernel values between the next state under the maximising
+            action and the support states, dimension [n_query, n_support]
+    '''
+    query_states = np.atleast_2d(query_states)
+    num_query = query_states.shape[0]
+    num_actions = self.actions.shape[0]
+    num_support = self.states.shape[0]
+
+    chunk_size = max(
+        1, self.max_chunk_elements // (num_support * num_actions))
+
+    max_val_indices = np.zeros(num_query, dtype=np.int64)
+    r = np.zeros(num_query)
+    w = np.zeros((num_query, num_support))
+
+    for start in range(0, num_query, chunk_size):
+      end = min(start + chunk_size, num_query)
+      max_val_indices[start:end], r[start:end], w[start:end] = \
+          self._find_max_actions_chunk(query_states[start:end])
+
+    return max_val_indices, r, w
+
+  def _find_max_actions_chunk(self, query_states):
+    num_query = query_states.shape[0]
+    num_actions = self.actions.shape[0]
+    k_v_inv_v = self.gp_val.alpha_.reshape((-1,))
+
+    hyperparameters = np.exp(self.gp_val.kernel_.theta)
+    v_squared, lengths_squared = hyperparameters[0], hyperparameters[1:] ** 2
+
+    # Every (query state, action) pair, query state varying slowest
+    state_actions = np.hstack([
+        np.repeat(query_states, num_actions, axis=0),
+        np.tile(self.actions, (num_query, 1))])
+
+    means = np.zeros((state_actions.shape[0], self.state_dim))
+    var = np.zeros((state_actions.shape[0], self.state_dim))
+    for d, gp in enumerate(self.gp_dynamics):
+      mu, std_dev = gp.predict(state_actions, return_std=True)
+      means[:, d] = mu
+      var[:, d] = np.square(std_dev)
+
+    # Expected value kernel against the support states. The squared
+    # Mahalanobis distance sum_d (s_d - mu_d)^2 / c_d is expanded into matrix
+    # products so no [n_support, n_pairs, state_dim] array is formed.
+    length_squared_plus_var = var + lengths_squared
+    inv_c = 1.0 / length_squared_plus_var
+    mahalanobis = np.square(self.states).dot(inv_c.T) \
+        - 2 * self.states.dot((means * inv_c).T) \
+        + np.sum(np.square(means) * inv_c, axis=1)
+    w = np.sqrt(np.prod(lengths_squared)) * v_squared \
+        * np.exp(-0.5 * np.maximum(mahalanobis, 0)) \
+        / np.sqrt(np.prod(length_squared_plus_var, axis=1))
+
+    r = self.expected_reward(means, var)
+
+    val = r + self.gamma * w.T.dot(k_v_inv_v)
+    val = val.reshape((num_query, num_actions))
+    max_val_indices = np.argmax(val, axis=1)
+
+    pair_indices = np.arange(num_query) * num_actions + max_val_indices
+    return max_val_indices, r[pair_indices], w[:, pair_indices].T
+
+  def expected_reward(self, means, var):
+    ''' Expected Gaussian reward centred on the target for next states with
+        independent Gaussian marginals. Normalised to a peak of one.
+
+      # Params
+        means: Means of the states, dimension [n, state_dim]
+        var: Variances of the states, dimension [n, state_dim]
+    '''
+    reward_var = np.square(self.reward_length_scale) * np.ones(self.state_dim)
+    var_plus = var + reward_var
+    exponentiated = np.exp(
+        -0.5 * np.sum(np.square(self.target - means) / var_plus, axis=1))
+    return exponentiated * np.sqrt(np.prod(reward_var)) \
+        / np.sqrt(np.prod(var_plus, axis=1))
+
+  def predict_trajectory(self, initial_means, initial_covs, policy, horizon):
+    ''' Predict Gaussian state distributions along a trajectory by moment
+        matching through the learned dynamics GPs.
+
+      # Params
+        initial_means: Initial state means, dimension [B, state_dim]
+        initial_covs: Initial state covariances, dimension
+            [B, state_dim, state_dim]
+        policy: A policy from moment_matching, e.g. LinearPolicy.
+        horizon (int): The number of steps to predict.
+
+      # Returns
+        means: State means, dimension [horizon+1, B, state_dim]
+        covs: State covariances, dimension
+            [horizon+1, B, state_dim, state_dim]
+    '''
+    dynamics = MomentMatchingDynamics(self.gp_dynamics)
+    return dynamics.propagate(initial_means, initial_covs, policy, horizon)
+
+  def evaluate_policy(self, initial_means, initial_covs, policy, horizon):
+    ''' Discounted sum of expected rewards along the predicted trajectory,
+        one value per initial state distribution.
+    '''
+    means, covs = self.predict_trajectory(
+        initial_means, initial_covs, policy, horizon)
+    rewards = expected_reward(
+        means, covs, self.target, self.reward_length_scale)
+    discounts = self.gamma ** np.arange(horizon + 1)
+    return discounts.dot(rewards)
+
+  def find_max_action(self, state):
+    max_val_indices, r, w = self.find_max_actions(state)
+    return max_val_indices[0], r[0], w[0]
 
   def act(self, env_state):
-    current_x, current_x_dot = env_state
-    max_val_index, _, _ = self.find_max_action(current_x, current_x_dot)
+    max_val_index, _, _ = self.find_max_action(env_state)
+
+    return self._env_action(self.actions[max_val_index])
 
-    return self.a[max_val_index]
+  def _env_action(self, action):
+    # Scalar-action environments such as MountainCar take a plain float
+    return action[0] if self.action_dim == 1 else action
 
   def plot_actions(self, xs, x_dots):
+    import matplotlib.lines as mlines
+    import matplotlib.pyplot as plt
     redline = mlines.Line2D([], [], color='red', label="Actual")
     predicted, = plt.plot(xs, x_dots, label="Predicted")
     start, = plt.plot([-0.5], [0.0], marker='*',
@@ -327,3 +448,11 @@ class GaussianProcessAgent(object):
     plt.title('Trajectory')
 
     plt.show()
+
+
+def _grid(supports):
+  ''' Cartesian product of 1-D supports as an array of points, with the first
+      dimension varying fastest.
+  '''
+  points = np.array(list(itertools.product(*reversed(supports))))
+  return np.ascontiguousarray(points[:, ::-1])
@@ -0,0 +1,225 @@
+"""
+Analytic moment matching of Gaussian state distributions through the learned
+GP dynamics, as in PILCO (Deisenroth & Rasmussen, 2011; gp0.m in the PILCO
+toolbox used by pilco_triple_pendulum/).
+
+Each dynamics GP maps a (state, action) input to one dimension of the next
+state and has a ConstantKernel * RBF (ARD) + WhiteKernel covariance. Given a
+Gaussian over the input, the mean and covariance of the next state have closed
+forms, so a whole trajectory of state distributions can be predicted without
+sampling rollouts.
+"""
+
+import numpy as np
+from scipy.linalg import cho_solve
+
+
+class MomentMatchingDynamics(object):
+  ''' Propagates Gaussian state distributions through a set of dynamics GPs.
+      The per-GP quantities (training inputs, K^-1 y, K^-1 and
+      hyperparameters) are extracted once, so repeated steps along a horizon
+      only do the distribution dependent work, vectorised over a batch of
+      distributions.
+
+      # Params
+        gp_dynamics ([GaussianProcessRegressor]): Fitted GPs, one per state
+            dimension, with ConstantKernel * RBF + WhiteKernel kernels.
+  '''
+  def __init__(self, gp_dynamics):
+    self._gps = [_unpack_gp(gp) for gp in gp_dynamics]
+    self.state_dim = len(self._gps)
+    self.input_dim = self._gps[0]['inputs'].shape[1]
+
+  def step(self, means, covs):
+    ''' Moment match the next state distribution for a batch of Gaussian
+        input distributions.
+
+      # Params
+        means: Input means, dimension [B, input_dim]
+        covs: Input covariances, dimension [B, input_dim, input_dim]
+
+      # Returns
+        means: Next state means, dimension [B, state_dim]
+        covs: Next state covariances, dimension [B, state_dim, state_dim]
+    '''
+    batch_size = means.shape[0]
+    eye = np.eye(self.input_dim)
+    next_means = np.zeros((batch_size, self.state_dim))
+    next_covs = np.zeros((batch_size, self.state_dim, self.state_dim))
+
+    # Training inputs relative to each input mean, [B, N, input_dim]
+    diffs = [gp['inputs'][np.newaxis] - means[:, np.newaxis] for gp in self._gps]
+    # Log of the kernel between each training input and the input mean
+    log_k = []
+
+    for a, gp in enumerate(self._gps):
+      scaled = diffs[a] / gp['lengths']
+      B = covs / np.outer(gp['lengths'], gp['lengths']) + eye
+      t = np.linalg.solve(B, scaled.transpose(0, 2, 1)).transpose(0, 2, 1)
+      l = np.exp(-0.5 * np.sum(scaled * t, axis=2))
+      c = gp['signal_var'] / np.sqrt(np.linalg.det(B))
+      next_means[:, a] = c * l.dot(gp['beta'])
+      log_k.append(np.log(gp['signal_var'])
+                   - 0.5 * np.sum(np.square(scaled), axis=2))
+
+    for a, gp_a in enumerate(self._gps):
+      ii = diffs[a] / np.square(gp_a['lengths'])
+      for b in range(a, self.state_dim):
+        gp_b = self._gps[b]
+        ij = diffs[b] / np.square(gp_b['lengths'])
+
+        R = covs * (1 / np.square(gp_a['lengths'])
+                    + 1 / np.square(gp_b['lengths'])) + eye
+        half_R_inv_S = np.linalg.solve(R, covs) / 2
+
+        # (ii_n + ij_m)^T R^-1 S / 2 (ii_n + ij_m), expanded so the
+        # [B, N, N] result is built from [B, N, input_dim] products
+        ii_Q = np.matmul(ii, half_R_inv_S)
+        ij_Q = np.matmul(ij, half_R_inv_S)
+        maha = np.sum(ii_Q * ii, axis=2)[:, :, np.newaxis] \
+            + np.sum(ij_Q * ij, axis=2)[:, np.newaxis, :] \
+            + 2 * np.matmul(ii_Q, ij.transpose(0, 2, 1))
+        L = np.exp(log_k[a][:, :, np.newaxis] + log_k[b][:, np.newaxis, :]
+                   + maha)
+        t = 1 / np.sqrt(np.linalg.det(R))
+
+        cov = t * np.einsum('n,bnm,m->b', gp_a['beta'], L, gp_b['beta'])
+        if a == b:
+          cov += gp_a['signal_var'] + gp_a['noise_var'] \
+              - t * np.sum(gp_a['K_inv'] * L, axis=(1, 2))
+        next_covs[:, a, b] = cov
+        next_covs[:, b, a] = cov
+
+    next_covs -= next_means[:, :, np.newaxis] * next_means[:, np.newaxis, :]
+
+    # Undo any target normalisation applied by the regressor
+    y_means = np.array([gp['y_mean'] for gp in self._gps])
+    y_stds = np.array([gp['y_std'] for gp in self._gps])
+    next_means = next_means * y_stds + y_means
+    next_covs = next_covs * np.outer(y_stds, y_stds)
+
+    return next_means, next_covs
+
+  def propagate(self, means, covs, policy, horizon):
+    ''' Predict the state distributions along a trajectory.
+
+      # Params
+        means: Initial state means, dimension [B, state_dim]
+        covs: Initial state covariances, dimension [B, state_dim, state_dim]
+        policy: Callable policy(t, means, covs) returning the action mean
+            [B, action_dim], action covariance [B, action_dim, action_dim] and
+            state-action cross covariance [B, state_dim, action_dim].
+        horizon (int): The number of steps to predict.
+
+      # Returns
+        means: State means, dimension [horizon+1, B, state_dim]
+        covs: State covariances, dimension
+            [horizon+1, B, state_dim, state_dim]
+    '''
+    means = np.atleast_2d(np.asarray(means, dtype=np.float64))
+    covs = np.asarray(covs, dtype=np.float64).reshape(
+        (means.shape[0], self.state_dim, self.state_dim))
+
+    all_means = [means]
+    all_covs = [covs]
+
+    for t in range(horizon):
+      act_means, act_covs, cross_covs = policy(t, means, covs)
+      joint_means = np.concatenate([means, act_means], axis=1)
+      joint_covs = np.concatenate([
+          np.concatenate([covs, cross_covs], axis=2),
+          np.concatenate([cross_covs.transpose(0, 2, 1), act_covs], axis=2)],
+                                  axis=1)
+
+      means, covs = self.step(joint_means, joint_covs)
+      # Symmetrise to stop round off accumulating over long horizons
+      covs = 0.5 * (covs + covs.transpose(0, 2, 1))
+      all_means.append(means)
+      all_covs.append(covs)
+
+    return np.stack(all_means), np.stack(all_covs)
+
+
+class LinearPolicy(object):
+  ''' Linear state feedback u = K x + b. A Gaussian state distribution maps to
+      a Gaussian action distribution exactly. No saturation is applied.
+
+      # Params
+        gain: The feedback matrix K, dimension [action_dim, state_dim]
+        offset: The offset b, dimension [action_dim]
+  '''
+  def __init__(self, gain, offset):
+    self._gain = np.atleast_2d(gain)
+    self._offset = np.asarray(offset, dtype=np.float64)
+
+  def __call__(self, t, means, covs):
+    cross_covs = np.matmul(covs, self._gain.T)
+    act_means = means.dot(self._gain.T) + self._offset
+    act_covs = np.matmul(self._gain, cross_covs)
+    return act_means, act_covs, cross_covs
+
+
+class OpenLoopPolicy(object):
+  ''' A fixed sequence of actions, shared by every distribution in the batch.
+
+      # Params
+        actions: The actions at each step, dimension [horizon, action_dim]
+  '''
+  def __init__(self, actions):
+    self._actions = np.atleast_2d(actions)
+
+  def __call__(self, t, means, covs):
+    batch_size, state_dim = means.shape
+    action_dim = self._actions.shape[1]
+    act_means = np.tile(self._actions[t], (batch_size, 1))
+    act_covs = np.zeros((batch_size, action_dim, action_dim))
+    cross_covs = np.zeros((batch_size, state_dim, action_dim))
+    return act_means, act_covs, cross_covs
+
+
+def expected_reward(means, covs, target, length_scale):
+  ''' Expectation of the Gaussian reward exp(-|x - target|^2 / 2l^2), scaled to
+      a peak of one as in GaussianProcessAgent.expected_reward, under Gaussian
+      state distributions with full covariances.
+
+    # Params
+      means: State means, dimension [..., state_dim]
+      covs: State covariances, dimension [..., state_dim, state_dim]
+      target: The target state, dimension [state_dim]
+      length_scale (float): The length scale of the reward.
+
+    # Returns
+      rewards: Expected rewards, dimension [...]
+  '''
+  state_dim = means.shape[-1]
+  reward_cov = np.square(length_scale) * np.eye(state_dim)
+  total_covs = covs + reward_cov
+  diffs = (means - target)[..., np.newaxis]
+  maha = np.sum(diffs * np.linalg.solve(total_covs, diffs), axis=(-2, -1))
+  return np.sqrt(np.linalg.det(reward_cov) / np.linalg.det(total_covs)) \
+      * np.exp(-0.5 * maha)
+
+
+def _unpack_gp(gp):
+  kernel = gp.kernel_
+  try:
+    signal_var = kernel.k1.k1.constant_value
+    lengths = kernel.k1.k2.length_scale
+    noise_var = kernel.k2.noise_level
+  except AttributeError:
+    raise ValueError('Moment matching needs ConstantKernel * RBF + '
+                     'WhiteKernel dynamics GPs, got {}'.format(kernel))
+
+  inputs = np.asarray(gp.X_train_, dtype=np.float64)
+  lengths = np.asarray(lengths, dtype=np.float64) * np.ones(inputs.shape[1])
+
+  return {
+      'inputs': inputs,
+      'beta': np.asarray(gp.alpha_, dtype=np.float64).reshape((-1,)),
+      'K_inv': cho_solve((gp.L_, True), np.eye(gp.L_.shape[0])),
+      'signal_var': signal_var,
+      'lengths': lengths,
+      'noise_var': noise_var,
+      'y_mean': float(np.squeeze(getattr(gp, '_y_train_mean', 0.0))),
+      'y_std': float(np.squeeze(getattr(gp, '_y_train_std', 1.0))),
+  }
@@ -1,22 +1,55 @@
-from gym_environment import Continuous_MountainCarEnv
-from gaussian_process_agent import GaussianProcessAgent
 from time import sleep
 
 import argparse
+import numpy as np
+
+MOUNTAIN_CAR = 'mountain_car'
+TRIPLE_PENDULUM = 'triple_pendulum'
 
 
 def main():
   parser = argparse.ArgumentParser(
       description='Uses Gaussian Process techniques to solve the \
-      Mountain Car reinforcement learning task.')
+      Mountain Car or triple pendulum reinforcement learning tasks.')
+  parser.add_argument(
+      '--env', choices=[MOUNTAIN_CAR, TRIPLE_PENDULUM], default=MOUNTAIN_CAR,
+      help='the task to solve (default: {0})'.format(MOUNTAIN_CAR))
   parser.add_argument(
       '--visualise', action='store_true',
       help='whether to visualise the graphs (default: False)')
+  parser.add_argument(
+      '--value_reoptimise_every', type=int, default=None,
+      help='re-optimise the value function hyperparameters every n sweeps \
+      (default: keep the hyperparameters from the first fit)')
 
   args = parser.parse_args()
 
-  env = Continuous_MountainCarEnv(gaussian_reward_scale=0.05)
-  agent = GaussianProcessAgent(env, args.visualise)
+  # Imported once the arguments are parsed, so --help does not wait for
+  # scipy and sklearn
+  from gym_environment import Continuous_MountainCarEnv
+  from gaussian_process_agent import GaussianProcessAgent
+  from triple_pendulum_environment import TriplePendulumEnv, MAX_TORQUE
+
+  if args.env == TRIPLE_PENDULUM:
+    env = TriplePendulumEnv()
+    # A coarse 3 point grid per dimension keeps the 6-D support set at 729
+    # states and the joint torque grid at 27 actions.
+    velocity_support = np.linspace(-10, 10, num=3)
+    angle_support = np.linspace(-np.pi, np.pi, num=3)
+    torque_support = np.linspace(-MAX_TORQUE, MAX_TORQUE, num=3)
+    agent = GaussianProcessAgent(
+        env, args.visualise,
+        value_reoptimise_every=args.value_reoptimise_every,
+        state_supports=[velocity_support] * 3 + [angle_support] * 3,
+        action_supports=[torque_support] * 3,
+        target=env._goal_state, reward_length_scale=1.0,
+        num_dynamics_examples=300,
+        support_values_file='support_values_triple_pendulum')
+  else:
+    env = Continuous_MountainCarEnv(gaussian_reward_scale=0.05)
+    agent = GaussianProcessAgent(
+        env, args.visualise,
+        value_reoptimise_every=args.value_reoptimise_every)
 
   agent.learn()
   env.reset()
@@ -0,0 +1,311 @@
+"""
+Triple pendulum swing-up with a torque actuator at every joint, ported from
+the PILCO scenario in pilco_triple_pendulum/ (dynamics_tp.m, settings_tp.m and
+loss_tp.m).
+
+The state is ordered as in the MATLAB code:
+  dt1, dt2, dt3:  angular velocities of the inner, middle and outer link
+  t1, t2, t3:     angles of the inner, middle and outer link, 0 is upright
+
+All of the physics is written for batches of states, dimension [N, 6], so the
+same code drives the single gym environment and the vectorised one.
+"""
+
+import gym
+from gym import spaces
+from gym.utils import seeding
+import numpy as np
+
+MASSES = (0.5, 0.5, 0.5)        # [kg]     mass of each link
+FRICTIONS = (0.0, 0.0, 0.0)     # [Ns/m]   coefficient of friction of each joint
+LENGTHS = (0.5, 0.5, 0.5)       # [m]      length of each link
+G = 9.81                        # [m/s^2]  acceleration of gravity
+
+DT = 0.05                       # [s] sampling time
+HORIZON = 60                    # steps per episode, ceil(T/dt) for T = 3s
+# Runge-Kutta steps per time step. The swing-up is chaotic, so 1ms steps are
+# needed to stay within ~1e-4 rad of a tight-tolerance ode45 trajectory over a
+# full episode; fewer substeps trade accuracy for throughput.
+SUBSTEPS = 50
+MAX_TORQUE = 3.0                # [Nm] max. amplitude of each torque
+INITIAL_MEAN = np.array([0, 0, 0, np.pi, np.pi, np.pi])
+INITIAL_STD_DEV = np.array([0.1, 0.1, 0.1, 0.01, 0.01, 0.01])
+TARGET_STATE = np.zeros(6)
+COST_WIDTH = 0.75
+
+
+def dynamics(states, torques):
+  ''' Time derivatives of a batch of states under constant torques. A
+      vectorised port of dynamics_tp.m.
+
+    # Params
+      states: Array of states, dimension [N, 6]
+      torques: Array of torques applied at each joint, dimension [N, 3]
+
+    # Returns
+      dz: Time derivatives of the states, dimension [N, 6]
+  '''
+  m1, m2, m3 = MASSES
+  b1, b2, b3 = FRICTIONS
+  l1, l2, l3 = LENGTHS
+  I1, I2, I3 = m1*l1**2/12, m2*l2**2/12, m3*l3**2/12
+
+  dt1, dt2, dt3, t1, t2, t3 = states.T
+  f1, f2, f3 = torques.T
+
+  c21, c31, c32 = np.cos(t2-t1), np.cos(t3-t1), np.cos(t3-t2)
+  s21, s31, s32 = np.sin(t2-t1), np.sin(t3-t1), np.sin(t3-t2)
+
+  # The mass matrix A is symmetric with a constant diagonal
+  a00 = (0.25*m1+m2+m3)*l1**2+I1
+  a11 = I2+l2**2*(0.25*m2+m3)
+  a22 = 0.25*m3*l3**2+I3
+  a01 = l1*l2*c21*(0.5*m2+m3)
+  a02 = 0.5*m3*l1*l3*c31
+  a12 = 0.5*m3*l2*l3*c32
+
+  r0 = f1 - b1*dt1 + l1*l2*dt2*(dt2-dt1)*s21*(0.5*m2+m3) \
+      + 0.5*m3*l1*l3*dt3*(dt3-dt1)*s31 \
+      + l1*l2*dt1*dt2*s21*(0.5*m2+m3) + 0.5*m3*l1*l3*dt1*dt3*s31 \
+      + G*l1*np.sin(t1)*(0.5*m1+m2+m3)
+  r1 = f2 - b2*dt2 + l1*l2*dt1*(dt2-dt1)*s21*(m3+0.5*m2) \
+      + 0.5*m3*l2*l3*dt3*(dt3-dt2)*s32 \
+      - l1*l2*dt1*dt2*s21*(0.5*m2+m3) + 0.5*m3*l2*l3*dt2*dt3*s32 \
+      + G*l2*np.sin(t2)*(0.5*m2+m3)
+  r2 = f3 - b3*dt3 \
+      + 0.5*m3*(G*l3*np.sin(t3) - l1*l3*dt1*dt3*s31 - l2*l3*dt2*dt3*s32) \
+      + 0.5*m3*(l1*l3*dt1*(dt3-dt1)*s31 + l2*l3*dt2*(dt3-dt2)*s32)
+
+  # Solve A x = r with the adjugate of A, which for a batch of 3x3 systems is
+  # much cheaper than a batched np.linalg.solve
+  c00 = a11*a22 - a12*a12
+  c01 = a02*a12 - a01*a22
+  c02 = a01*a12 - a02*a11
+  c11 = a00*a22 - a02*a02
+  c12 = a01*a02 - a00*a12
+  c22 = a00*a11 - a01*a01
+  det = a00*c00 + a01*c01 + a02*c02
+
+  dz = np.empty_like(states)
+  dz[:, 0] = (c00*r0 + c01*r1 + c02*r2) / det
+  dz[:, 1] = (c01*r0 + c11*r1 + c12*r2) / det
+  dz[:, 2] = (c02*r0 + c12*r1 + c22*r2) / det
+  dz[:, 3:] = states[:, :3]
+
+  return dz
+
+
+def integrate(states, torques, dt=DT, substeps=SUBSTEPS):
+  ''' Advance a batch of states by dt with the torques held constant
+      (zero-order hold), using fixed step fourth order Runge-Kutta.
+
+    # Params
+      states: Array of states, dimension [N, 6]
+      torques: Array of torques, dimension [N, 3]
+      dt (float): The time to integrate over.
+      substeps (int): The number of Runge-Kutta steps to split dt into.
+
+    # Returns
+      states: The states after dt, dimension [N, 6]
+  '''
+  h = dt / substeps
+  z = np.array(states, dtype=np.float64)
+  torques = np.asarray(torques, dtype=np.float64)
+
+  for _ in range(substeps):
+    k1 = dynamics(z, torques)
+    k2 = dynamics(z + 0.5*h*k1, torques)
+    k3 = dynamics(z + 0.5*h*k2, torques)
+    k4 = dynamics(z + h*k3, torques)
+    z = z + h/6*(k1 + 2*k2 + 2*k3 + k4)
+
+  return z
+
+
+def tip_positions(states):
+  ''' Cartesian position of the tip of the outer link, dimension [N, 2]. '''
+  l1, l2, l3 = LENGTHS
+  t1, t2, t3 = states[:, 3], states[:, 4], states[:, 5]
+  x = l1*np.sin(t1) + l2*np.sin(t2) + l3*np.sin(t3)
+  y = l1*np.cos(t1) + l2*np.cos(t2) + l3*np.cos(t3)
+  return np.stack([x, y], axis=1)
+
+
+def loss(states, target=TARGET_STATE, width=COST_WIDTH):
+  ''' Saturating loss 1-exp(-0.5*d^2/width^2) from loss_tp.m, evaluated at a
+      batch of (deterministic) states, where d is the distance between the tip
+      of the outer link and its position in the target state.
+
+    # Params
+      states: Array of states, dimension [N, 6]
+      target: The target state, dimension [6]
+      width (float): The width of the cost.
+
+    # Returns
+      loss: Array of losses in [0, 1), dimension [N]
+  '''
+  target_tip = tip_positions(np.asarray(target).reshape((1, 6)))
+  d_squared = np.sum(np.square(tip_positions(states) - target_tip), axis=1)
+  return 1 - np.exp(-0.5 * d_squared / width**2)
+
+
+class TriplePendulumEnv(gym.Env):
+  ''' Gym environment for the triple pendulum swing-up. The reward is one
+      minus the saturating loss, so it lies in (0, 1] and peaks at the upright
+      target. Episodes end after HORIZON steps.
+  '''
+  metadata = {
+      'render.modes': ['human', 'rgb_array'],
+      'video.frames_per_second': int(1/DT)
+  }
+
+  def __init__(self, t_step=DT, substeps=SUBSTEPS, horizon=HORIZON):
+    self._t_step = t_step
+    self._substeps = substeps
+    self._horizon = horizon
+    self._max_torque = MAX_TORQUE
+    self._goal_state = TARGET_STATE
+    self._last_action = np.zeros(3)
+    self._viewer = None
+
+    self.action_space = spaces.Box(
+        low=-self._max_torque, high=self._max_torque, shape=(3,),
+        dtype=np.float32)
+    high = np.full(6, np.inf)
+    self.observation_space = spaces.Box(low=-high, high=high,
+                                        dtype=np.float32)
+
+    self.seed()
+    self.reset()
+
+  def seed(self, seed=None):
+    self._np_random, seed = seeding.np_random(seed)
+    return [seed]
+
+  def step(self, action):
+    action = np.clip(np.reshape(action, (1, 3)),
+                     -self._max_torque, self._max_torque)
+    self._last_action = action[0]
+
+    state = integrate(self._state.reshape((1, 6)), action,
+                      dt=self._t_step, substeps=self._substeps)
+    self._state = state[0]
+    self._num_steps += 1
+
+    reward = 1 - loss(state)[0]
+    done = self._num_steps >= self._horizon
+
+    return self._state, reward, done, {}
+
+  def reset(self, state=None):
+    if state is None:
+      self._state = INITIAL_MEAN \
+          + INITIAL_STD_DEV * self._np_random.standard_normal(6)
+    else:
+      self._state = np.array(state, dtype=np.float64)
+    self._num_steps = 0
+    return self._state
+
+  def get_state(self):
+    return self._state
+
+  def render(self, mode='human'):
+    screen_size = 500
+    bound = 1.1 * sum(LENGTHS)
+
+    if self._viewer is None:
+      from gym.envs.classic_control import rendering
+      self._viewer = rendering.Viewer(screen_size, screen_size)
+      self._viewer.set_bounds(-bound, bound, -bound, bound)
+
+    from gym.envs.classic_control import rendering
+    joints = np.zeros((4, 2))
+    for i, (length, angle) in enumerate(zip(LENGTHS, self._state[3:])):
+      joints[i+1] = joints[i] + length * np.array([-np.sin(angle),
+                                                   np.cos(angle)])
+
+    for i, length in enumerate(LENGTHS):
+      link = self._viewer.draw_line(tuple(joints[i]), tuple(joints[i+1]))
+      link.set_color(0.8, 0.3, 0.3)
+      joint = self._viewer.draw_circle(0.04)
+      joint.add_attr(rendering.Transform(translation=tuple(joints[i])))
+      joint.set_color(0.8, 0.8, 0)
+
+    return self._viewer.render(return_rgb_array=mode == 'rgb_array')
+
+  def close(self):
+    if self._viewer:
+      self._viewer.close()
+
+
+class TriplePendulumVecEnv(object):
+  ''' A batch of triple pendulums stepped together in one vectorised
+      integration, with the VecEnv interface of OpenAI baselines. Finished
+      environments are reset automatically and report the episode return and
+      length in info['episode'], as the baselines Monitor does.
+
+      # Params
+        num_envs (int): The number of pendulums.
+        seed (int): The random number generator seed.
+        substeps (int): Runge-Kutta steps per environment step.
+  '''
+  def __init__(self, num_envs, seed=None, substeps=SUBSTEPS,
+               horizon=HORIZON):
+    self.num_envs = num_envs
+    self._substeps = substeps
+    self._horizon = horizon
+    self._np_random, _ = seeding.np_random(seed)
+    self._actions = None
+
+    self.action_space = spaces.Box(
+        low=-MAX_TORQUE, high=MAX_TORQUE, shape=(3,), dtype=np.float32)
+    high = np.full(6, np.inf)
+    self.observation_space = spaces.Box(low=-high, high=high,
+                                        dtype=np.float32)
+
+    self.reset()
+
+  def reset(self):
+    self._states = self._initial_states(self.num_envs)
+    self._num_steps = np.zeros(self.num_envs, dtype=np.int64)
+    self._returns = np.zeros(self.num_envs)
+    return self._observations()
+
+  def step_async(self, actions):
+    self._actions = np.clip(np.reshape(actions, (self.num_envs, 3)),
+                            -MAX_TORQUE, MAX_TORQUE)
+
+  def step_wait(self):
+    self._states = integrate(self._states, self._actions,
+                             substeps=self._substeps)
+    self._num_steps += 1
+
+    rewards = 1 - loss(self._states)
+    self._returns += rewards
+    dones = self._num_steps >= self._horizon
+
+    infos = [{} for _ in range(self.num_envs)]
+    done_indices = np.flatnonzero(dones)
+    for i in done_indices:
+      infos[i]['episode'] = {'r': self._returns[i], 'l': self._num_steps[i]}
+
+    if done_indices.size > 0:
+      self._states[done_indices] = self._initial_states(done_indices.size)
+      self._num_steps[done_indices] = 0
+      self._returns[done_indices] = 0
+
+    return self._observations(), rewards.astype(np.float32), dones, infos
+
+  def step(self, actions):
+    self.step_async(actions)
+    return self.step_wait()
+
+  def close(self):
+    pass
+
+  def _initial_states(self, n):
+    return INITIAL_MEAN \
+        + INITIAL_STD_DEV * self._np_random.standard_normal((n, 6))
+
+  def _observations(self):
+    return self._states.astype(np.float32)
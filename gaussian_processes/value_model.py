@@ -0,0 +1,80 @@
+import numpy as np
+from scipy.linalg import cho_solve
+from sklearn.gaussian_process import GaussianProcessRegressor
+
+
+class IncrementalValueGP(object):
+  ''' A Gaussian process value function for value iteration, where the support
+      states stay fixed between sweeps and only the target values change.
+
+      The first fit optimises the kernel hyperparameters as normal. Later fits
+      on the same states reuse the Cholesky factor of the kernel matrix and
+      only recompute alpha_ = K^-1 v, which costs two triangular solves.
+
+      If reoptimise_every is set, the hyperparameters are re-optimised every
+      that many fits, warm-started from their current values. The new
+      factorisation is only adopted when the hyperparameters have moved.
+
+      # Params
+        kernel: The sklearn kernel used for the first fit.
+        alpha (float): Value added to the diagonal of the kernel matrix.
+        reoptimise_every (int): Re-optimise the hyperparameters every n fits.
+            None keeps the hyperparameters from the first fit.
+        theta_tolerance (float): The largest change in any log hyperparameter
+            that is still treated as no change.
+  '''
+  def __init__(self, kernel, alpha=0.01, reoptimise_every=None,
+               theta_tolerance=1e-3):
+    self._kernel = kernel
+    self._alpha = alpha
+    self._reoptimise_every = reoptimise_every
+    self._theta_tolerance = theta_tolerance
+    self._num_fits = 0
+
+    self.gp = None
+    # Set when the last fit changed L_, so callers can refresh anything they
+    # have derived from the kernel matrix.
+    self.factorisation_changed = False
+
+  def fit(self, states, values):
+    ''' Fit the value function to values at the support states.
+
+      # Params
+        states: Support states, dimension [n_states, state_dim]
+        values: Target values, dimension [n_states, 1]
+
+      # Returns
+        gp: The fitted GaussianProcessRegressor.
+    '''
+    states_changed = self.gp is None \
+        or not np.array_equal(states, self.gp.X_train_)
+    reoptimise = self._reoptimise_every is not None \
+        and self._num_fits % self._reoptimise_every == 0
+
+    if states_changed:
+      self.gp = self._optimise(self._kernel, states, values)
+      self.factorisation_changed = True
+    elif reoptimise:
+      gp = self._optimise(self.gp.kernel_, states, values)
+      theta_change = np.max(np.abs(gp.kernel_.theta - self.gp.kernel_.theta))
+      if theta_change > self._theta_tolerance:
+        self.gp = gp
+        self.factorisation_changed = True
+      else:
+        self._update_targets(values)
+        self.factorisation_changed = False
+    else:
+      self._update_targets(values)
+      self.factorisation_changed = False
+
+    self._num_fits += 1
+    return self.gp
+
+  def _optimise(self, kernel, states, values):
+    gp = GaussianProcessRegressor(kernel=kernel, alpha=self._alpha)
+    return gp.fit(states, values)
+
+  def _update_targets(self, values):
+    values = np.array(values, dtype=np.float64)
+    self.gp.y_train_ = values
+    self.gp.alpha_ = cho_solve((self.gp.L_, True), values)
@@ -0,0 +1,32 @@
+%% record_trajectory_tp.m
+% *Summary:* Script to record a reference trajectory of the triple pendulum
+% under random piecewise constant torques, for checking the Python port in
+% gaussian_processes/triple_pendulum_environment.py with
+%
+%   python benchmark_triple_pendulum.py --recording triple_pendulum_trajectory.csv
+%
+%% High-Level Steps
+% # Load parameters
+% # Integrate dynamics_tp with a zero-order hold on the torques
+% # Write (t, state, torques) rows to a CSV file
+
+%% Code
+
+% 1. Initialization
+settings_tp;                              % load scenario-specific settings
+U = 2*max(policy.maxU)*rand(H, 3) - max(policy.maxU);   % random torques
+z = mu0;
+opts = odeset('RelTol', 1e-10, 'AbsTol', 1e-10);
+
+% 2. Integrate with the torques held constant over each time step
+out = zeros(H+1, 10);
+out(1,:) = [0, z', U(1,:)];
+for i = 1:H
+  f1 = @(t) U(i,1); f2 = @(t) U(i,2); f3 = @(t) U(i,3);
+  [~, zs] = ode45(@(t, z) dynamics_tp(t, z, f1, f2, f3), [0 dt/2 dt], z, opts);
+  z = zs(end,:)';
+  out(i+1,:) = [i*dt, z', U(min(i+1, H),:)];
+end
+
+% 3. Save
+csvwrite('triple_pendulum_trajectory.csv', out);
@@ -1,15 +1,20 @@
 import math
-import tensorflow as tf
+import os
+import sys
 import numpy as np
-import matplotlib
-# matplotlib.use('AGG')
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 
-import matplotlib.animation as animation
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'a2c'))
+from metrics_log import MetricsLogReader
 
+# matplotlib is imported by each plot, so importing this module (e.g. to
+# queue render_pipeline.py jobs) does not load it
 
-def gaussian_reward():
+# More points than a figure has pixels across only slow the plot down
+MAX_PLOT_POINTS = 5000
+
+
+def gaussian_reward(output_path='gaussian_reward.png', dpi=300):
+  import matplotlib.pyplot as plt
   from scipy.stats import multivariate_normal
   X, X_DOT = np.meshgrid(np.linspace(-1, 1, num=250),
                          np.linspace(-2, 2, num=250))
@@ -23,10 +28,11 @@ def gaussian_reward():
   plt.xlim([-1, 1])
   plt.ylim([-2, 2])
   plt.title("Reward Function")
-  plt.savefig("gaussian_reward.png", dpi=300)
+  _finish(plt.gcf(), output_path, dpi)
 
 
-def hill():
+def hill(output_path=None, dpi=300):
+  import matplotlib.pyplot as plt
   x1 = np.linspace(-1, 0, num=150)
   x2 = np.linspace(0, 1, num=150)
   y1 = x1 * x1 + x1
@@ -47,282 +53,132 @@ def hill():
   plt.ylabel("height")
   plt.xlim([-1, 1])
   plt.ylim([-0.3, 0.5])
-  plt.show()
-
+  _finish(plt.gcf(), output_path, dpi)
 
-def entropy_plot():
-  import pandas as pd
-  entropy_csv = pd.read_csv('/Users/peterboothroyd/Downloads/entropy.csv')
-  data = entropy_csv.values
 
-  vals = data[:, 2]
-  t_steps = data[:, 1]*80
-
-  N = 10
-  averaged_vals = np.convolve(vals, np.ones((N,))/N, mode='same')
+def entropy_plot(log_dir, window=10, output_path=None, dpi=300):
+  import matplotlib.pyplot as plt
+  import matplotlib.ticker as ticker
+  steps, averaged_vals = _running_mean(log_dir, 'train', 'entropy', window)
 
   fig, ax = plt.subplots()
-  ax.plot(t_steps, averaged_vals)
+  ax.plot(steps, averaged_vals)
   ax.set_xlabel("Training Step")
   ax.set_ylabel("Entropy")
   ax.set_ylim(0, 1.5)
   ax.set_title('Collapsing Entropy during A2C Learning')
   ax.get_xaxis().set_major_formatter(ticker.FormatStrFormatter('%0.00e'))
-  plt.show()
-
-
-def pg_plot():
-  import pandas as pd
-  pg_loss_csv = pd.read_csv('/Users/peterboothroyd/Downloads/pg_loss.csv')
-  data = pg_loss_csv.values
+  _finish(fig, output_path, dpi)
 
-  vals = data[:, 2]
-  t_steps = data[:, 1]*80
 
-  N = 10
-  averaged_vals = np.convolve(vals, np.ones((N,))/N, mode='same')
+def pg_plot(log_dir, window=10, output_path=None, dpi=300):
+  import matplotlib.pyplot as plt
+  import matplotlib.ticker as ticker
+  steps, averaged_vals = _running_mean(log_dir, 'train', 'pg_loss', window)
 
   fig, ax = plt.subplots()
-  ax.plot(t_steps, averaged_vals)
+  ax.plot(steps, averaged_vals)
   ax.set_xlabel("Training Step")
   ax.set_ylabel("Policy Loss")
   ax.set_title('Destabilised Policy Loss during Entropy Collapse')
   ax.get_xaxis().set_major_formatter(ticker.FormatStrFormatter('%0.00e'))
-  plt.show()
-
-
-def return_plot():
-  import json
-  with open('/Users/peterboothroyd/Desktop/returns.json', 'r') as f:
-    jsn = json.load(f)
-    rewards = np.array(jsn['episode_rewards'])
-    print(rewards)
-    N = 100
-    averaged_rewards = np.convolve(rewards, np.ones((N,))/N, mode='valid')
-    t_steps = np.arange(0, len(averaged_rewards))
-
-    fig, ax = plt.subplots()
-    ax.plot(t_steps, averaged_rewards)
-    ax.set_xlabel("Training Step")
-    ax.set_ylabel("Episode Return")
-    ax.set_title('Returns')
-    ax.get_xaxis().set_major_formatter(ticker.FormatStrFormatter('%0.00e'))
-    plt.show()
-
-
-def value_rollout_plot(values, probs, i):
-  np_vals = np.array(values)
+  _finish(fig, output_path, dpi)
 
-  num_frames = len(np_vals)
 
-  vid_length = 24
-  t_steps = np.linspace(0, 21, num=num_frames)
+def return_plot(log_dir, window=100, output_path=None, dpi=300):
+  import matplotlib.pyplot as plt
+  import matplotlib.ticker as ticker
+  steps, averaged_rewards = _running_mean(
+      log_dir, 'episodes', 'episode_return', window)
 
-  # PLOT VALUE FUNCTION
-  # fig, ax = plt.subplots()
-  # ax.plot(t_steps, values)
-  # ax.set_xlabel("Training Step")
-  # ax.set_ylabel("Value")
-  # ax.set_title('Value During Rollout')
-  # # ax.get_xaxis().set_major_formatter(ticker.FormatStrFormatter('%0.00e'))
-  # plt.savefig("/Users/peterboothroyd/Desktop/values{}.png".format(i), dpi=300)
-
-  # ANIMATE VALUES
-  fig, ax = plt.subplots()
-  line, = ax.plot(t_steps, values)
-  ax.set_xlabel("Time (s)")
-  ax.set_ylabel("Critic Output")
-  ax.set_title('Critic Output During Rollout')
-
-  def animate_val(i, x, y):
-    line.set_data(x[:i], y[:i])  # update the data
-    return line,
-
-  # line, = ax.plot([], [], 'o-', lw=2)
-  # time_template = 'time = %.1fs'
-  # time_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
-
-  Writer = animation.writers['ffmpeg']
-  writer = Writer(fps=30, metadata=dict(
-      artist='Peter Boothroyd'), bitrate=3600)
-
-  ani = animation.FuncAnimation(
-      fig, animate_val, num_frames, fargs=[t_steps, np_vals], interval=34.2,
-      blit=False)  # , init_func=init
-  ani.save("/Users/peterboothroyd/Desktop/value_animation{}.mp4".format(i), )
-
-  # ANIMATE ACTIONS
-  np_probs = np.squeeze(np.array(probs))
-  print('np_probs.shape', np_probs.shape)
-
-  num_actions = np_probs.shape[1]
-  plt.clf()
   fig, ax = plt.subplots()
-  ax.set_xlabel("Action")
-  ax.set_ylabel("Probability")
-  ax.set_ylim(0, 1)
-  ax.set_title('Actor Action Probabilities During Rollout')
-  ax.set_xticklabels(('', '', 'Noop', '', 'Fire', '', 'Right', '', 'Left', ''))
+  ax.plot(steps, averaged_rewards)
+  ax.set_xlabel("Training Step")
+  ax.set_ylabel("Episode Return")
+  ax.set_title('Returns')
+  ax.get_xaxis().set_major_formatter(ticker.FormatStrFormatter('%0.00e'))
+  _finish(fig, output_path, dpi)
+
 
-  # def barlist(n):
-  #   return [1.0/(n*k) for k in range(1, 4)]
+def _finish(fig, output_path, dpi):
+  import matplotlib.pyplot as plt
+  # Show the figure, or render it to output_path and free it, as figures
+  # rendered in a batch would otherwise accumulate
+  if output_path is None:
+    plt.show()
+  else:
+    fig.savefig(output_path, dpi=dpi)
+    plt.close(fig)
 
-  actions = range(0, num_actions)
-  barcollection = plt.bar(actions, np_probs[0])
 
-  def animate_act(i):
-    y = np_probs[i]
-    for n, b in enumerate(barcollection):
-      b.set_height(y[n])
+def _running_mean(log_dir, log_name, column, window):
+  # Reads the metrics log the A2C agent writes to <log_dir>/metrics, a chunk
+  # at a time, keeping about MAX_PLOT_POINTS points
+  reader = MetricsLogReader(os.path.join(log_dir, 'metrics', log_name))
+  return reader.running_mean(column, window, max_points=MAX_PLOT_POINTS)
 
-  ani = animation.FuncAnimation(
-      fig, animate_act, repeat=False, blit=False, frames=num_frames, interval=34.2)
 
-  ani.save("/Users/peterboothroyd/Desktop/action_animation{}.mp4".format(i))
+def value_rollout_plot(values, probs, i, output_dir='.', frames=None):
+  # One composited video of the frames, values and action probabilities,
+  # blitted straight into ffmpeg rather than redrawn with FuncAnimation
+  from rollout_video import write_rollout_video
+  write_rollout_video(
+      os.path.join(output_dir, 'rollout{}.mp4'.format(i)), values,
+      probs=probs, frames=frames)
 
 
-def conv_filters_plot():
+def conv_filters_plot(log_dir, step=None, tensor='^conv_1/kernel',
+                      output_path=None, dpi=100):
   """
-  Plots convolutional filters
-  :param weights: numpy array of rank 4
-  :param channels_all: boolean, optional
+  Plots the convolutional filters of a tensor in the weight history the A2C
+  agent records to <log_dir>/weights, as of the last snapshot at or before
+  step (the latest if None). Each filter is summed over its input channels.
   """
-  with tf.Session() as sess:
-    saver = tf.train.import_meta_graph(
-        '/Users/peterboothroyd/Documents/IIB/Project/Code/car_on_the_hill/archived_model_out/good_adamlr7e-4/model/model-62200.meta')
-    saver.restore(sess, tf.train.latest_checkpoint(
-        '/Users/peterboothroyd/Documents/IIB/Project/Code/car_on_the_hill/archived_model_out/good_adamlr7e-4/model/'))
-    graph = tf.get_default_graph()
-
-    conv_weights_tensor = graph.get_tensor_by_name('hidden/conv_1/kernel:0')
-    conv_weights = sess.run(conv_weights_tensor)
-
-    max_vals = np.sum(conv_weights, axis=2)
-
-    print('conv_weights.shape', conv_weights.shape)
-    print('max_vals.shape', max_vals.shape)
-
-    w_min = np.min(max_vals)
-    w_max = np.max(max_vals)
-
-    # get number of convolutional filters
-    num_filters = max_vals.shape[2]
-
-    # get number of grid rows and columns
-    grid_r, grid_c = 4, 4  # utils.get_grid_dim(num_filters)
-
-    # create figure and axes
-    fig, axes = plt.subplots(min([grid_r, grid_c]),
-                             max([grid_r, grid_c]))
-
-    # iterate filters inside every channel
-    for l, ax in enumerate(axes.flat):
-      # get a single filter
-      img = max_vals[:, :, l]
-      # put it on the grid
-      ax.imshow(img, vmin=w_min, vmax=w_max,
+  import matplotlib.pyplot as plt
+  from weight_history import WeightHistoryReader
+  history = WeightHistoryReader(os.path.join(log_dir, 'weights'))
+  snapshot_step, conv_weights = history.at(tensor, step)
+
+  max_vals = np.sum(conv_weights, axis=2)
+  w_min = np.min(max_vals)
+  w_max = np.max(max_vals)
+
+  # get number of convolutional filters and a square grid holding them
+  num_filters = max_vals.shape[2]
+  grid_size = int(math.ceil(math.sqrt(num_filters)))
+
+  fig, axes = plt.subplots(grid_size, grid_size, squeeze=False)
+  for l, ax in enumerate(axes.flat):
+    if l < num_filters:
+      ax.imshow(max_vals[:, :, l], vmin=w_min, vmax=w_max,
                 interpolation='nearest', cmap='seismic')
-      # remove any labels from the axes
-      ax.set_xticks([])
-      ax.set_yticks([])
-    # save figure
-    plt.savefig('./fig_out/{}.png'.format('conv_weights'), bbox_inches='tight')
-
-
-def embeddings_saver(embeddings, obs, sess):
-  from tensorboard.plugins import projector
-
-  # NUM_TO_VISUALISE = 1000
-
-  np_embeddings = np.squeeze(np.array(embeddings))#[:NUM_TO_VISUALISE]
-  np_obs = np.squeeze(np.array(obs, dtype=np.float32))
-  
-  print('embeddings.shape', np_embeddings.shape)
-  print('obs.shape', np_obs.shape, np_obs.dtype, np.amin(np_obs), np.amax(np_obs))
-
-  mult = np.array([0.25, 0.5, 0.75, 1.0])
-  np_obs = np.multiply(np_obs, mult)
-  print('obs.shape', np_obs.shape, np_obs.dtype, np.amin(np_obs), np.amax(np_obs))
-  np_obs_flattened = np.amax(np_obs, axis=3)#[:NUM_TO_VISUALISE]
-  print('np_obs_flattened.shape', np_obs_flattened.shape)
-
-  # TENSORBOARD VISUALISATION
-
-  # embedding_name = 'embedding'
-  out_path = './embed_out/'
-  image_name = 'sprite.png'
-
-  # embedding_var = tf.Variable(np_embeddings, name=embedding_name)
-  # sess.run(embedding_var.initializer)
-
-  # config = projector.ProjectorConfig()
-  # embedding = config.embeddings.add()
-  # embedding.tensor_name = embedding_name
-  # embedding.sprite.image_path = image_name
-  # embedding.sprite.single_image_dim.extend([np_obs.shape[1], np_obs.shape[2]])
-
-  # projector.visualize_embeddings(tf.summary.FileWriter(out_path), config)
-
-  # saver = tf.train.Saver({embedding_name: embedding_var})
-  # saver.save(sess, out_path+'model.ckpt')
-
-  # # Save obs to sprite
-  def create_sprite_image(images):
-    """ Returns a sprite image consisting of images passed as argument.
-        Images should be count x width x height
-    """
-    if isinstance(images, list):
-      images = np.array(images)
-    img_h = images.shape[1]
-    img_w = images.shape[2]
-    n_plots = int(np.ceil(np.sqrt(images.shape[0])))
-
-    spriteimage = np.ones((img_h * n_plots, img_w * n_plots))
-
-    for i in range(n_plots):
-      for j in range(n_plots):
-        this_filter = i * n_plots + j
-        if this_filter < images.shape[0]:
-          this_img = images[this_filter]
-          this_img = this_img / (np.amax(this_img) - np.amin(this_img))
-          plt.imsave(out_path+str(i * n_plots + j)+image_name, this_img, cmap='gray')
-          spriteimage[i * img_h:(i + 1) * img_h,
-                      j * img_w:(j + 1) * img_w] = this_img
-
-    return spriteimage
-
-  sprite = create_sprite_image(np_obs_flattened)
-  # plt.imsave(out_path+image_name, sprite, cmap='gray')
-
-  # SKLEARN PLOT
-  def plot_with_labels(low_dim_embs, labels, filename):
-    assert low_dim_embs.shape[0] >= len(labels), 'More labels than embeddings'
-    plt.figure(figsize=(18, 18))  # in inches
-    plt.axis('off')
-    for i, label in enumerate(labels):
-      x, y = low_dim_embs[i, :]
-      plt.scatter(x, y)
-      plt.annotate(
-          label,
-          xy=(x, y),
-          xytext=(5, 2),
-          textcoords='offset points',
-          ha='right',
-          va='bottom')
-    plt.savefig(filename)
-
-  try:
-    from sklearn.manifold import TSNE
-
-    tsne = TSNE(
-        perplexity=15, n_components=2, init='pca', n_iter=5000, method='exact')
-    plot_only = 500
-    low_dim_embs = tsne.fit_transform(np_embeddings[:plot_only, :])
-    plot_with_labels(low_dim_embs, np.arange(plot_only), './fig_out/tsne.png')
-
-  except ImportError as ex:
-    print('Please install sklearn, matplotlib, and scipy to show embeddings.')
-    print(ex)
+    # remove any labels from the axes
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_frame_on(l < num_filters)
+  fig.suptitle('{} at step {}'.format(history.resolve(tensor), snapshot_step))
+  _finish(fig, output_path, dpi)
+
+
+def embeddings_saver(embeddings, obs, sess=None, output_dir='.', values=None,
+                     max_points=20000):
+  # Streams the activations into a memory mapped store and embeds them with
+  # PCA and Barnes-Hut t-SNE, see embedding_analysis.py. sess is unused.
+  from embedding_analysis import EmbeddingStore, analyse_store
+
+  np_embeddings = np.reshape(np.asarray(embeddings), [len(embeddings), -1])
+  if values is None:
+    values = np.zeros(len(np_embeddings))
+  out_path = os.path.join(output_dir, 'embed_out')
+  # A fresh store, so embeddings saved earlier to output_dir are replaced
+  store = EmbeddingStore(out_path, capacity=len(np_embeddings), overwrite=True)
+  num_stored = store.append(np_embeddings, values, np.squeeze(np.asarray(obs)))
+  store.close()
+  if num_stored != len(np_embeddings):
+    raise ValueError('Stored {} of {} embeddings'.format(
+        num_stored, len(np_embeddings)))
+  analyse_store(store, out_path, max_points=max_points)
+
 
 if __name__ == "__main__":
-  return_plot()
+  return_plot(sys.argv[1])
@@ -0,0 +1,146 @@
+"""
+Headless, parallel rendering of report figures.
+
+Figure jobs are queued with RenderPipeline.submit and rendered together by
+run() on a pool of worker processes using the Agg backend, so no display is
+needed and the figures of many runs render concurrently. A job is any
+picklable plotting function accepting output_path and dpi keyword arguments,
+such as those in plots.py. Rollout videos are jobs too, their data passed
+by keyword so output_path stays free:
+
+  pipeline.submit(rollout_video.write_rollout_video, 'rollout0.mp4',
+                  values=values, probs=probs, frames=frames)
+
+Run as a script to render the training curves of many A2C runs:
+
+  python render_pipeline.py --runs model_out/run_a model_out/run_b \
+      --output_dir reports
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import time
+import traceback
+
+FigureJob = collections.namedtuple(
+    'FigureJob', ['fn', 'filename', 'args', 'kwargs'])
+JobResult = collections.namedtuple(
+    'JobResult', ['path', 'seconds', 'error'])
+
+# The figures rendered for each run by the script
+RUN_FIGURES = [
+    ('entropy_plot', 'entropy.png'),
+    ('pg_plot', 'pg_loss.png'),
+    ('return_plot', 'returns.png'),
+]
+
+
+class RenderPipeline(object):
+  ''' Renders queued figure jobs on a process pool.
+
+      # Params
+        output_dir (str): The directory figures are written to, created if
+            missing. Job filenames are relative to it.
+        num_workers (int): Worker processes, the number of cores by default.
+        dpi (int): The resolution of the rendered figures.
+  '''
+  def __init__(self, output_dir, num_workers=None, dpi=150):
+    self._output_dir = output_dir
+    self._num_workers = num_workers or multiprocessing.cpu_count()
+    self._dpi = dpi
+    self._jobs = []
+
+  def submit(self, fn, filename, *args, **kwargs):
+    ''' Queue fn(*args, output_path=<output_dir>/filename, dpi=dpi,
+        **kwargs). fn must be importable by the workers, e.g. a module level
+        function.
+    '''
+    self._jobs.append(FigureJob(fn, filename, args, kwargs))
+
+  def run(self):
+    ''' Render every queued job and clear the queue.
+
+      # Returns
+        results ([JobResult]): The output path, render seconds and the
+            traceback of a failed job (None on success) of each job, in
+            submission order.
+    '''
+    jobs, self._jobs = self._jobs, []
+    if not jobs:
+      return []
+
+    paths = [os.path.join(self._output_dir, job.filename) for job in jobs]
+    for directory in set(os.path.dirname(path) for path in paths):
+      if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Spawned workers import nothing from this process, so the backend is
+    # chosen before pyplot is first imported in each of them
+    context = multiprocessing.get_context('spawn')
+    num_workers = min(self._num_workers, len(jobs))
+    with concurrent.futures.ProcessPoolExecutor(
+        num_workers, mp_context=context, initializer=_use_agg) as executor:
+      futures = [executor.submit(_render, job, path, self._dpi)
+                 for job, path in zip(jobs, paths)]
+      return [future.result() for future in futures]
+
+
+def _use_agg():
+  import matplotlib
+  matplotlib.use('Agg')
+
+
+def _render(job, path, dpi):
+  start_time = time.time()
+  try:
+    job.fn(*job.args, output_path=path, dpi=dpi, **job.kwargs)
+    error = None
+  except Exception:  # pylint: disable=broad-except
+    error = traceback.format_exc()
+  return JobResult(path, time.time() - start_time, error)
+
+
+def main():
+  args = command_line_args()
+  import plots
+
+  pipeline = RenderPipeline(args.output_dir, args.num_workers, args.dpi)
+  for run_dir in args.runs:
+    run_name = os.path.basename(os.path.normpath(run_dir))
+    for fn_name, filename in RUN_FIGURES:
+      pipeline.submit(getattr(plots, fn_name),
+                      os.path.join(run_name, filename), run_dir)
+
+  start_time = time.time()
+  results = pipeline.run()
+  for result in results:
+    if result.error is not None:
+      print('Failed {}:\n{}'.format(result.path, result.error))
+  print('Rendered {} of {} figures in {:.1f}s'.format(
+      sum(result.error is None for result in results), len(results),
+      time.time() - start_time))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Renders the training curves of A2C runs headlessly on a \
+      process pool.')
+  parser.add_argument(
+      '--runs', type=str, nargs='+', required=True,
+      help='run directories containing metrics logs')
+  parser.add_argument(
+      '--output_dir', type=str, default='./fig_out',
+      help='the directory to write a subdirectory of figures per run to')
+  parser.add_argument(
+      '--num_workers', type=int, default=None,
+      help='worker processes, the number of cores by default')
+  parser.add_argument(
+      '--dpi', type=int, default=150, help='the resolution of the figures')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,291 @@
+"""
+Renders evaluation rollouts to video close to real time.
+
+Each video frame composites the game frame, the critic's value so far and the
+actor's action probabilities into one figure. The axes, labels and ticks are
+rasterised once; each frame restores that background and draws only the
+artists that change. The value curve never changes behind the current step,
+so it is accumulated into its own saved region one segment per frame instead
+of being redrawn from the start. The rendered RGBA buffer is written straight
+to the stdin of an ffmpeg process, with no intermediate image files.
+
+Run as a script to encode an episode saved with numpy.savez, holding values
+and optionally probs and frames arrays:
+
+  python rollout_video.py --episode episode.npz --output rollout.mp4
+"""
+
+import argparse
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+# The action meanings of Breakout, used to label four action policies
+BREAKOUT_ACTIONS = ('Noop', 'Fire', 'Right', 'Left')
+
+
+class FFmpegPipe(object):
+  ''' Encodes raw RGBA frames written to an ffmpeg subprocess.
+
+      # Params
+        output_path (str): The video file, its format chosen by the suffix.
+        width (int): The frame width in pixels.
+        height (int): The frame height in pixels.
+        fps (int): Frames per second.
+        bitrate (int): The target bitrate in kbit/s.
+        ffmpeg (str): The ffmpeg executable, found on the path if None.
+  '''
+  def __init__(self, output_path, width, height, fps=30, bitrate=3600,
+               ffmpeg=None):
+    ffmpeg = ffmpeg or _find_ffmpeg()
+    command = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgba',
+        '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+        # yuv420p needs even dimensions
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-b:v', '{}k'.format(bitrate), output_path]
+    self._frame_bytes = width * height * 4
+    self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+  def write(self, rgba):
+    ''' Append a frame, any buffer of height * width * 4 bytes. '''
+    buffer = memoryview(rgba).cast('B')
+    if buffer.nbytes != self._frame_bytes:
+      raise ValueError('Expected a frame of {} bytes, got {}'.format(
+          self._frame_bytes, buffer.nbytes))
+    self._process.stdin.write(buffer)
+
+  def close(self):
+    self._process.stdin.close()
+    if self._process.wait() != 0:
+      raise RuntimeError('ffmpeg exited with code {}'.format(
+          self._process.returncode))
+
+
+class RolloutRenderer(object):
+  ''' Draws composited rollout frames with blitting.
+
+      # Params
+        num_steps (int): The length of the rollout, fixing the time axis.
+        value_range ((float, float)): The limits of the value axis.
+        num_actions (int): The number of action probability bars, 0 for none.
+        frame_shape (tuple): The shape of the game frames, None for none.
+        fps (int): Frames per second, the time axis is in seconds.
+        action_names ([str]): The bar labels, Breakout's actions for four
+            actions and the action indices otherwise if None.
+        figsize ((float, float)): The figure size in inches.
+        dpi (int): Pixels per inch.
+  '''
+  def __init__(self, num_steps, value_range, num_actions=0, frame_shape=None,
+               fps=30, action_names=None, figsize=None, dpi=100):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    num_panels = 1 + bool(num_actions) + (frame_shape is not None)
+    self._fig = Figure(figsize=figsize or (4 * num_panels, 4), dpi=dpi)
+    self._canvas = FigureCanvasAgg(self._fig)
+    axes = list(self._fig.subplots(1, num_panels, squeeze=False)[0])
+    self._fps = float(fps)
+
+    self._image = None
+    if frame_shape is not None:
+      frame_ax = axes.pop(0)
+      frame_ax.set_axis_off()
+      self._image = frame_ax.imshow(
+          np.zeros(_display_shape(frame_shape), dtype=np.uint8),
+          cmap='gray', vmin=0, vmax=255, animated=True)
+
+    self._value_ax = axes.pop(0)
+    low, high = value_range
+    margin = 0.05 * (high - low) or 1.0
+    self._value_ax.set_xlim(0, max(num_steps - 1, 1) / self._fps)
+    self._value_ax.set_ylim(low - margin, high + margin)
+    self._value_ax.set_xlabel('Time (s)')
+    self._value_ax.set_ylabel('Critic Output')
+    self._value_ax.set_title('Critic Output During Rollout')
+    self._segment, = self._value_ax.plot([], [], color='C0', animated=True)
+    self._marker, = self._value_ax.plot([], [], 'o', color='C1',
+                                        animated=True)
+
+    self._bars = []
+    if num_actions:
+      probs_ax = axes.pop(0)
+      if action_names is None:
+        action_names = BREAKOUT_ACTIONS if num_actions == 4 \
+            else [str(a) for a in range(num_actions)]
+      self._bars = list(probs_ax.bar(
+          np.arange(num_actions), np.zeros(num_actions), animated=True))
+      probs_ax.set_xticks(np.arange(num_actions))
+      probs_ax.set_xticklabels(action_names)
+      probs_ax.set_ylim(0, 1)
+      probs_ax.set_xlabel('Action')
+      probs_ax.set_ylabel('Probability')
+      probs_ax.set_title('Action Probabilities')
+
+    self._fig.tight_layout()
+    # Animated artists are left out of a full draw, so this rasterises only
+    # the static parts of the figure
+    self._canvas.draw()
+    self._background = self._canvas.copy_from_bbox(self._fig.bbox)
+    self._curve = self._canvas.copy_from_bbox(self._value_ax.bbox)
+    self._last_point = None
+
+  @property
+  def size(self):
+    ''' The (width, height) of the frames in pixels. '''
+    width, height = self._canvas.get_width_height()
+    return int(width), int(height)
+
+  def render(self, step, value, probs=None, frame=None):
+    ''' Draw the frame of a step. Steps must be rendered in order.
+
+      # Returns
+        rgba (memoryview): The frame, height x width x 4 bytes, valid until
+            the next call.
+    '''
+    point = (step / self._fps, float(value))
+    canvas = self._canvas
+    canvas.restore_region(self._background)
+    canvas.restore_region(self._curve)
+
+    # Extend the saved curve by one segment, so drawing it stays constant
+    # time however long the rollout is
+    if self._last_point is not None:
+      self._segment.set_data(*zip(self._last_point, point))
+      self._value_ax.draw_artist(self._segment)
+      self._curve = canvas.copy_from_bbox(self._value_ax.bbox)
+    self._last_point = point
+
+    self._marker.set_data([point[0]], [point[1]])
+    self._value_ax.draw_artist(self._marker)
+
+    if self._bars and probs is not None:
+      for bar, prob in zip(self._bars, np.ravel(probs)):
+        bar.set_height(prob)
+        bar.axes.draw_artist(bar)
+
+    if self._image is not None and frame is not None:
+      self._image.set_data(_display_frame(frame))
+      self._image.axes.draw_artist(self._image)
+
+    canvas.blit(self._fig.bbox)
+    return canvas.buffer_rgba()
+
+  def reset(self):
+    ''' Clear the value curve to render another rollout of the same length.
+    '''
+    self._canvas.restore_region(self._background)
+    self._curve = self._canvas.copy_from_bbox(self._value_ax.bbox)
+    self._last_point = None
+
+
+def write_rollout_video(output_path, values, probs=None, frames=None, fps=30,
+                        action_names=None, dpi=100, bitrate=3600):
+  ''' Encode a rollout to a video, each frame showing the game frame, the
+      value curve so far and the action probabilities of a step.
+
+    # Params
+      output_path (str): The video file.
+      values: The critic's values, dimension (steps,)
+      probs: The action probabilities, dimension (steps, num_actions), or
+          None to leave out the bars.
+      frames: The observations or rendered frames, dimension
+          (steps, height, width[, channels]), or None to leave them out.
+          Frame stacked observations show their most recent frame.
+      fps (int): Frames per second.
+      action_names ([str]): The bar labels.
+      dpi (int): Pixels per inch of the 4 inch high frames.
+      bitrate (int): The target bitrate in kbit/s.
+
+    # Returns
+      seconds (float): The time spent rendering and encoding.
+  '''
+  start_time = time.time()
+  values = np.reshape(np.asarray(values, dtype=np.float64), [-1])
+  num_steps = values.shape[0]
+  if probs is not None:
+    probs = np.reshape(np.asarray(probs), [num_steps, -1])
+  if frames is not None:
+    frames = np.asarray(frames)
+
+  renderer = RolloutRenderer(
+      num_steps, (np.min(values), np.max(values)),
+      num_actions=0 if probs is None else probs.shape[1],
+      frame_shape=None if frames is None else frames.shape[1:],
+      fps=fps, action_names=action_names, dpi=dpi)
+  width, height = renderer.size
+  pipe = FFmpegPipe(output_path, width, height, fps=fps, bitrate=bitrate)
+  try:
+    for step in range(num_steps):
+      pipe.write(renderer.render(
+          step, values[step],
+          None if probs is None else probs[step],
+          None if frames is None else frames[step]))
+  finally:
+    pipe.close()
+  return time.time() - start_time
+
+
+def _display_shape(frame_shape):
+  if len(frame_shape) == 3 and frame_shape[-1] != 3:
+    return tuple(frame_shape[:2])
+  return tuple(frame_shape)
+
+
+def _display_frame(frame):
+  # Stacked grayscale observations show the newest frame, RGB frames as is
+  frame = np.asarray(frame)
+  if frame.ndim == 3 and frame.shape[-1] != 3:
+    frame = frame[..., -1]
+  if frame.dtype != np.uint8:
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+  return frame
+
+
+def _find_ffmpeg():
+  ffmpeg = shutil.which('ffmpeg')
+  if ffmpeg is None:
+    import matplotlib
+    ffmpeg = matplotlib.rcParams['animation.ffmpeg_path']
+  return ffmpeg
+
+
+def main():
+  args = command_line_args()
+  episode = np.load(args.episode)
+  seconds = write_rollout_video(
+      args.output, episode['values'],
+      probs=episode['probs'] if 'probs' in episode else None,
+      frames=episode['frames'] if 'frames' in episode else None,
+      fps=args.fps, dpi=args.dpi, bitrate=args.bitrate)
+  num_steps = np.size(episode['values'])
+  print('Encoded {} frames in {:.1f}s ({:.1f} frames/s)'.format(
+      num_steps, seconds, num_steps / max(seconds, 1e-6)))
+
+
+def command_line_args():
+  parser = argparse.ArgumentParser(
+      description='Renders the values, action probabilities and frames of a \
+      rollout to a video.')
+  parser.add_argument(
+      '--episode', type=str, required=True,
+      help='an .npz file of values and optionally probs and frames arrays')
+  parser.add_argument(
+      '--output', type=str, default='rollout.mp4',
+      help='the video file to write')
+  parser.add_argument(
+      '--fps', type=int, default=30, help='frames per second')
+  parser.add_argument(
+      '--dpi', type=int, default=100, help='pixels per inch of the frames')
+  parser.add_argument(
+      '--bitrate', type=int, default=3600,
+      help='the target bitrate in kbit/s')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,14 @@
-import tensorflow as tf
-import numpy as np
+import os
 import random
 
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import cm
-from matplotlib.ticker import LinearLocator, FormatStrFormatter
-import matplotlib.pyplot as plt
+import numpy as np
+
+# tensorflow and matplotlib are imported by the functions using them, so
+# importing utils for one helper does not load them all
 
 
 def set_global_seeds(i=1):
+  import tensorflow as tf
   tf.set_random_seed(i)
   np.random.seed(i)
   random.seed(i)
@@ -17,8 +17,12 @@ def plot(mean_rewards,
          std_dev_rewards,
          episode_lengths,
          summary_every,
-         dir_path):
+         dir_path,
+         dpi=300):
+  import matplotlib.pyplot as plt
+
   def plot_fig(series, name):
+    fig = plt.figure()
     mean = np.mean(series, axis=0)
     lower = np.percentile(series, 5, axis=0)
     upper = np.percentile(series, 95, axis=0)
@@ -29,15 +33,22 @@ def plot(mean_rewards,
     plt.xlabel("Episode")
     plt.ylabel(name)
     plt.title(name + ' vs. Episode Number')
-    save_name = dir_path + '_'.join(name.lower().split(' ')) + '.png'
-    plt.savefig(save_name, dpi=300)
-    plt.clf()
+    save_name = os.path.join(
+        dir_path, '_'.join(name.lower().split(' ')) + '.png')
+    fig.savefig(save_name, dpi=dpi)
+    plt.close(fig)
 
   plot_fig(mean_rewards, 'Mean Reward')
   plot_fig(std_dev_rewards, 'Standard Deviation Rewards')
   plot_fig(episode_lengths, 'Episode Lengths')
 
-def plot_value_func(estimator, episode, ob_space):
+def plot_value_func(estimator, episode, ob_space, output_dir='.', dpi=300):
+  import matplotlib.pyplot as plt
+  from matplotlib import cm
+  from matplotlib.ticker import LinearLocator, FormatStrFormatter
+  # Registers the 3d projection
+  from mpl_toolkits.mplot3d import Axes3D  # pylint: disable=unused-import
+
   def plot(vals, x1, x2, name):
     plt.clf()
     fig = plt.figure()
@@ -52,12 +63,14 @@ def plot_value_func(estimator, episode, ob_space):
 
     # Add a color bar which maps values to colors.
     fig.colorbar(surf, shrink=0.5, aspect=5)
-    plt.savefig("{0}_surface_{1}.png".format(name, episode), dpi=300)
+    plt.savefig(os.path.join(
+        output_dir, "{0}_surface_{1}.png".format(name, episode)), dpi=dpi)
 
     plt.clf()
     contour = plt.contourf(x_grid, x_dot_grid, predicted_vals)
     plt.colorbar(contour, shrink=0.5)
-    plt.savefig("{0}_contour_{1}.png".format(name, episode), dpi=300)
+    plt.savefig(os.path.join(
+        output_dir, "{0}_contour_{1}.png".format(name, episode)), dpi=dpi)
 
     plt.close()
 